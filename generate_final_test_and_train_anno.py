@@ -1,9 +1,15 @@
 """
 This is used to generate the final train and test annotations.
 It is used to combine the action classes
+If the annotation store (global_settings -> annotation_store, default annotations.db in the root dir)
+is available, the classes are combined with a query on the store, otherwise train.txt and test.txt are parsed
 """
 
 import os
+import json
+
+from lib.utils.annotation_store import AnnotationStore
+from lib.utils import utils
 
 LABEL_MATCHER = {
     # KTH Labels
@@ -71,7 +77,22 @@ TUBELET_LABELS =["WALKING", "RUNNING", "SITTING",
                  "USING_PHONE"]
 
 
-def main(root_dir):
+def get_configured_store_path(config_file="generator_config.json") :
+    """ annotation store path of the generator config (None -> default path) """
+    if not os.path.isfile(config_file) :
+        return None
+    with open(config_file) as fd :
+        return json.load(fd)["global_settings"].get("annotation_store", None)
+
+def main(root_dir, db_path=None):
+    db_path = utils.get_annotation_store_path(root_dir, db_path)
+    if os.path.isfile(db_path) :
+        store = AnnotationStore(db_path)
+        store.set_label_matcher(LABEL_MATCHER)
+        store.export_harmonized_split_files(root_dir, TUBELET_LABELS)
+        store.close()
+        return
+
     train_file = os.path.join(root_dir,"train.txt")
     test_file = os.path.join(root_dir,"test.txt")
     class_list_file = os.path.join(root_dir,"class_list.txt")
@@ -99,4 +120,4 @@ def main(root_dir):
 
 if __name__ == "__main__" :
     ROOT_DIR = "TUBELET_DATASET_FINAL"
-    main(ROOT_DIR)
\ No newline at end of file
+    main(ROOT_DIR, get_configured_store_path())
\ No newline at end of file
@@ -4,10 +4,13 @@ import ffmpeg
 import os
 import shutil
 import cv2
+import numpy as np
 import itertools 
+import fnmatch
 import subprocess
 import sys
 import multiprocessing
+import time
 from functools import partial
 
 from .processors.kth_dataset_processor import KTHDatasetProcessor
@@ -21,6 +24,29 @@ from .processors.mcad_dataset_processor import MCADDatasetProcessor
 from .analysis.dataset_stats import DatasetStats
 
 from .utils import utils, person_detector
+from .utils.detector_pool import DetectorPool
+from .utils.inventory import SourceInventory
+from .utils.annotation_store import AnnotationStore
+from .utils.activity import Activity
+from .utils.activity_data import ActivityDataWriter, iter_activity_data
+from .utils.scheduler import Scheduler
+from .utils.crop_dedup import CropDedup
+from .utils import crop_dedup
+from .utils import sampling
+from .utils import resampling
+from .utils.staging import SourceStager
+from .utils import staging
+
+DATASET_PROCESSORS = {
+    "KTH" : KTHDatasetProcessor,
+    "VIRAT" : ViratDatasetProcessor,
+    "JRDBACT" : JRDBActDatasetProcessor,
+    "OKUTAMA" : OkutamaDatasetProcessor,
+    "UCFARG" : UCFARGDatasetProcessor,
+    "MMACT" : MMActDatasetProcessor,
+    "MCAD" : MCADDatasetProcessor
+}
+STAGES = ["parse", "extract", "detect", "crop", "split", "stats"]
 
 
 class ActTubeletGenerator():
@@ -31,6 +57,26 @@ class ActTubeletGenerator():
         self.current_processing_dataset = None
         self.current_activity_info = None
         self.current_data = dict()
+        self.inventory = None
+        self.annotation_store = None
+        self.data_writer = None
+        self.scheduler = Scheduler(self.config['global_settings'].get('processing', 'sequential'),
+                                   self.config['global_settings'].get('workers', None))
+        # identical crops (same source frame, crop rect and output settings) are encoded once and hardlinked
+        self.crop_dedup = CropDedup(self.config['global_settings'].get('crop_store_dir',
+                                        os.path.join(self.config['global_settings']['output_dir'], ".crop_store")),
+                                    enabled=self.config['global_settings'].get('dedup_crops', False))
+        # source videos / image dirs are copied from the network storage to local scratch ahead of the stages
+        self.stager = SourceStager(**self.config['global_settings'].get('staging', {}))
+
+    def __getstate__(self) :
+        # only the settings are sent to the worker processes of the scheduler
+        # (the data of the dataset is sent with each task, the store and the writer stay in the main process)
+        state = self.__dict__.copy()
+        state["current_data"] = dict()
+        state["annotation_store"] = None
+        state["data_writer"] = None
+        return state
 
     def get_config(self, config_file) :
         """get the config of the all the datasets"""
@@ -56,16 +102,73 @@ class ActTubeletGenerator():
     def get_current_bbox_info(self) :
         return self.current_activity_info['bbox_info']
 
+    def get_target_fps(self) :
+        """
+        fps the frames are sampled at, target_fps of the dataset (default global target_fps, numeric src_data_fps)
+        or the native fps of the dataset
+        """
+        dataset_cfg = self.config["each_dataset_config"][self.get_current_dataset_name()]
+        src_data_fps = self.config["global_settings"].get("src_data_fps", "org")
+        target_fps = dataset_cfg.get("target_fps", self.config["global_settings"].get("target_fps", None))
+        if target_fps is None and src_data_fps != "org" :
+            target_fps = src_data_fps
+        if target_fps is None :
+            return dataset_cfg["fps"]
+        assert 0 < target_fps <= dataset_cfg["fps"], F"target_fps {target_fps} should be in (0, {dataset_cfg['fps']}]"
+        return target_fps
+
+    def get_frame_step(self) :
+        """ fps / target_fps, 1 -> all the frames """
+        return self.config["each_dataset_config"][self.get_current_dataset_name()]["fps"] / self.get_target_fps()
+
     def set_frames_per_dataset(self) :
-        self.MAX_FRAMES_IN_SAMPLE = int(self.config["global_settings"]["max_duration"] * \
-                                self.config["each_dataset_config"][self.get_current_dataset_name()]["fps"])
-        self.MIN_FRAMES_IN_SAMPLES = int(self.config["global_settings"]["min_duration"] * \
-                                self.config["each_dataset_config"][self.get_current_dataset_name()]["fps"])    
+        # frame counts at the target fps, the frames are resampled at decode time
+        self.MAX_FRAMES_IN_SAMPLE = int(self.config["global_settings"]["max_duration"] * self.get_target_fps())
+        self.MIN_FRAMES_IN_SAMPLES = int(self.config["global_settings"]["min_duration"] * self.get_target_fps())
+        # stride between the tubelet parts (part_stride in sec or part_overlap as fraction of max_duration),
+        # default is non overlapping parts, each dataset can override the global setting (ex. more parts for rare classes)
+        dataset_cfg = self.config["each_dataset_config"][self.get_current_dataset_name()]
+        part_stride = dataset_cfg.get("part_stride", self.config["global_settings"].get("part_stride", None))
+        part_overlap = dataset_cfg.get("part_overlap", self.config["global_settings"].get("part_overlap", 0))
+        assert 0 <= part_overlap < 1, F"part_overlap should be in [0, 1), got {part_overlap}"
+        if part_stride is not None :
+            self.PART_STRIDE = max(1, int(part_stride * self.get_target_fps()))
+        else :
+            self.PART_STRIDE = max(1, int(self.MAX_FRAMES_IN_SAMPLE * (1 - part_overlap)))
+
+    def sample_current_data(self) :
+        """ per class / per dataset quotas (sampling config, dataset config overrides the global one) before decoding """
+        sampling_cfg = self.config["each_dataset_config"][self.get_current_dataset_name()].get("sampling",
+                            self.config["global_settings"].get("sampling", None))
+        if sampling_cfg is None :
+            return self.current_data
+        self.set_frames_per_dataset()
+        def estimate_tubelets(act) :
+            if act.get("start_f_no", None) is None or act.get("end_f_no", None) is None :
+                return 1 # range is known only after the detections
+            return max(1, len(self.get_part_windows(int(act["start_f_no"]), int(act["end_f_no"]), float("inf"))))
+        return sampling.stratified_sample(self.current_data,
+                                          per_class=sampling_cfg.get("per_class", None),
+                                          per_dataset=sampling_cfg.get("per_dataset", None),
+                                          seed=sampling_cfg.get("seed", 0),
+                                          estimate_tubelets=estimate_tubelets)
+
+    def get_annotation_store(self) :
+        if self.annotation_store is None :
+            db_path = self.config["global_settings"].get("annotation_store",
+                        os.path.join(self.config["global_settings"]["output_dir"], "annotations.db"))
+            self.annotation_store = AnnotationStore(db_path)
+        return self.annotation_store
 
-    def get_dataset_stats(self,class_to_include=[], key_word="filtered") :
-        dataset_stats = DatasetStats()
+    def get_dataset_stats(self,class_to_include=[], key_word="filtered", datasets=None) :
+        # stats only over the given datasets (default datasets_to_consider)
+        datasets = datasets if datasets is not None else self.config["global_settings"]["datasets_to_consider"]
+        dataset_stats = DatasetStats({"DATASETS_TO_CONSIDER" : datasets})
         all_stats = dataset_stats(self.config["global_settings"]["output_dir"],
                                   class_to_include, key_word)
+        # tubelets and frames per dataset, class and split from the annotation store
+        all_stats["store"] = self.get_annotation_store().get_stats(datasets)
+        all_stats["integrity"] = self.get_annotation_store().get_integrity_stats()
         with open("dataset_stats.json","w") as fw :
             json.dump(all_stats,fw)
 
@@ -81,42 +184,106 @@ class ActTubeletGenerator():
             self.set_current_dataset_name(k)
 
             if k in self.config["global_settings"]["datasets_to_consider"] :
-                if k == "KTH" :
-                    kth_data = KTHDatasetProcessor(self.config["each_dataset_config"]["KTH"])
-                    self.current_data = kth_data()
-                elif k == "VIRAT" :
-                    virat_data = ViratDatasetProcessor(self.config["each_dataset_config"]["VIRAT"])
-                    self.current_data = virat_data()
-                elif k == "JRDBACT" :
-                    jrdbact_data = JRDBActDatasetProcessor(self.config['each_dataset_config']["JRDBACT"])
-                    self.current_data = jrdbact_data()
-                elif k == "OKUTAMA" :
-                    okutama_data = OkutamaDatasetProcessor(self.config['each_dataset_config']["OKUTAMA"])
-                    self.current_data = okutama_data()
-                elif k == "UCFARG" :
-                    ucfarg_data = UCFARGDatasetProcessor(self.config['each_dataset_config']["UCFARG"])
-                    self.current_data = ucfarg_data()
-                elif k == "MMACT" :
-                    mmact_data = MMActDatasetProcessor(self.config['each_dataset_config']["MMACT"])
-                    self.current_data = mmact_data()
-                elif k == "MCAD" :
-                    mcad_data = MCADDatasetProcessor(self.config['each_dataset_config']["MCAD"])
-                    self.current_data = mcad_data()
-                else :
-                    logger.info(F"data processor not implemented for {k}")
-                    sys.exit()
-                
-                # self.current_data = dict(itertools.islice(self.current_data.items(), 20)) # FOR TESTING
-                self.save_current_data()
+                self.parse_dataset()
                 self.extract_tubelets()
             else :
                 logger.info(F"skipping {k}")
 
+    def parse_dataset(self) :
+        """ parse stage, process the annotations of the current dataset and save them as {DATASET}_data.jsonl """
+        k = self.get_current_dataset_name()
+        if k not in DATASET_PROCESSORS :
+            logger.info(F"data processor not implemented for {k}")
+            sys.exit()
+        processor = DATASET_PROCESSORS[k](self.config["each_dataset_config"][k])
+        self.current_data = processor()
+        self.current_data = self.resample_current_data()
+        self.current_data = self.sample_current_data()
+        self.get_annotation_store().add_source_data(k, self.current_data, self.config['each_dataset_config'][k].get('src_dir', None))
+        self.data_writer = None # new file for each dataset
+        self.save_current_data()
+
+    def resample_current_data(self) :
+        """ remap the frame numbers of the activities to the target fps (see resampling) """
+        frame_step = self.get_frame_step()
+        if frame_step == 1 :
+            return self.current_data
+        logger.info(F"resampling {self.get_current_dataset_name()} from {self.config['each_dataset_config'][self.get_current_dataset_name()]['fps']} "
+                    F"to {self.get_target_fps()} fps")
+        for acts in self.current_data.values() :
+            for act in acts :
+                # frames extracted from the videos are numbered from 1
+                resampling.resample_activity(act, frame_step, first_frame=1 if self.is_video_data() else 0)
+        return self.current_data
+
+    def get_data_path(self) :
+        return os.path.join(self.config['global_settings']['output_dir'], F"{self.get_current_dataset_name()}_data.jsonl")
+
+    def load_current_data(self, videos=None, classes=None) :
+        """
+        load the saved {DATASET}_data.jsonl of the current dataset (output of the earlier stages)
+        returns (all the data, data of the videos / classes to process)
+        videos -> video names or glob patterns, classes -> activity names (None -> all)
+        the activity records are shared by both, so the updates of a stage are part of all the data
+        """
+        path = self.get_data_path()
+        if not os.path.isfile(path) :
+            raise FileNotFoundError(F"{path} not found, run the parse stage for {self.get_current_dataset_name()} first")
+        all_data = dict(iter_activity_data(path, as_records=True))
+        selected_data = {}
+        for video, acts in all_data.items() :
+            if videos is not None and not any(fnmatch.fnmatch(video, x) for x in videos) :
+                continue
+            acts = [act for act in acts if classes is None or act['activity'] in classes]
+            if len(acts) > 0 :
+                selected_data[video] = acts
+        logger.info(F"loaded {len(all_data)} videos from {path}, {len(selected_data)} videos selected")
+        self.data_writer = ActivityDataWriter(path) # the stages only checkpoint the changed videos
+        return all_data, selected_data
+
+    def run_stage(self, stage, datasets=None, videos=None, classes=None) :
+        """
+        run a single stage of the generator on its saved inputs
+        parse   -> annotations to {DATASET}_data.jsonl (datasets filter only)
+        extract -> video frames in tmp_dir, src_dir / src_video of the activities in {DATASET}_data.jsonl
+        detect  -> person detections as bbox_info in {DATASET}_data.jsonl
+        crop    -> tubelets in output_dir and the annotation store
+        split   -> train.txt / test.txt / class_list.txt (always over all the datasets)
+        stats   -> dataset_stats.json (datasets and classes filters)
+        """
+        assert stage in STAGES, F"unknown stage {stage}, supported {STAGES}"
+        if stage == "split" :
+            return self.get_train_test_split()
+        if stage == "stats" :
+            return self.get_dataset_stats(classes if classes is not None else [], "filtered" if classes is not None else "all",
+                                          datasets)
+
+        for k in self.config['each_dataset_config'].keys() :
+            if k not in self.config["global_settings"]["datasets_to_consider"] or (datasets is not None and k not in datasets) :
+                continue
+            logger.info(F"running {stage} stage for dataset {k}")
+            self.set_current_dataset_name(k)
+            if stage == "parse" :
+                self.parse_dataset()
+                continue
+            all_data, self.current_data = self.load_current_data(videos, classes)
+            if stage == "extract" :
+                self.extract_frames()
+                changed_videos = list(self.current_data.keys()) if self.is_video_data() else []
+            elif stage == "detect" :
+                changed_videos = self.detect_persons()
+            else :
+                self.crop_tubelets()
+                changed_videos = []
+            if len(changed_videos) > 0 :
+                self.current_data = all_data
+                self.save_current_data(changed_videos)
+
     def get_train_test_split(self) :
         logger.info(F"Generating the train and test splits")
-        train_data = []
-        test_data = []
         train_test_split = {}
+        # processors list the tubelets from the configured annotation store
+        db_path = self.get_annotation_store().db_path
         # print(self.config['each_dataset_config'].keys())
         for k in self.config['each_dataset_config'].keys() :
             logger.info(F"Processing {k}")
@@ -134,199 +301,643 @@ class ActTubeletGenerator():
                     # print(train_test_split)
                 elif k == "JRDBACT" :
                     jrdbact_data = JRDBActDatasetProcessor(self.config["each_dataset_config"]["JRDBACT"])
-                    train_test_split[k] = jrdbact_data.get_train_test_split(self.config["global_settings"]["output_dir"])
+                    train_test_split[k] = jrdbact_data.get_train_test_split(self.config["global_settings"]["output_dir"], db_path)
                 elif k == "OKUTAMA" :
                     okutama_data = OkutamaDatasetProcessor(self.config["each_dataset_config"]["OKUTAMA"])
-                    train_test_split[k] = okutama_data.get_train_test_split(self.config["global_settings"]["output_dir"])
+                    train_test_split[k] = okutama_data.get_train_test_split(self.config["global_settings"]["output_dir"], db_path)
                 elif k == "UCFARG" :
                     ucfarg_data = UCFARGDatasetProcessor(self.config["each_dataset_config"]["UCFARG"])
-                    train_test_split[k] = ucfarg_data.get_train_test_split(self.config["global_settings"]["output_dir"])
+                    train_test_split[k] = ucfarg_data.get_train_test_split(self.config["global_settings"]["output_dir"], db_path)
                 elif k == "MMACT" :
                     mmact_data = MMActDatasetProcessor(self.config["each_dataset_config"]["MMACT"])
-                    train_test_split[k] = mmact_data.get_train_test_split(self.config["global_settings"]["output_dir"])
+                    train_test_split[k] = mmact_data.get_train_test_split(self.config["global_settings"]["output_dir"], db_path)
                 elif k == "MCAD" :
                     mcad_data = MCADDatasetProcessor(self.config["each_dataset_config"]["MCAD"])
-                    train_test_split[k] = mcad_data.get_train_test_split(self.config["global_settings"]["output_dir"])
+                    train_test_split[k] = mcad_data.get_train_test_split(self.config["global_settings"]["output_dir"], db_path)
                 else :
                     logger.info(F"not implemted for {k}")
             else :
                 logger.info(F"NOT PROCESSING FOR {k}")
                 continue
 
-        all_dataset_samples = [ x for x in os.listdir(self.config['global_settings']['output_dir']) \
-                                if os.path.isdir(os.path.join(self.config['global_settings']['output_dir'],x))]
-        
-        classes_list = list(set([ x.split("-")[2] for x in all_dataset_samples]))
+        # tubelets cropped before the annotation store existed are added from the output dir
+        store = self.get_annotation_store()
+        store.sync_tubelets(self.config['global_settings']['output_dir'], utils.get_tubelet_length)
 
-        for each_sample in all_dataset_samples :
-            sample_length =len( os.listdir(os.path.join(self.config['global_settings']['output_dir'], each_sample)))
-            k = each_sample.split("-")[0] # get dataset name
-            
+        name_to_split = {}
+        for each_sample, k, _, sample_length in store.get_tubelets() :
+            if k not in train_test_split :
+                name_to_split[each_sample] = None
+                continue
+            self.set_current_dataset_name(k)
+            self.set_frames_per_dataset()
             # for JRDBACT consider entire dir name instead of video name -> since JRDB collects the data in single burst i.e it doesn't have any individual vidoes / all the images are part of single video ? 
             each_dir_name = each_sample.split("-")[1] if k not in ["JRDBACT","OKUTAMA","UCFARG","MMACT","MCAD"] else each_sample
 
+            name_to_split[each_sample] = None
             if sample_length > self.MIN_FRAMES_IN_SAMPLES :
                 if each_dir_name in train_test_split[k]["train"] :
-                    train_data.append(F"{os.path.basename(each_sample)} {sample_length} {classes_list.index(os.path.basename(each_sample).split('-')[2])}\n")
+                    name_to_split[each_sample] = "train"
                 elif each_dir_name in train_test_split[k]["test"] :
-                    test_data.append(F"{os.path.basename(each_sample)} {sample_length} {classes_list.index(os.path.basename(each_sample).split('-')[2])}\n")
+                    name_to_split[each_sample] = "test"
                 else :
-                    logger.info(F"{os.path.basename(each_sample)} is not part of partition")
+                    logger.info(F"{each_sample} is not part of partition")
             else :
-                logger.info(F"Skipping {os.path.basename(each_sample)}, it contains only {sample_length} samples")
+                logger.info(F"Skipping {each_sample}, it contains only {sample_length} samples")
 
-            
-        with open(os.path.join(self.config['global_settings']['output_dir'],"train.txt"),'w') as fw:
-            fw.writelines(train_data)
-        with open(os.path.join(self.config['global_settings']['output_dir'],"test.txt"),'w') as fw :
-            fw.writelines(test_data)
-        with open(os.path.join(self.config['global_settings']['output_dir'],"class_list.txt"),'w') as fw :
-            fw.writelines([ F"{x}\n" for x in classes_list])
+        # train.txt, test.txt and class_list.txt are exported from the store
+        store.set_splits(name_to_split)
+        store.export_split_files(self.config['global_settings']['output_dir'])
 
         logger.info(F"Dataset annotations are saved to {self.config['global_settings']['output_dir']}")                      
 
     def extract_tubelets(self) :
         """ This function will do post processing (such as get person detections) if needed and extract the tubelets"""
         logger.info(F"extracting the processed data")
-        
+        self.extract_frames()
+        videos_to_detect = self.detect_persons()
+
+        # only the videos updated above are checkpointed
+        # (for video data the src_dir of all the videos is updated, otherwise only the detected videos)
+        if self.is_video_data() :
+            self.save_current_data()
+        else :
+            self.save_current_data(videos_to_detect)
+        self.crop_tubelets()
+
+    def is_video_data(self) :
+        return self.config['each_dataset_config'][self.get_current_dataset_name()].get('data_format','frames') == "video"
+
+    def needs_detection(self) :
+        return self.config['each_dataset_config'][self.get_current_dataset_name()].get('bbox_info', False) == False
+
+    def use_detect_on_decode(self) :
+        """
+        detect on the frames decoded from the video stream while they are stored for cropping,
+        instead of extracting with ffmpeg and decoding the jpegs again for the detector
+        (frames which are not part of the target fps are dropped by the decoder)
+        """
+        return self.needs_detection() and self.is_video_data() \
+                and self.config['global_settings'].get('detector', {}).get('detect_on_decode', False)
+
+    def extract_frames(self) :
+        """ extract stage, convert the videos into frames (if needed) and set the src_dir / src_video of the activities """
         dataset_name = self.get_current_dataset_name()
         self.set_frames_per_dataset()
         logger.info(F"all the videos are : {self.current_data.keys()}")
+        if not self.is_video_data() :
+            return
 
-        # modifying this to process all videos first (i.e) convert them to frames
-        # and add the frames directory to the src_dir in each activity
-        
-        if self.config['each_dataset_config'][dataset_name].get('data_format','frames') == "video" :
+        # with the ffmpeg crop backend the tubelets are cropped straight from the source video,
+        # frames are only extracted if they are needed for the detections
+        skip_extraction = not self.needs_detection() and self.use_ffmpeg_crop()
+        if self.use_detect_on_decode() :
+            logger.info(F"frames of {dataset_name} are decoded with the detections (detect stage)")
+        elif not skip_extraction :
             logger.info(F"converting the videos into the frames")
             all_videos = self.current_data.keys()
             all_videos = [os.path.join(self.config['each_dataset_config'][dataset_name]['src_dir'],x) \
                           for x in all_videos]
-            
-            # pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-            # pool.map(self.get_frames_from_video, all_videos,chunksize=10)
-            # pool.close()
-            # pool.join()
-            for v in all_videos:
-                try :
-                    self.get_frames_from_video(v)
-                except :
-                    logger.error(F"unable to extract frames from {v}")
-                
-
-            # add the frames dir as the src_dir for each activity
-            for video_name in self.current_data.keys() :
-                for idx, act in enumerate(self.current_data[video_name]) :
-                    if self.get_current_dataset_name() != "MMACT" : 
-                        self.current_data[video_name][idx]['src_dir'] = os.path.join(self.config["global_settings"]["tmp_dir"],\
-                                                                     os.path.splitext(os.path.basename(video_name))[0] )
-                    else :
-                        self.current_data[video_name][idx]['src_dir'] = os.path.join(self.config["global_settings"]["tmp_dir"],\
-                                                                    F"{'_'.join(video_name.split(os.sep)[-5:-1])}_{os.path.splitext(os.path.basename(video_name))[0]}")
-        # if bbox info not available in the dataset, run the pedestrian detector and get the detections
-        # for all the cases, we only have one person in frame i.e one person per frame
-        if self.config['each_dataset_config'][dataset_name].get('bbox_info', False) == False :
-            
-            # we have to run this each video, cuda won't support multiprocessing (or does it ?)
-            for each_video in self.current_data.keys() :
-                if len(self.current_data[each_video]) == 0 :
-                    continue
-                detections = self.get_person_detections(self.current_data[each_video][0]['src_dir'])
-                logger.info(F"Getting person detections from {os.path.basename(self.current_data[each_video][0]['src_dir'])}")
-                if len(detections) == 0 :
-                    continue
-                # check for start_f_no and end_f_no
-                # we are assuming the each video has only class
-                if self.current_data[each_video][0].get("start_f_no",None) == None :
-                    all_frame_ids = [int(x.split("_")[-1]) for x in detections.keys()]
-                    self.current_data[each_video][0]["start_f_no"] = min(all_frame_ids)
-                    self.current_data[each_video][0]["end_f_no"] = max(all_frame_ids)
-        
-                # using '0' since all the activities in a single video has single frame
-                for act_idx, act in enumerate(self.current_data[each_video]) :
-                    bbox_info = {}
-                    ## add bounding box information using the detections
-                    for frame_idx in range(act["start_f_no"], act["end_f_no"]) :
-                        bbox_info[F"img_{frame_idx:05d}"] = detections.get(F"img_{frame_idx:05d}")
-
-                    self.current_data[each_video][act_idx]["bbox_info"] = bbox_info
 
+            # largest videos first, staged in the order the scheduler starts them
+            self.stager.set_remote_roots([self.config['each_dataset_config'][dataset_name]['src_dir']])
+            self.stager.prefetch([all_videos[i] for i in self.scheduler.get_task_order("extract", all_videos, utils.get_file_size)])
+            all_results = self.scheduler.map("extract", ActTubeletGenerator.extract_frames_task, all_videos,
+                                             cost=utils.get_file_size, context=self)
+            self.stager.finish()
+            staging.log_stats(staging.merge_stats([stats for _, stats in all_results] + [self.stager.take_stats()]))
+
+        # add the frames dir as the src_dir for each activity
+        for video_name in self.current_data.keys() :
+            for idx, act in enumerate(self.current_data[video_name]) :
+                self.current_data[video_name][idx]['src_video'] = os.path.join(self.config['each_dataset_config'][dataset_name]['src_dir'], video_name)
+                if self.get_current_dataset_name() != "MMACT" : 
+                    self.current_data[video_name][idx]['src_dir'] = os.path.join(self.config["global_settings"]["tmp_dir"],\
+                                                                 os.path.splitext(os.path.basename(video_name))[0] )
+                else :
+                    self.current_data[video_name][idx]['src_dir'] = os.path.join(self.config["global_settings"]["tmp_dir"],\
+                                                                F"{'_'.join(video_name.split(os.sep)[-5:-1])}_{os.path.splitext(os.path.basename(video_name))[0]}")
+
+    def detect_persons(self) :
+        """
+        detect stage, if bbox info not available in the dataset, run the pedestrian detector and get the detections
+        for all the cases, we only have one person in frame i.e one person per frame
+        returns the videos which are updated
+        """
+        dataset_name = self.get_current_dataset_name()
+        if not self.needs_detection() :
+            return []
+        self.set_frames_per_dataset()
+        # static camera datasets can use the cheaper background subtraction localizer
+        detector_cfg = dict(self.config['global_settings'].get('detector', {}))
+        detector_cfg['num_workers'] = self.scheduler.get_workers('detect', detector_cfg.get('num_workers', 1))
+        detector_pool = DetectorPool(localizer=self.config['each_dataset_config'][dataset_name].get('localizer', 'detector'),
+                                     **detector_cfg)
+
+        # on cpu the videos are distributed over a pool of detector processes (one model per process)
+        # on cuda the pool falls back to a single worker
+        videos_to_detect = [v for v in self.current_data.keys() if len(self.current_data[v]) > 0]
+        if self.use_detect_on_decode() :
+            logger.info(F"decoding the videos into the frames and getting the person detections")
+            all_detections = detector_pool.detect_videos(
+                [os.path.join(self.config['each_dataset_config'][dataset_name]['src_dir'],v) for v in videos_to_detect],
+                [self.current_data[v][0]['src_dir'] for v in videos_to_detect],
+                frame_step=self.get_frame_step())
+        else :
+            all_detections = detector_pool([self.current_data[v][0]['src_dir'] for v in videos_to_detect])
+
+        # results are in the same order as videos_to_detect
+        for each_video, detections in zip(videos_to_detect, all_detections) :
+            logger.info(F"Got person detections from {os.path.basename(self.current_data[each_video][0]['src_dir'])}")
+            if len(detections) == 0 :
+                continue
+            # check for start_f_no and end_f_no
+            # we are assuming the each video has only class
+            if self.current_data[each_video][0].get("start_f_no",None) == None :
+                all_frame_ids = [int(x.split("_")[-1]) for x in detections.keys()]
+                self.current_data[each_video][0]["start_f_no"] = min(all_frame_ids)
+                self.current_data[each_video][0]["end_f_no"] = max(all_frame_ids)
+                if self.current_data[each_video][0].get("activity_id", None) is not None :
+                    self.get_annotation_store().update_activity_range(self.current_data[each_video][0]["activity_id"],
+                                                                      min(all_frame_ids), max(all_frame_ids))
+    
+            # using '0' since all the activities in a single video has single frame
+            for act_idx, act in enumerate(self.current_data[each_video]) :
+                bbox_info = {}
+                ## add bounding box information using the detections
+                for frame_idx in range(act["start_f_no"], act["end_f_no"]) :
+                    bbox_info[F"img_{frame_idx:05d}"] = detections.get(F"img_{frame_idx:05d}")
+
+                # detections are kept as compact activity records
+                act = act if isinstance(act, Activity) else Activity.from_dict(act)
+                act["bbox_info"] = bbox_info
+                self.current_data[each_video][act_idx] = act
+        return videos_to_detect
+
+    def crop_tubelets(self) :
+        """ crop stage, crop the tubelets of all the activities and add them to the annotation store """
+        dataset_name = self.get_current_dataset_name()
+        self.set_frames_per_dataset()
+        is_video_data = self.is_video_data()
         out_dir = os.path.join(self.config['global_settings']['output_dir'])
         utils.create_dir_if_not_exists(out_dir) # out root dir for dataset
 
-        self.save_current_data()
+        # frames datasets are read from the source tree, the frame counts come from the cached inventory
+        dataset_cfg = self.config['each_dataset_config'][dataset_name]
+        self.inventory = None if is_video_data else SourceInventory(dataset_cfg['src_dir'], dataset_cfg.get('inventory_cache_dir', None))
 
         all_activities = []
         for each_video in self.current_data.keys() :
             for each_act in self.current_data[each_video] :
                 all_activities.append(each_act)
-        # For testing
-        for act in all_activities :
-            self.process_each_activity(act)
-            # break
-        # pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-        # pool.map(self.process_each_activity, all_activities,chunksize=10)
-        # pool.close()
-        # pool.join()
+        if is_video_data and any(act.get('src_video', None) is None for act in all_activities) :
+            logger.error(F"frames of {dataset_name} are not extracted, run the extract stage first")
+            return
+        if self.inventory is not None :
+            # listings are scanned (and saved) in the main process, the crop workers get them with their copy of the inventory
+            self.inventory.scan_dirs([act['src_dir'] for act in all_activities])
+            self.inventory.save()
+        # sources of the activities are staged in the order the activities are cropped
+        # (for video data the frames are in the local tmp dir, only the videos read by the ffmpeg crop are staged)
+        self.stager.set_remote_roots([dataset_cfg['src_dir']])
+        all_sources = [all_activities[i].get('src_video', None) if is_video_data else all_activities[i]['src_dir']
+                       for i in self.scheduler.get_task_order("crop", all_activities, self.get_activity_length)]
+        if not is_video_data or self.use_ffmpeg_crop() :
+            self.stager.prefetch([x for x in all_sources if x is not None])
+        # activities with more frames first, the tubelets are added to the store in the main process as each activity
+        # is done (tubelets already on disk are in the store even if the stage is interrupted)
+        store = self.get_annotation_store()
+        def add_tubelets(result) :
+            for tubelet in result[0] :
+                store.add_tubelet(*tubelet)
+        all_results = self.scheduler.map("crop", ActTubeletGenerator.crop_activity_task, all_activities,
+                                          cost=self.get_activity_length, context=self, on_result=add_tubelets)
+        self.stager.finish()
+        crop_dedup.log_stats(crop_dedup.merge_stats([stats for _, stats, _ in all_results]))
+        logger.info(F"tubelet integrity {store.get_integrity_stats()}")
+        staging.log_stats(staging.merge_stats([stats for _, _, stats in all_results] + [self.stager.take_stats()]))
+        if self.inventory is not None : # dirs rescanned by the tasks (sequential / threads only)
+            self.inventory.save()
+
+    def crop_activity_task(self, activity_info) :
+        """ process_each_activity, a failing activity is logged and skipped instead of stopping the crop stage """
+        try :
+            return self.process_each_activity(activity_info)
+        except Exception as e :
+            logger.error(F"unable to crop the tubelets of {activity_info.get('src_dir', None)} "
+                         F"{activity_info.get('activity', None)}, failed with {e}")
+            return [], crop_dedup.new_stats(), self.stager.take_stats()
+
+    def get_activity_length(self, activity_info) :
+        try :
+            return int(activity_info.get('end_f_no', 0)) - int(activity_info.get('start_f_no', 0))
+        except (TypeError, ValueError) :
+            return 0
+
+    def get_bbox_variation(self) :
+        bbox_variation = self.config['global_settings']['bbox_variation']
+        # for OKUTAMA only consider the 'org' bounding boxes, since it has moving camera, union is only applicable for static camera
+        bbox_variation = bbox_variation if self.get_current_dataset_name() != "OKUTAMA" else "org"
+        assert bbox_variation in ["org", "union", "uniform"], F"unknown bbox variaion in config {bbox_variation}"
+        return bbox_variation
+
+    def use_ffmpeg_crop(self) :
+        """
+        ffmpeg crop backend is used only when the crop rectangle is constant for each part (union bbox)
+        and the source is a video
+        """
+        return self.config['global_settings'].get('crop_backend', 'cv2') == "ffmpeg" \
+                and self.get_bbox_variation() == "union" \
+                and self.config['each_dataset_config'][self.get_current_dataset_name()].get('data_format','frames') == "video"
+
+    def get_part_windows(self, act_start_frame_no, act_end_frame_no, no_of_src_frames) :
+        """
+        [(p_idx, start_idx, end_idx)] parts of MAX_FRAMES_IN_SAMPLE frames every PART_STRIDE frames,
+        stops after the first part reaching the end of the activity (same as the non overlapping parts)
+        """
+        windows = []
+        for p_idx, start_idx in enumerate(range(act_start_frame_no, act_end_frame_no, self.PART_STRIDE)) :
+            end_idx = start_idx + self.MAX_FRAMES_IN_SAMPLE
+            windows.append((p_idx, start_idx, end_idx if end_idx <= no_of_src_frames else no_of_src_frames))
+            if end_idx >= act_end_frame_no :
+                break
+        return windows
 
     def process_each_activity(self,activity_info) :
+        """
+        crop all the parts of the activity
+        returns the tubelets [(name, activity_id, start_idx, end_idx, no_of_frames, frames_dir, frame_offset, integrity)]
+        for the annotation store, the crop dedup stats and the staging read stats
+
+        part_storage (global_settings)
+            copy -> each part is cropped to its own dir (or mp4)
+            manifest -> the activity is cropped once to a frame store (<output_dir>/.frames/<activity>), each part is
+                        only a (frames_dir, frame_offset, no_of_frames) entry in the annotation store and parts_manifest.txt,
+                        so overlapping parts don't cost any disk or encode time. With union bbox variation the union is
+                        taken over the activity instead of each part.
+        """
+        tubelets = []
+        dedup_stats = crop_dedup.new_stats()
         img_src_dir_path = activity_info['src_dir']
-        all_src_imgs = os.listdir(img_src_dir_path)
+        use_ffmpeg = self.use_ffmpeg_crop() and activity_info.get('src_video', None) is not None
+        if use_ffmpeg :
+            video_info = utils.get_video_info(self.stager.resolve(activity_info['src_video']))
+            no_of_src_frames = resampling.get_target_frame_count(video_info["frame_count"], self.get_frame_step())
+        elif self.inventory is not None : # frames dataset, frames are resampled when they are read
+            no_of_src_frames = resampling.get_target_frame_count(len(self.inventory.listdir(img_src_dir_path)), self.get_frame_step())
+        else : # extracted frames, already at the target fps
+            no_of_src_frames = len(os.listdir(img_src_dir_path))
         act_start_frame_no = activity_info.get('start_f_no',None)
         act_end_frame_no = activity_info.get('end_f_no',None)
         if act_start_frame_no == None or act_end_frame_no == None :
             logger.warning(F"Skipping {img_src_dir_path}, since we are unable to find any detections")
-            return
+            return tubelets, dedup_stats, self.stager.take_stats()
         act_start_frame_no = int(act_start_frame_no)
         act_end_frame_no = int(act_end_frame_no)
         activity_name = activity_info['activity']
-        for p_idx, idx_org in enumerate(range(act_start_frame_no, act_end_frame_no, self.MAX_FRAMES_IN_SAMPLE)) :
-            start_idx = idx_org
-            end_idx = start_idx + self.MAX_FRAMES_IN_SAMPLE
-            end_idx = end_idx if end_idx <= len(all_src_imgs) else len(all_src_imgs)
+        # replacing '-' in src_dir name with '_' for consistency in tubelet dir name 
+        # replacing the spaces ' ' in activity aka class names with _ -> I dont know how its gonna pan out
+        activity_prefix = F"{self.get_current_dataset_name()}-{os.path.basename(activity_info['src_dir']).replace('-','_')}-{activity_name.replace(' ','_')}-id{act_start_frame_no}_{act_end_frame_no}"
+        windows = self.get_part_windows(act_start_frame_no, act_end_frame_no, no_of_src_frames)
+        if len(windows) == 0 :
+            return tubelets, dedup_stats, self.stager.take_stats()
+
+        if self.config['global_settings'].get('part_storage', 'copy') == "manifest" :
+            store_start, store_end = windows[0][1], max(end_idx for _, _, end_idx in windows)
+            frames_dir = os.path.join(".frames", activity_prefix)
+            out_dir = os.path.join(self.config['global_settings']['output_dir'], frames_dir)
+            gaps = {}
+            if use_ffmpeg :
+                no_of_frames = self.crop_part_with_ffmpeg(activity_info, [store_start, store_end], out_dir, video_info, dedup_stats)
+                # frames which ffmpeg didn't write are at the end of the store
+                gaps = {idx : "missing" for idx in range(store_start + no_of_frames, store_end)}
+            else :
+                # frames keep their offset from store_start, so the parts can index into the store
+                no_of_frames, gaps = self.crop_part_with_cv2(activity_info, [store_start, store_end], out_dir, dedup_stats,
+                                                             keep_frame_offsets=True)
+            if no_of_frames == 0 :
+                return tubelets, dedup_stats, self.stager.take_stats()
+            if use_ffmpeg and self.config['global_settings'].get('crop_output_format', 'jpg') == "mp4" :
+                frames_dir = F"{frames_dir}.mp4"
+            for p_idx, start_idx, end_idx in windows :
+                part_frames = end_idx - start_idx - len([idx for idx, x in gaps.items() if x == "missing" and start_idx <= idx < end_idx])
+                integrity = self.get_integrity_record([start_idx, end_idx], part_frames, gaps)
+                if not self.is_repair_acceptable(integrity, F"{activity_prefix}-p{p_idx}") :
+                    continue
+                tubelets.append((F"{activity_prefix}-p{p_idx}", activity_info.get('activity_id', None),
+                                 start_idx, end_idx, part_frames, frames_dir, start_idx - store_start, integrity))
+            return tubelets, dedup_stats, self.stager.take_stats()
+
+        for p_idx, start_idx, end_idx in windows :
             # logger.info(F"processing {start_idx} to {end_idx}")
-            f_name_idx = 0
             out_dir = os.path.join(self.config['global_settings']['output_dir'],
                                     # self.get_current_dataset_name(), -> skipping this as well store all of these in the same dir
                                     # current_activity, -> skipping this, may be we don't need it
-                                    # replacing '-' in src_dir name with '_' for consistency in tubelet dir name 
-                                    # replacing the spaces ' ' in activity aka class names with _ -> I dont know how its gonna pan out
-                                    F"{self.get_current_dataset_name()}-{os.path.basename(activity_info['src_dir']).replace('-','_')}-{activity_name.replace(' ','_')}-id{act_start_frame_no}_{act_end_frame_no}-p{p_idx}"
+                                    F"{activity_prefix}-p{p_idx}"
                                     )
-            utils.create_dir_if_not_exists(out_dir)
-
-            for idx in range(start_idx, end_idx) :
-                if self.get_current_dataset_name() != "JRDBACT" :
-                    img_path = os.path.join(img_src_dir_path,F"img_{idx:05d}.jpg")
-                else : # image names are having different notation for 
-                    img_path = os.path.join(img_src_dir_path,F"{idx:06d}.jpg")
-                # logger.warning(F"img_path is {img_path}")
-                if not os.path.isfile(img_path) :
-                    logger.info(F"{img_path} not found! skipping")
-                    # return
-                
-                try :
-                    # logger.info(F"range {[start_idx, end_idx]} , idx {idx}, img_{f_name_idx:05d}.jpg")
-                    img = cv2.imread(img_path)
+            if use_ffmpeg :
+                no_of_frames = self.crop_part_with_ffmpeg(activity_info, [start_idx, end_idx], out_dir, video_info, dedup_stats)
+                if no_of_frames > 0 :
+                    tubelets.append((os.path.basename(out_dir), activity_info.get('activity_id', None),
+                                     start_idx, end_idx, no_of_frames, None, None,
+                                     self.get_integrity_record([start_idx, end_idx], no_of_frames)))
+                continue
+            no_of_frames, gaps = self.crop_part_with_cv2(activity_info, [start_idx, end_idx], out_dir, dedup_stats)
+            integrity = self.get_integrity_record([start_idx, end_idx], no_of_frames, gaps)
+            if not self.is_repair_acceptable(integrity, os.path.basename(out_dir)) :
+                # removed, so the dir is not picked up again when the store is synced with the output dir
+                shutil.rmtree(out_dir, ignore_errors=True)
+                continue
+            tubelets.append((os.path.basename(out_dir), activity_info.get('activity_id', None),
+                             start_idx, end_idx, no_of_frames, None, None, integrity))
+        return tubelets, dedup_stats, self.stager.take_stats()
+
+    def crop_part_with_cv2(self, activity_info, tubelet_idx_range, out_dir, dedup_stats, keep_frame_offsets=False) :
+        """
+        crop the frames of a tubelet part from the frames dir (src_dir) of the activity
+        keep_frame_offsets -> name the crops with their offset from the start of the part, else the crops are numbered
+                              continuously (the frames which couldn't be cropped are skipped)
+        with repair_gaps (global_settings, default true) each frame keeps its offset and the frames which couldn't be
+        cropped are repaired after the part is written
+            no bbox (ex. org variation) -> cropped again with the bbox interpolated between the nearest frames with a bbox
+                                           (frames before the first / after the last bbox are missing)
+            unreadable frame / no bbox at all -> hardlink of the nearest cropped frame (no decoding or encoding)
+        returns (no of frames, {frame_idx : "interpolated" / "duplicated" / "missing"} for the frames which couldn't be cropped)
+        """
+        img_src_dir_path = activity_info['src_dir']
+        start_idx, end_idx = tubelet_idx_range
+        repair_gaps = self.config['global_settings'].get('repair_gaps', True)
+        keep_frame_offsets = keep_frame_offsets or repair_gaps
+        f_name_idx = 0
+        no_of_frames = 0
+        utils.create_dir_if_not_exists(out_dir)
+        # frames are written by the write threads of the scheduler (if any) while the next frames are cropped
+        write_pool = self.scheduler.get_write_pool()
+        pending_writes = []
+        # union bbox is same for all the frames of the part, its computed once
+        constant_bbox = self.get_bbox_variation() == "union"
+        part_bbox = None
+        # crops of extracted frames are keyed on the source video and frame (the tmp frames are re-extracted
+        # on every run and their numbering depends on the target fps), frames datasets on the source image
+        src_video = self.get_source_signature(activity_info['src_video']) if activity_info.get('src_video', None) is not None else None
+        written = []
+        gaps = {}
+
+        for idx in range(start_idx, end_idx) :
+            if keep_frame_offsets :
+                f_name_idx = idx - start_idx
+            img_path = self.get_src_img_path(activity_info, idx)
+            # logger.warning(F"img_path is {img_path}")
+            src_img_path = self.stager.resolve(img_path)
+            if not os.path.isfile(src_img_path) :
+                logger.info(F"{img_path} not found! skipping")
+                gaps[idx] = "duplicated"
+                continue
+            
+            try :
+                # logger.info(F"range {[start_idx, end_idx]} , idx {idx}, img_{f_name_idx:05d}.jpg")
+                if constant_bbox :
+                    if part_bbox is None :
+                        part_bbox = self.get_bbox_for_idx(start_idx, [start_idx,end_idx], activity_info)
+                    bbox = part_bbox
+                else :
                     bbox = self.get_bbox_for_idx(idx, [start_idx,end_idx], activity_info)
-                    crop_img = img[bbox[1]:bbox[3],bbox[0]:bbox[2]]
-                    # logger.info(F"range {[start_idx, end_idx]} , idx {idx}, img_{f_name_idx:05d}.jpg")
-                    out_img_path = os.path.join(out_dir, F"img_{f_name_idx:05d}.jpg")
-                    cv2.imwrite(out_img_path,crop_img)
+                if bbox is None :
+                    gaps[idx] = "interpolated"
+                    continue
+                out_img_path = os.path.join(out_dir, F"img_{f_name_idx:05d}.jpg")
+                if src_video is not None :
+                    crop_src = (src_video, resampling.to_source_frame(idx - 1, self.get_frame_step()))
+                else :
+                    crop_src = self.get_source_signature(img_path)
+                crop_key = self.crop_dedup.get_key(crop_src, [int(x) for x in bbox], "jpg")
+                if self.crop_dedup.link_from_store(crop_key, out_img_path, dedup_stats) :
+                    written.append(idx)
                     f_name_idx = f_name_idx + 1
-                except Exception as e:
-                    logger.error(F"unable to write for {img_path}, failed with {e}")
-                    # raise
-                    # return
+                    no_of_frames = no_of_frames + 1
+                    continue
+
+                t_start = time.perf_counter()
+                img = cv2.imread(src_img_path)
+                if img is None :
+                    gaps[idx] = "duplicated"
+                    continue
+                crop_img = img[bbox[1]:bbox[3],bbox[0]:bbox[2]]
+                if crop_img.size == 0 : # checked here, since the write may happen in another thread
+                    raise ValueError(F"empty crop {bbox}")
+                # logger.info(F"range {[start_idx, end_idx]} , idx {idx}, img_{f_name_idx:05d}.jpg")
+                crop_dedup.remove_if_exists(out_img_path)
+                if write_pool is None :
+                    if cv2.imwrite(out_img_path,crop_img) :
+                        self.crop_dedup.publish(crop_key, out_img_path, dedup_stats, time.perf_counter() - t_start)
+                        written.append(idx)
+                    else :
+                        gaps[idx] = "duplicated"
+                else :
+                    pending_writes.append((idx, out_img_path, crop_key, time.perf_counter() - t_start,
+                                           write_pool.submit(utils.timed, cv2.imwrite, out_img_path, crop_img)))
+                f_name_idx = f_name_idx + 1
+                no_of_frames = no_of_frames + 1
+            except Exception as e:
+                logger.error(F"unable to write for {img_path}, failed with {e}")
+                gaps[idx] = "interpolated"
+                # raise
+                # return
+        for idx, out_img_path, crop_key, crop_time, write in pending_writes :
+            try :
+                ok, write_time = write.result()
+                if ok :
+                    self.crop_dedup.publish(crop_key, out_img_path, dedup_stats, crop_time + write_time)
+                    written.append(idx)
+                else :
+                    gaps[idx] = "duplicated"
+            except Exception as e :
+                logger.error(F"unable to write {out_img_path}, failed with {e}")
+                gaps[idx] = "duplicated"
 
+        if not repair_gaps :
+            return len(written), {idx : "missing" for idx in gaps.keys()}
+        return self.repair_part_gaps(activity_info, tubelet_idx_range, out_dir, sorted(written), gaps)
 
-    
-    def save_current_data(self) :
+    def get_source_signature(self, src_path) :
+        """ (path, size, mtime) of a source for the crop keys, so the crops of a replaced source are not reused """
+        try :
+            if self.inventory is not None : # source images, from the cached listing instead of a stat on NFS for each frame
+                _, size, mtime = self.inventory.scan_dir(os.path.dirname(src_path))[os.path.basename(src_path)]
+                return (src_path, size, mtime)
+            st = os.stat(src_path)
+        except (OSError, KeyError) :
+            return (src_path, None, None)
+        return (src_path, st.st_size, st.st_mtime)
+
+    def get_src_img_path(self, activity_info, idx) :
+        """ source image of the frame, the frames datasets are resampled here (extracted frames are already at the target fps) """
+        if not self.is_video_data() :
+            idx = resampling.to_source_frame(idx, self.get_frame_step())
+        if self.get_current_dataset_name() != "JRDBACT" :
+            return os.path.join(activity_info['src_dir'],F"img_{idx:05d}.jpg")
+        # image names are having different notation for JRDBACT
+        return os.path.join(activity_info['src_dir'],F"{idx:06d}.jpg")
+
+    def repair_part_gaps(self, activity_info, tubelet_idx_range, out_dir, written, gaps) :
+        """
+        fill the frames of the part which couldn't be cropped (out_dir/img_{offset from the start of the part}.jpg)
+        returns (no of frames, gaps with the repair of each frame)
+        """
+        start_idx, end_idx = tubelet_idx_range
+        get_out_path = lambda idx : os.path.join(out_dir, F"img_{idx - start_idx:05d}.jpg")
+        for idx in sorted(gaps.keys()) :
+            if gaps[idx] == "interpolated" :
+                bbox = self.interpolate_bbox(idx, activity_info)
+                if bbox is None : # before the first / after the last bbox of the activity
+                    gaps[idx] = "missing"
+                    continue
+                img_path = self.get_src_img_path(activity_info, idx)
+                img = cv2.imread(self.stager.resolve(img_path))
+                if img is not None :
+                    x0, y0 = max(0, int(bbox[0])), max(0, int(bbox[1]))
+                    x1, y1 = min(img.shape[1], int(bbox[2])), min(img.shape[0], int(bbox[3]))
+                    crop_img = img[y0:y1, x0:x1]
+                    crop_dedup.remove_if_exists(get_out_path(idx))
+                    if crop_img.size > 0 and cv2.imwrite(get_out_path(idx), crop_img) :
+                        continue
+                gaps[idx] = "duplicated"
+            # nearest cropped frame (the earlier frame for a tie)
+            if len(written) == 0 :
+                gaps[idx] = "missing"
+                continue
+            nearest = min(written, key=lambda x : (abs(x - idx), x))
+            try :
+                self.crop_dedup.link(get_out_path(nearest), get_out_path(idx))
+            except OSError as e :
+                logger.error(F"unable to repair {get_out_path(idx)}, failed with {e}")
+                gaps[idx] = "missing"
+        no_of_frames = end_idx - start_idx - len([x for x in gaps.values() if x == "missing"])
+        if len(gaps) > 0 :
+            logger.info(F"repaired {len(gaps)} of {end_idx - start_idx} frames of {os.path.basename(out_dir)}")
+        return no_of_frames, gaps
+
+    def interpolate_bbox(self, frame_idx, activity_info) :
+        """ bbox of a frame without a bbox, linear interpolation between the nearest frames with a bbox (None if outside the boxes) """
+        if isinstance(activity_info, Activity) :
+            frames = activity_info.base + activity_info.offsets.astype(np.int64)
+            boxes = activity_info.boxes
+        else :
+            items = sorted([(int(k.split("_")[-1]), v) for k, v in activity_info['bbox_info'].items() if v is not None])
+            frames = np.array([k for k, _ in items])
+            boxes = np.array([v for _, v in items]).reshape(-1, 4)
+        # only between two frames with a bbox, the frames before the first / after the last bbox are not made up
+        if len(frames) == 0 or frame_idx < frames.min() or frame_idx > frames.max() :
+            return None
+        return [int(round(np.interp(frame_idx, frames, boxes[:, i]))) for i in range(4)]
+
+    def is_repair_acceptable(self, integrity, name) :
+        """
+        tubelets with too many repaired frames are dropped, they need more than MIN_FRAMES_IN_SAMPLES frames cropped from
+        their own frame (same limit as the split) and at most max_repaired_fraction (global_settings, default 0.5) repaired
+        """
+        repaired = len(integrity["interpolated"]) + len(integrity["duplicated"])
+        max_repaired_fraction = self.config['global_settings'].get('max_repaired_fraction', 0.5)
+        if integrity["written_frames"] <= self.MIN_FRAMES_IN_SAMPLES or \
+                repaired > max_repaired_fraction * (integrity["written_frames"] + repaired) :
+            logger.info(F"Skipping {name}, {integrity['written_frames']} of {integrity['expected_frames']} frames are cropped "
+                        F"({repaired} repaired), needs more than {self.MIN_FRAMES_IN_SAMPLES} cropped and at most "
+                        F"{max_repaired_fraction} repaired")
+            return False
+        return True
+
+    def get_integrity_record(self, tubelet_idx_range, no_of_frames, gaps=None) :
+        """ integrity record of a tubelet (frames repaired in the range and the no of frames cropped from their own frame) """
+        start_idx, end_idx = tubelet_idx_range
+        gaps = {idx : x for idx, x in (gaps if gaps is not None else {}).items() if start_idx <= idx < end_idx}
+        record = {k : sorted([idx for idx, x in gaps.items() if x == k]) for k in ["interpolated", "duplicated", "missing"]}
+        record["expected_frames"] = end_idx - start_idx
+        record["written_frames"] = no_of_frames - len(record["interpolated"]) - len(record["duplicated"])
+        return record
+
+    def crop_part_with_ffmpeg(self, activity_info, tubelet_idx_range, out_dir, video_info, dedup_stats=None) :
+        """
+        crop a tubelet part with constant bbox straight from the source video with ffmpeg
+        (seek + crop filter + encode in a single ffmpeg call) instead of reading and writing each frame with cv2
+        output format is based on global_settings -> crop_output_format
+            jpg -> out_dir/img_XXXXX.jpg (same as cv2 backend)
+            mp4 -> out_dir.mp4
+        returns the no of frames cropped (0 if the crop failed)
+        identical parts (same video, frame range, crop rect and output format) are hardlinked from the crop store
+        """
+        dedup_stats = dedup_stats if dedup_stats is not None else crop_dedup.new_stats()
+        start_idx, end_idx = tubelet_idx_range
+        bbox = self.get_bbox_for_idx(start_idx, tubelet_idx_range, activity_info)
+        if bbox is None : # no boxes in the whole part (no detections, gap in the track)
+            logger.warning(F"Skipping {out_dir}, no bbox in {tubelet_idx_range}")
+            return 0
+        # keep the crop inside the frame
+        x0, y0 = max(0, int(bbox[0])), max(0, int(bbox[1]))
+        x1, y1 = min(video_info["width"], int(bbox[2])), min(video_info["height"], int(bbox[3]))
+        out_format = self.config['global_settings'].get('crop_output_format', 'jpg')
+        if out_format == "mp4" : # yuv420p needs even width and height
+            x1, y1 = x1 - (x1 - x0) % 2, y1 - (y1 - y0) % 2
+        if x1 - x0 <= 0 or y1 - y0 <= 0 :
+            logger.warning(F"Skipping {out_dir}, empty crop {bbox}")
+            return 0
+
+        crop_key = self.crop_dedup.get_key(self.get_source_signature(activity_info['src_video']), start_idx, end_idx,
+                                           (x0, y0, x1, y1), out_format, self.get_frame_step())
+        if out_format == "mp4" :
+            if self.crop_dedup.link_from_store(crop_key, F"{out_dir}.mp4", dedup_stats, ext=".mp4") :
+                return utils.get_video_info(F"{out_dir}.mp4")["frame_count"]
+            crop_dedup.remove_if_exists(F"{out_dir}.mp4")
+        else :
+            no_of_frames = self.crop_dedup.link_dir_from_store(crop_key, out_dir, dedup_stats)
+            if no_of_frames > 0 :
+                return no_of_frames
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+        t_start = time.perf_counter()
+        # extracted frames are numbered from 1 i.e img_{idx:05d} is frame (idx - 1) of the video (at the target fps)
+        frame_step = self.get_frame_step()
+        seek_frame = resampling.to_source_frame(start_idx - 1, frame_step)
+        stream = ffmpeg.input(self.stager.resolve(activity_info['src_video']), ss=seek_frame / video_info["fps"])
+        if frame_step != 1 :
+            stream = stream.filter("select", resampling.get_select_expr(frame_step, seek_frame))
+        stream = stream.crop(x0, y0, x1 - x0, y1 - y0)
+        # vfr -> the frames dropped by the select filter are not filled with duplicates (same as the frame extraction)
+        try :
+            if out_format == "mp4" :
+                stream.output(F"{out_dir}.mp4", vframes=end_idx - start_idx, vcodec="libx264",
+                              pix_fmt="yuv420p", vsync="vfr", loglevel="quiet").run(overwrite_output=True)
+            else :
+                utils.create_dir_if_not_exists(out_dir)
+                stream.output(os.path.join(out_dir, "img_%05d.jpg"), vframes=end_idx - start_idx, start_number=0,
+                              vsync="vfr", loglevel="quiet", **{"q:v" : 2}).run(overwrite_output=True)
+            # frames actually written, seek drift / select / an overshooting frame count in the header can give less frames
+            no_of_frames = utils.get_video_info(F"{out_dir}.mp4")["frame_count"] if out_format == "mp4" else len(os.listdir(out_dir))
+        except Exception as e :
+            logger.error(F"unable to crop {out_dir} from {activity_info['src_video']}, failed with {e}")
+            return 0
+        if no_of_frames < end_idx - start_idx :
+            logger.warning(F"{out_dir} has only {no_of_frames} of {end_idx - start_idx} frames")
+        if no_of_frames > 0 :
+            if out_format == "mp4" :
+                self.crop_dedup.publish(crop_key, F"{out_dir}.mp4", dedup_stats, time.perf_counter() - t_start, ext=".mp4")
+            else :
+                self.crop_dedup.publish_dir(crop_key, out_dir, dedup_stats, time.perf_counter() - t_start)
+        return no_of_frames
+
+    def save_current_data(self, changed_videos=None) :
+        """
+        save the current data as {DATASET}_data.jsonl (one line per video)
+        the first save of the dataset writes all the videos, the later saves (checkpoints) only append
+        the changed videos (None -> all the videos)
+        """
         utils.create_dir_if_not_exists(self.config['global_settings']['output_dir'])
-        path_to_save = os.path.join(self.config['global_settings']['output_dir'],
-                                    F"{self.get_current_dataset_name()}_data.json")
-        
-        with open(path_to_save,'w') as fw :
-            json.dump(self.current_data, fw)
+        path_to_save = self.get_data_path()
+
+        if self.data_writer is None or self.data_writer.path != path_to_save :
+            self.data_writer = ActivityDataWriter(path_to_save)
+            self.data_writer.write(self.current_data)
+        else :
+            self.data_writer.checkpoint(self.current_data, changed_videos)
 
     
     def get_bbox_for_idx(self, frame_idx, tubelet_idx_range, activity_info) :
@@ -339,12 +950,11 @@ class ActTubeletGenerator():
         3. uniform -> make all the boundingboxes of uniform height and width - TODO
         """
         def get_bbox(idx) :
+            if isinstance(activity_info, Activity) :
+                return activity_info.get_bbox(idx)
             img_key = F"img_{idx:05d}"
             return activity_info['bbox_info'].get(img_key,None)
-        bbox_variation = self.config['global_settings']['bbox_variation']
-        # for OKUTAMA only consider the 'org' bounding boxes, since it has moving camera, union is only applicable for static camera
-        bbox_variation = bbox_variation if self.get_current_dataset_name() != "OKUTAMA" else "org"
-        assert bbox_variation in ["org", "union", "uniform"], F"unknown bbox variaion in config {bbox_variation}"
+        bbox_variation = self.get_bbox_variation()
 
         if bbox_variation == "org" :
             return get_bbox(frame_idx) # TODO -> need a way to skip the frame
@@ -380,6 +990,8 @@ class ActTubeletGenerator():
         return uniform_boxes[frame_idx]
 
     def union_of_bounding_boxes(self, bounding_boxes):
+        if len(bounding_boxes) == 0 : # None -> no bbox for the part
+            return None
         # Parsing the bounding boxes into tuples of (x_min, y_min, x_max, y_max)
         bounding_boxes = [tuple(map(int, box.split() if type(box) == str else box)) for box in bounding_boxes]
 
@@ -392,11 +1004,18 @@ class ActTubeletGenerator():
         return [x_min, y_min, x_max, y_max]            
     
 
+    def extract_frames_task(self, video_name) :
+        try :
+            return self.get_frames_from_video(video_name), self.stager.take_stats()
+        except :
+            logger.error(F"unable to extract frames from {video_name}")
+            return None, self.stager.take_stats()
+
     def get_frames_from_video(self,video_name):
         """
         Extract frames from given video and return the dir where the frames are stored
         """
-        fps = self.config['global_settings'].get('src_data_fps','org')
+        frame_step = self.get_frame_step()
         tmp_dir = os.path.join(self.config['global_settings'].get('tmp_dir','tmp'))
         if self.get_current_dataset_name() != "MMACT" :
             output_dir = os.path.join(tmp_dir,os.path.splitext(os.path.basename(video_name))[0])
@@ -408,10 +1027,12 @@ class ActTubeletGenerator():
         out_format = f"{output_dir}/img_%05d.jpg"
 
         try :
-            if fps == "org" :
-                cmd = ffmpeg.input(video_name).output(out_format, loglevel='quiet').run()
+            if frame_step == 1 :
+                cmd = ffmpeg.input(self.stager.resolve(video_name)).output(out_format, loglevel='quiet').run()
             else :
-                cmd = ffmpeg.input(video_name, r=fps).output(out_format,loglevel='quiet').run()
+                # only the frames of the target fps are decoded to jpg, numbered continuously (vfr -> no duplicated frames)
+                cmd = ffmpeg.input(self.stager.resolve(video_name)).filter("select", resampling.get_select_expr(frame_step)) \
+                        .output(out_format, vsync="vfr", loglevel='quiet').run()
 
             # subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
             return output_dir
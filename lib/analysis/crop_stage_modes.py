@@ -0,0 +1,102 @@
+"""
+Check that the crop stage gives the same output in all the processing modes (global_settings -> processing)
+
+A small frames dataset (synthetic frames, activities with boxes and a few frames without a box / missing frame)
+is cropped with crop_tubelets once for each mode (sequential, threads, processes), the following are compared
+- the files of the output dir (name and md5 of each tubelet frame)
+- the tubelets and their integrity records in the annotation store
+
+usage
+python -m lib.analysis.crop_stage_modes
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import cv2
+from loguru import logger
+
+from lib.act_tubelet_generator import ActTubeletGenerator
+from lib.utils.activity import Activity
+from lib.utils.scheduler import MODES
+
+DATASET = "MMACT"
+
+
+def create_fixture(src_dir, no_of_videos=4, no_of_frames=60, seed=0) :
+    """ frames dirs of the videos and their activities ({video : [Activity]}) """
+    rng = np.random.default_rng(seed)
+    all_data = {}
+    for v_idx in range(no_of_videos) :
+        video = F"video{v_idx}"
+        frames_dir = os.path.join(src_dir, video)
+        os.makedirs(frames_dir, exist_ok=True)
+        for idx in range(no_of_frames) :
+            if v_idx == 1 and idx == 17 : # missing frame
+                continue
+            frame = rng.integers(0, 255, (120, 160, 3), dtype=np.uint8)
+            cv2.imwrite(os.path.join(frames_dir, F"img_{idx:05d}.jpg"), frame)
+        acts = []
+        for a_idx, (start, end) in enumerate([(2, 40), (10, no_of_frames - 1)]) :
+            # a few frames without a box in the middle of the activity
+            frames = [x for x in range(start, end) if x % 13 != 5]
+            boxes = [[10 + x % 20, 5 + a_idx, 90 + x % 30, 110] for x in frames]
+            acts.append(Activity(F"class{a_idx}", start, end, frames=frames, boxes=boxes, src_dir=frames_dir))
+        all_data[video] = acts
+    return all_data
+
+
+def get_output(out_dir, store) :
+    files = {}
+    for root, _, all_files in os.walk(out_dir) :
+        for x in all_files :
+            if x.startswith("annotations.db") :
+                continue
+            path = os.path.join(root, x)
+            with open(path, "rb") as fd :
+                files[os.path.relpath(path, out_dir)] = hashlib.md5(fd.read()).hexdigest()
+    tubelets = [(name, store.get_integrity(name)) for name, _, _, _ in store.get_tubelets()]
+    return files, tubelets
+
+
+def run_crop_stage(work_dir, mode, bbox_variation="org") :
+    src_dir = os.path.join(work_dir, "src")
+    out_dir = os.path.join(work_dir, F"out_{mode}_{bbox_variation}")
+    config = {
+        "global_settings" : {
+            "min_duration" : 1, "max_duration" : 2, "output_dir" : out_dir, "bbox_variation" : bbox_variation,
+            "tmp_dir" : os.path.join(work_dir, "tmp"), "processing" : mode,
+            "workers" : {"crop" : 3, "write" : 2},
+            "datasets_to_consider" : [DATASET]
+        },
+        "each_dataset_config" : {
+            DATASET : {"src_dir" : src_dir, "fps" : 10, "bbox_info" : True, "data_format" : "frames",
+                       "inventory_cache_dir" : os.path.join(work_dir, F"inventory_{mode}_{bbox_variation}")}
+        }
+    }
+    config_file = os.path.join(work_dir, F"config_{mode}_{bbox_variation}.json")
+    with open(config_file, "w") as fw :
+        json.dump(config, fw)
+    generator = ActTubeletGenerator(config_file)
+    generator.set_current_dataset_name(DATASET)
+    generator.current_data = create_fixture(src_dir)
+    generator.crop_tubelets()
+    return get_output(out_dir, generator.get_annotation_store())
+
+
+def main() :
+    with tempfile.TemporaryDirectory() as work_dir :
+        for bbox_variation in ["org", "union"] :
+            all_outputs = {mode : run_crop_stage(work_dir, mode, bbox_variation) for mode in MODES}
+            files, tubelets = all_outputs["sequential"]
+            assert len(files) > 0 and len(tubelets) > 0, "crop stage didn't write any tubelets"
+            for mode in MODES :
+                assert all_outputs[mode] == all_outputs["sequential"], F"{mode} output differs from sequential ({bbox_variation})"
+            logger.info(F"same crop stage output for {MODES} with {bbox_variation} bbox, "
+                        F"{len(tubelets)} tubelets, {len(files)} files")
+
+
+if __name__ == "__main__" :
+    main()
@@ -1,15 +1,45 @@
 import os
+from collections import Counter
 from loguru import logger
 
 from lib.utils import utils
 
+# classes with less than this no of train or test samples are removed
+MIN_SAMPLES_PER_SPLIT = 10
+# bin size (in frames) of the tubelet length histograms
+FRAME_LENGTH_BIN_SIZE = 16
+
+
+def read_split_file(file_name) :
+    """
+    read train / test file in one pass into columns
+    each line -> tubelet_name no_of_frames class_idx, tubelet name -> DATASET-...-CLASS-X-Y
+    """
+    columns = {"lines" : [], "names" : [], "datasets" : [], "classes" : [], "lengths" : []}
+    with open(file_name) as fd :
+        for line in fd :
+            line = line.strip()
+            if len(line) == 0 :
+                continue
+            name, length = line.split(" ")[:2]
+            name_parts = name.split("-")
+            columns["lines"].append(line)
+            columns["names"].append(name)
+            columns["datasets"].append(name_parts[0])
+            columns["classes"].append(name_parts[-3])
+            columns["lengths"].append(int(length))
+    return columns
+
+
 class DatasetStats() :
-    def __init__(self, config=dict()):
+    def __init__(self, config=None):
         logger.info(F"Initialized Dataset Stats")
-        if len(config) == 0 :
-            config["DATASETS_TO_CONSIDER"] = "ALL"
+        config = dict(config) if config is not None else dict()
+        # "ALL" or list of dataset names (ex. ["KTH", "VIRAT"])
+        config.setdefault("DATASETS_TO_CONSIDER", "ALL")
+        config.setdefault("FRAME_LENGTH_BIN_SIZE", FRAME_LENGTH_BIN_SIZE)
         self.config = config
-    
+
     def __call__(self, tubelet_dataset_dir, class_to_include=[], key_word="filtered"):
         train_file = os.path.join(tubelet_dataset_dir,"train.txt")
         test_file = os.path.join(tubelet_dataset_dir,"test.txt")
@@ -20,96 +50,101 @@ class DatasetStats() :
         assert(utils.check_if_file_exists(class_list_file)),F"{class_list_file} not found"
 
         logger.info(F"classes to include {class_to_include}, key_word {key_word}")
-        
-        with open(train_file) as fd :
-            train_data = fd.readlines()
-            train_data = [x.strip() for x in train_data]
-        
-        with open(test_file) as fd :
-            test_data = fd.readlines()
-            test_data = [x.strip() for x in test_data]
-        
+
+        splits = {
+            "train" : read_split_file(train_file),
+            "test" : read_split_file(test_file)
+        }
+
         with open(class_list_file) as fd :
             class_list_data = fd.readlines()
             class_list_data = [x.strip() for x in class_list_data]
-        
-        logger.info(F"{len(train_data)} train samples, {len(test_data)} test samples, {len(class_list_data)} classes")
 
-        classes_to_remove = []
+        logger.info(F"{len(splits['train']['lines'])} train samples, {len(splits['test']['lines'])} test samples, {len(class_list_data)} classes")
+
+        # per dataset filtering, the lines of the other datasets are dropped before computing the stats
+        datasets_to_consider = self.config["DATASETS_TO_CONSIDER"]
+        if datasets_to_consider != "ALL" :
+            datasets_to_consider = set(datasets_to_consider)
+            logger.info(F"considering only the datasets {sorted(datasets_to_consider)}")
+            for split_name, columns in splits.items() :
+                keep = [d in datasets_to_consider for d in columns["datasets"]]
+                splits[split_name] = {k : [x for x, m in zip(v, keep) if m] for k, v in columns.items()}
+
+        # samples per class, single pass over each split
+        class_counts = {split_name : Counter(columns["classes"]) for split_name, columns in splits.items()}
 
-        if self.config["DATASETS_TO_CONSIDER"] != "ALL" :
-            # pass # TODO - NEED TO FIGURE IT OUT
-            raise NotImplementedError("Dataset specific stats are yet to be implemented")
+        classes_to_remove = set()
+        for each_class in class_list_data :
+            n_train, n_test = class_counts["train"][each_class], class_counts["test"][each_class]
+            if n_train < MIN_SAMPLES_PER_SPLIT or n_test < MIN_SAMPLES_PER_SPLIT :
+                logger.warning(F"no samples for {each_class}, train {n_train}, test {n_test}")
+                classes_to_remove.add(each_class)
+
+        # removing the classes with low samples
+        if len(class_to_include) == 0 :
+            class_list_data_filtered = [x for x in class_list_data if x not in classes_to_remove]
         else :
-            samples_per_class = {
-                "activities" : [],
-                "train" : [],
-                "test" : [],
-                "total" : []
+            class_list_data_filtered = [x for x in class_list_data if x in class_to_include]
+
+        # old class name -> new class idx
+        new_class_idx = {x : idx for idx, x in enumerate(class_list_data_filtered)}
+
+        samples_per_class = {
+            "activities" : [],
+            "train" : [],
+            "test" : [],
+            "total" : [],
+            "datasets" : {},
+            "frame_length_histogram" : {}
+        }
+
+        filtered_lines = {}
+        bin_size = self.config["FRAME_LENGTH_BIN_SIZE"]
+        for split_name, columns in splits.items() :
+            filtered_lines[split_name] = []
+            histogram = Counter()
+            for name, dataset, cls, length in zip(columns["names"], columns["datasets"], columns["classes"], columns["lengths"]) :
+                if cls not in new_class_idx :
+                    continue
+                # filtered data still has old idx
+                filtered_lines[split_name].append(F"{name} {length - 1} {new_class_idx[cls]}")
+                histogram[(length // bin_size) * bin_size] += 1
+                dataset_stats = samples_per_class["datasets"].setdefault(dataset, {"train" : Counter(), "test" : Counter(), "frame_length_histogram" : Counter()})
+                dataset_stats[split_name][cls] += 1
+                dataset_stats["frame_length_histogram"][(length // bin_size) * bin_size] += 1
+            samples_per_class["frame_length_histogram"][split_name] = dict(sorted(histogram.items()))
+
+        logger.info(F"train_data_filtered {len(filtered_lines['train'])} \
+            test_data_filtered {len(filtered_lines['test'])} \
+            class_list_data_filtered {len(class_list_data_filtered)}")
+
+        for each_class in class_list_data_filtered :
+            n_train, n_test = class_counts["train"][each_class], class_counts["test"][each_class]
+            samples_per_class["train"].append(n_train)
+            samples_per_class["test"].append(n_test)
+            samples_per_class["total"].append(n_train + n_test)
+            samples_per_class["activities"].append(each_class)
+            logger.info(F"each_class {each_class} , train {n_train} test {n_test}")
+
+        for dataset, dataset_stats in samples_per_class["datasets"].items() :
+            samples_per_class["datasets"][dataset] = {
+                "train" : dict(dataset_stats["train"]),
+                "test" : dict(dataset_stats["test"]),
+                "total" : sum(dataset_stats["train"].values()) + sum(dataset_stats["test"].values()),
+                "frame_length_histogram" : dict(sorted(dataset_stats["frame_length_histogram"].items()))
             }
-            
-            for each_class in class_list_data :
-                cl_train_samples = [x for x in train_data if x.split(" ")[0].split("-")[-3] == each_class]
-                cl_test_samples = [x for x in test_data if x.split(" ")[0].split("-")[-3] == each_class]
-                if len(cl_train_samples) < 10 or len(cl_test_samples) < 10 :
-                    logger.warning(F"no samples for {each_class.strip()}, train {len(cl_train_samples)}, test {len(cl_test_samples)}")
-                    classes_to_remove.append(each_class)
-                    continue # not adding these classes to statistics     
-        
-            # removing the classes with low samples
-            if len(class_to_include) == 0:
-                train_data_filtered = [x for x in train_data if x.split(" ")[0].split("-")[-3] not in classes_to_remove]
-                test_data_filtered = [x for x in test_data if x.split(" ")[0].split("-")[-3] not in classes_to_remove]
-                class_list_data_filtered = [ x for x in class_list_data if x not in classes_to_remove]
-            else :
-                train_data_filtered = [x for x in train_data if x.split(" ")[0].split("-")[-3] in class_to_include]
-                test_data_filtered = [x for x in test_data if  x.split(" ")[0].split("-")[-3] in class_to_include]
-                class_list_data_filtered = [ x for x in class_list_data if x in class_to_include]                
-
-            logger.info(F"train_data_filtered {len(train_data_filtered)} \
-                test_data_filtered {len(test_data_filtered)} \
-                class_list_data_filtered {len(class_list_data_filtered)}")
-            
-            for each_class in class_list_data_filtered :
-                cl_train_samples = [x for x in train_data_filtered if x.split(" ")[0].split("-")[-3] == each_class]
-                cl_test_samples = [x for x in test_data_filtered if x.split(" ")[0].split("-")[-3] == each_class]
-
-                samples_per_class["train"].append(len(cl_train_samples))
-                samples_per_class["test"].append(len(cl_test_samples))
-                samples_per_class["total"].append(len(cl_train_samples) + len(cl_test_samples))
-                samples_per_class["activities"].append(each_class)
-            
-                logger.info(F"each_class {each_class} , train {len(cl_train_samples)} test {len(cl_test_samples)}")
-            
-            # replacing the class numbers to filtered ones
-            def new_class_idx (old_cls_idx) :
-                cls_name = class_list_data[int(old_cls_idx)]
-                return class_list_data_filtered.index(cls_name)
-            
-            train_data_filtered_updated_idx = []
-            test_data_filtered_updated_idx = []
-
-            for each_line in train_data_filtered : # filtered data still has old idx
-                old_cls_idx = each_line.split(" ")[-1]
-                new_line = F"{each_line.split(' ')[0]} {int(each_line.split(' ')[1]) - 1} {new_class_idx(old_cls_idx)}"
-                train_data_filtered_updated_idx.append(new_line)
-
-            for each_line in test_data_filtered :
-                old_cls_idx = each_line.split(" ")[-1]
-                new_line = F"{each_line.split(' ')[0]} {int(each_line.split(' ')[1]) - 1} {new_class_idx(old_cls_idx)}"
-                test_data_filtered_updated_idx.append(new_line)                
-
-                    
-            
-            with open(os.path.join(tubelet_dataset_dir,F"train_{key_word}.txt"),"w") as fw :
-                fw.writelines([F"{x}\n" for x in train_data_filtered_updated_idx])
-
-            with open(os.path.join(tubelet_dataset_dir,F"test_{key_word}.txt"),"w") as fw :
-                fw.writelines([ F"{x}\n" for x in test_data_filtered_updated_idx])
-            
-            with open(os.path.join(tubelet_dataset_dir,F"class_list_{key_word}.txt"),"w") as fw :
-                fw.writelines([F"{x}\n" for x in class_list_data_filtered])
-            
-            logger.info(F"filtered data is written to {tubelet_dataset_dir}")
-
-        return samples_per_class
\ No newline at end of file
+            logger.info(F"{dataset} : train {sum(dataset_stats['train'].values())}, test {sum(dataset_stats['test'].values())}")
+
+        with open(os.path.join(tubelet_dataset_dir,F"train_{key_word}.txt"),"w") as fw :
+            fw.writelines([F"{x}\n" for x in filtered_lines["train"]])
+
+        with open(os.path.join(tubelet_dataset_dir,F"test_{key_word}.txt"),"w") as fw :
+            fw.writelines([ F"{x}\n" for x in filtered_lines["test"]])
+
+        with open(os.path.join(tubelet_dataset_dir,F"class_list_{key_word}.txt"),"w") as fw :
+            fw.writelines([F"{x}\n" for x in class_list_data_filtered])
+
+        logger.info(F"filtered data is written to {tubelet_dataset_dir}")
+
+        return samples_per_class
@@ -0,0 +1,83 @@
+"""
+Compare the background subtraction localizer against the deep person detector
+
+For each frames dir both the localizers are run and the following are reported
+- run time of each localizer and the speedup
+- coverage -> no of frames with a box from each localizer
+- mean IoU and % of frames with IoU >= 0.5 on the frames where both have a box
+  (deep detector is taken as the reference)
+
+usage
+python -m lib.analysis.localizer_comparison <frames_dir> [<frames_dir> ...]
+"""
+
+import os
+import sys
+import json
+import time
+from loguru import logger
+
+from lib.utils import person_detector, bg_subtraction_localizer
+
+
+def iou(box_a, box_b) :
+    x0 = max(box_a[0], box_b[0])
+    y0 = max(box_a[1], box_b[1])
+    x1 = min(box_a[2], box_b[2])
+    y1 = min(box_a[3], box_b[3])
+    intersection = max(0, x1 - x0) * max(0, y1 - y0)
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def compare_localizers(frames_dir, input_size=None) :
+    t_start = time.perf_counter()
+    detector_boxes = person_detector.get_person_bboxes_from_dir(frames_dir, input_size)
+    detector_time = time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    bg_boxes = bg_subtraction_localizer.get_person_bboxes_from_dir(frames_dir)
+    bg_time = time.perf_counter() - t_start
+
+    common_frames = [x for x in detector_boxes.keys() if x in bg_boxes]
+    all_iou = [iou(detector_boxes[x], bg_boxes[x]) for x in common_frames]
+
+    return {
+        "frames_dir" : frames_dir,
+        "no_of_frames" : len(os.listdir(frames_dir)),
+        "detector_frames" : len(detector_boxes),
+        "bg_subtraction_frames" : len(bg_boxes),
+        "common_frames" : len(common_frames),
+        "mean_iou" : sum(all_iou) / len(all_iou) if len(all_iou) > 0 else 0.0,
+        "iou_50" : len([x for x in all_iou if x >= 0.5]) / len(all_iou) if len(all_iou) > 0 else 0.0,
+        "detector_time" : detector_time,
+        "bg_subtraction_time" : bg_time,
+        "speedup" : detector_time / bg_time if bg_time > 0 else 0.0
+    }
+
+
+def main(frames_dirs) :
+    all_results = []
+    for frames_dir in frames_dirs :
+        result = compare_localizers(frames_dir)
+        logger.info(F"{os.path.basename(os.path.normpath(frames_dir))} : mean IoU {result['mean_iou']:.3f}, "
+                    F"IoU>=0.5 {100 * result['iou_50']:.1f}%, coverage {result['bg_subtraction_frames']}/{result['detector_frames']}, "
+                    F"speedup {result['speedup']:.1f}x")
+        all_results.append(result)
+
+    total_detector_time = sum(x["detector_time"] for x in all_results)
+    total_bg_time = sum(x["bg_subtraction_time"] for x in all_results)
+    total_common = sum(x["common_frames"] for x in all_results)
+    if total_common > 0 and total_bg_time > 0 :
+        logger.info(F"overall : mean IoU {sum(x['mean_iou'] * x['common_frames'] for x in all_results) / total_common:.3f}, "
+                    F"speedup {total_detector_time / total_bg_time:.1f}x")
+
+    with open("localizer_comparison.json", "w") as fw :
+        json.dump(all_results, fw)
+    return all_results
+
+
+if __name__ == "__main__" :
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+"""
+Compare the VIRAT annotation parsing against the baseline lookup
+
+The baseline process_each_file looked up every frame of every activity with list.index on the ts0 list
+of the track and split the g0 string of each frame, the processor now indexes each track once per file
+(searchsorted on the sorted frames, g0 parsed in one go). Both are run on all the json files of a
+processed annotation dir (train + validate) in the current process, the outputs are checked to be the same
+and the following are reported
+- parse time of the baseline and the processor, speedup
+- no of files, activities and boxes
+
+The processor is timed on the json files, i.e without the npz cache (the cache is faster still).
+
+usage
+python -m lib.analysis.virat_parse_benchmark [<processed_annotations_dir>]
+    without a dir a synthetic annotation dir is generated (see create_synthetic_annotations)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+from loguru import logger
+
+from lib.processors.virat_dataset_processor import ViratDatasetProcessor
+
+
+def baseline_process_each_file(file_path, classes_to_include=None) :
+    """ process_each_file of the baseline (list.index per frame, one g0 string split per frame) """
+    with open(file_path) as fd :
+        data = json.load(fd)
+    file_name = os.path.basename(file_path).split(".")[0]
+    activities_in_file = []
+    for track_id , track_act_info in data['activity'].items() :
+        for each_act in track_act_info :
+            frame_range = each_act["tsr0"]
+            activity = each_act["activity"]
+            bbox_info = {}
+            for frame_idx in range(min(frame_range), max(frame_range)) :
+                try :
+                    bbox_idx = data["bbox"][F"{track_id}"]["ts0"].index(frame_idx)
+                    bbox = data["bbox"][F"{track_id}"]["g0"][bbox_idx]
+                    bbox_info[F"img_{frame_idx:05d}"] = [int(x) for x in bbox.split(" ")]
+                except Exception as e:
+                    logger.info(F"Unable to get bbox_info  tracker id {track_id} for {frame_idx} of {activity} in {file_name} failed with {e}")
+            if classes_to_include is not None and activity not in classes_to_include :
+                continue
+            activities_in_file.append({
+                    "start_f_no": min(frame_range),
+                    "end_f_no": max(frame_range),
+                    "activity": activity,
+                    "file_name": file_name,
+                    "bbox_info": bbox_info
+                    })
+    return activities_in_file
+
+
+def create_synthetic_annotations(out_dir, no_of_files=6, no_of_tracks=20, no_of_frames=9000, acts_per_track=20, seed=0) :
+    """ processed annotation dir (train / validate json files) with long tracks, ~1% of the frames without a box """
+    rng = random.Random(seed)
+    classes = ["activity_walking", "activity_standing", "activity_carrying", "vehicle_turning_left"]
+    for idx in range(no_of_files) :
+        split_dir = os.path.join(out_dir, "train" if idx % 3 != 2 else "validate")
+        os.makedirs(split_dir, exist_ok=True)
+        bbox, activity = {}, {}
+        for track_id in range(no_of_tracks) :
+            frames = [f for f in range(no_of_frames) if rng.random() > 0.01]
+            bbox[str(track_id)] = {
+                "ts0" : frames,
+                "g0" : [F"{rng.randint(0, 500)} {rng.randint(0, 500)} {rng.randint(500, 900)} {rng.randint(500, 900)}" for _ in frames]
+            }
+            activity[str(track_id)] = []
+            for _ in range(acts_per_track) :
+                start = rng.randint(0, no_of_frames - 1000)
+                activity[str(track_id)].append({"activity" : rng.choice(classes), "tsr0" : [start, start + rng.randint(50, 900)]})
+        with open(os.path.join(split_dir, F"VIRAT_S_{idx:06d}.json"), "w") as fw :
+            json.dump({"activity" : activity, "bbox" : bbox}, fw)
+    return out_dir
+
+
+def main(annotation_dir) :
+    config = {
+        "processed_annotations_dir" : annotation_dir,
+        "src_dir" : annotation_dir,
+        "bbox_info" : True,
+        "data_format" : "video",
+        "classes_to_include" : ["activity_walking", "activity_standing", "activity_carrying"]
+    }
+    all_files = sorted(os.path.join(annotation_dir, split, x) for split in ["train", "validate"]
+                       for x in os.listdir(os.path.join(annotation_dir, split)) if x.endswith(".json"))
+    processor = ViratDatasetProcessor(config)
+    # per frame / per activity logs are not part of the comparison
+    for name in ["lib", __name__] :
+        logger.disable(name)
+
+    t_start = time.perf_counter()
+    baseline = [baseline_process_each_file(x, config["classes_to_include"]) for x in all_files]
+    baseline_time = time.perf_counter() - t_start
+
+    cache_files = [F"{os.path.splitext(x)[0]}.npz" for x in all_files]
+    assert not any(os.path.isfile(x) for x in cache_files), "remove the npz cache files to time the json path"
+    t_start = time.perf_counter()
+    current = [processor.process_each_file(x) for x in all_files]
+    current_time = time.perf_counter() - t_start
+    for name in ["lib", __name__] :
+        logger.enable(name)
+
+    same = all([x.to_dict() for x in c] == b for c, b in zip(current, baseline))
+    result = {
+        "files" : len(all_files),
+        "activities" : sum(len(x) for x in baseline),
+        "boxes" : sum(len(act["bbox_info"]) for x in baseline for act in x),
+        "baseline_time" : baseline_time,
+        "current_time" : current_time,
+        "speedup" : baseline_time / current_time if current_time > 0 else 0.0,
+        "same_output" : same
+    }
+    logger.info(F"{result['files']} files, {result['activities']} activities, {result['boxes']} boxes : "
+                F"baseline {baseline_time:.2f} sec, current {current_time:.2f} sec, speedup {result['speedup']:.1f}x, "
+                F"same output {same}")
+    return result
+
+
+if __name__ == "__main__" :
+    if len(sys.argv) > 1 :
+        main(sys.argv[1])
+    else :
+        with tempfile.TemporaryDirectory() as tmp_dir :
+            main(create_synthetic_annotations(tmp_dir))
@@ -13,17 +13,29 @@ Labels of interest are
 Steps to extract tracklets
 1. Get the Unique person Id's in the given JSON file 
 2. for each person get the list of activities, respective frames and bboxes
+3. sort each person/activity track by frame and split it into contiguous runs (gap < 3 frames)
+
+Label files are processed in parallel (config num_workers, chunksize)
 """
 
 import os
 import json
 from loguru import logger
-import pybboxes
 import random
+import numpy as np
 
 import cv2
 import multiprocessing
 
+from lib.utils import utils
+from lib.utils.activity import Activity
+
+try :
+    import orjson
+    json_loads = orjson.loads
+except ImportError :
+    json_loads = json.loads
+
 class JRDBActDatasetProcessor() :
     def __init__(self, config) :
         logger.info(F"initialized JRDBAct Dataset processor")
@@ -38,87 +50,96 @@ class JRDBActDatasetProcessor() :
         return self.process_jrdb_annotations()
     
     def process_jrdb_annotations(self) :
-        p_groups = {}
-        for f_name in os.listdir(self.config['labels_dir']) :
-            logger.info(F"processing {f_name}")
-            f_name = os.path.join(self.config['labels_dir'],f_name)
-
-            with open(f_name) as fd :
-                file_data = json.load(fd)
-            
-            for _, image_data in file_data["labels"].items() : # this is a annotations for each image with mutliple people
-                for each_annotation in image_data :
-                    p_id = each_annotation["label_id"].split(":")[-1]
-                    activity_label = [ x.lower() for x in each_annotation.get("action_label",{}).keys()]
-
-                    if len(activity_label) == 0 :
-                        continue # skip there there are no activities 
-                
-                    frame_no = each_annotation["file_id"]
-                    bbox = each_annotation["box"]
-                    if bbox[2] < 10 or bbox[3] < 10 : # 
-                        continue # don't process bboxes with height or width less than 10
-
-                    for act in activity_label :
-                        if self.classes_to_include is not None and act not in self.classes_to_include :
-                            continue # skip if activity is not in classes_to_include                        
-                        data_of_intrest = {
-                            "file_name" : os.path.basename(f_name),
-                            "person_id" : p_id,
-                            "activity" : act,
-                            "frame_no" : frame_no.replace(".jpg",""),
-                            "bbox" : pybboxes.convert_bbox(bbox, from_type='coco', to_type='voc')
-                        }
-                        
-                        if(p_groups.get(F"{p_id}_{act}",None) == None) :
-                            p_groups[F"{p_id}_{act}"] = [data_of_intrest]
-                        else :
-                            p_groups[F"{p_id}_{act}"].append(data_of_intrest)
-        all_p_ids = list(p_groups.keys())
-
-        p_all_activities = []
-        for _p_id in all_p_ids :
-            c_activity = [p_groups[_p_id][0]]
-            for act in p_groups[_p_id][1:] :
-                # print(act["frame_no"]) 
-                if act['activity'] == c_activity[-1]['activity'] and \
-                        int(act["frame_no"]) - int(c_activity[-1]["frame_no"]) < 3:
-                    c_activity.append(act)
+        # label files are processed in parallel, results are merged in the same order as the files
+        all_files = [os.path.join(self.config['labels_dir'],f_name) for f_name in os.listdir(self.config['labels_dir'])]
+        all_results = utils.run_in_executor(self.process_label_file, all_files,
+                                            num_workers=self.config.get('num_workers', None),
+                                            chunksize=self.config.get('chunksize', 1))
+        out = {}
+        for file_activities in all_results :
+            for video_name, act_info in file_activities :
+                if out.get(video_name,None) != None :
+                    out[video_name].append(act_info)
                 else :
-                    p_all_activities.append(c_activity)
-                    c_activity = [act]
-            p_all_activities.append(c_activity)
-        logger.info(F"total no of activities are {len(p_all_activities)}")
+                    out[video_name] = [act_info]
+        logger.info(F"total no of activities are {sum([len(x) for x in out.values()])}")
 
-        # converting the activities suitable for getting the tubelets
-        out = {}
-        for each_act in p_all_activities :
-            video_name = each_act[0]['file_name'].split(".")[0]
-            each_act = sorted(each_act, key= lambda x: int(x['frame_no']))
-            bbox_info = {}
-            for _act in each_act :
-                bbox_info[F"img_{int(_act['frame_no']):05d}"] = _act['bbox']
-
-            act_info = {
-                "start_f_no" : each_act[0]['frame_no'],
-                "end_f_no" : each_act[-1]["frame_no"],
-                "activity" : each_act[0]["activity"],
-                "file_name" : video_name,
-                "src_dir" : os.path.join(self.config['src_dir'],F"image_{video_name.split('_')[-1][-1]}","_".join(video_name.split("_")[:-1])),
-                "bbox_info" : bbox_info
-            }
-
-            if out.get(video_name,None) != None :
-                out[video_name].append(act_info)
-            else :
-                out[video_name] = [act_info]
-        
         # with open("jrdb-act-ex.json","w") as fw :
         #     json.dump(out,fw)
         return out
 
+    def process_label_file(self, f_name) :
+        """
+        get the activities from a single label file
+        returns list of (video_name, act_info)
+        """
+        logger.info(F"processing {os.path.basename(f_name)}")
+        with open(f_name, "rb") as fd :
+            file_data = json_loads(fd.read())
+
+        p_ids = []
+        acts = []
+        frame_nos = []
+        boxes = []
+        for _, image_data in file_data["labels"].items() : # this is a annotations for each image with mutliple people
+            for each_annotation in image_data :
+                activity_label = [ x.lower() for x in each_annotation.get("action_label",{}).keys()]
+                if len(activity_label) == 0 :
+                    continue # skip there there are no activities 
+
+                bbox = each_annotation["box"]
+                if bbox[2] < 10 or bbox[3] < 10 : # 
+                    continue # don't process bboxes with height or width less than 10
+
+                for act in activity_label :
+                    if self.classes_to_include is not None and act not in self.classes_to_include :
+                        continue # skip if activity is not in classes_to_include
+                    p_ids.append(each_annotation["label_id"].split(":")[-1])
+                    acts.append(act)
+                    frame_nos.append(each_annotation["file_id"].replace(".jpg",""))
+                    boxes.append(bbox)
+
+        if len(p_ids) == 0 :
+            return []
+
+        # coco (x, y, w, h) to voc (x0, y0, x1, y1) for all the boxes at once
+        # same as pybboxes.convert_bbox i.e x, y, w and h are rounded (half to even) individually
+        boxes = np.rint(np.asarray(boxes, dtype=np.float64)).astype(np.int64)
+        boxes[:, 2:] = boxes[:, :2] + boxes[:, 2:]
+
+        # group by person and activity, sorted by frame within each group
+        frames = np.array([int(x) for x in frame_nos], dtype=np.int64)
+        group_keys, group_idx = np.unique(np.array([F"{p}_{a}" for p, a in zip(p_ids, acts)]), return_inverse=True)
+        order = np.lexsort((frames, group_idx))
+        sorted_groups = group_idx[order]
+        sorted_frames = frames[order]
+
+        # new track segment starts when the group changes or the gap between frames is >= 3
+        new_segment = np.ones(len(order), dtype=bool)
+        new_segment[1:] = (sorted_groups[1:] != sorted_groups[:-1]) | (np.diff(sorted_frames) >= 3)
+        segment_starts = np.flatnonzero(new_segment)
+        segment_ends = np.append(segment_starts[1:], len(order))
+
+        video_name = os.path.basename(f_name).split(".")[0]
+        src_dir = os.path.join(self.config['src_dir'],F"image_{video_name.split('_')[-1][-1]}","_".join(video_name.split("_")[:-1]))
+        out = []
+        for seg_start, seg_end in zip(segment_starts, segment_ends) :
+            rows = order[seg_start:seg_end]
+            # converting the activities suitable for getting the tubelets
+            act_info = Activity(
+                acts[rows[0]],
+                frame_nos[rows[0]],
+                frame_nos[rows[-1]],
+                frames=frames[rows],
+                boxes=boxes[rows],
+                file_name=video_name,
+                src_dir=src_dir
+            )
+            out.append((video_name, act_info))
+        return out
+
 
-    def get_train_test_split(self, dataset_dir) :
+    def get_train_test_split(self, dataset_dir, db_path=None) :
         """
         JRDB-Act doesn't have train and validation test.
         So we take the all the generated tubelets and split them into 75% (train) to 25% (test)
@@ -127,7 +148,7 @@ class JRDBActDatasetProcessor() :
         dataset_dir -> root dataset with jrbdact tubeletes
         """
         # get all the tubelets
-        all_tubelets = [ x for x in os.listdir(dataset_dir) if os.path.isdir(os.path.join(dataset_dir,x))]
+        all_tubelets = utils.list_tubelets(dataset_dir, db_path)
 
         # filter the jrdbact tubelets
         jrdbact_tubelets = [x for x in all_tubelets if x.split("-")[0]=="JRDBACT"]
@@ -4,6 +4,9 @@ import random
 
 from loguru import logger
 
+from lib.utils import utils
+from lib.utils.inventory import SourceInventory
+
 class MCADDatasetProcessor() :
     def __init__(self,config):
         logger.info("Initalized the MCAD dataset processor")
@@ -36,11 +39,14 @@ class MCADDatasetProcessor() :
 
     def __call__(self):
         all_activites = {}
-        all_id_dirs = os.listdir(self.config["src_dir"])
+        # src_dir -> id dirs -> videos, scanned once and cached
+        inventory = SourceInventory(self.config["src_dir"], self.config.get("inventory_cache_dir", None))
+        inventory.scan(max_depth=1)
+        all_id_dirs = inventory.listdir(self.config["src_dir"])
         # filter files if any and get me only dirs
-        all_id_dirs = [x for x in all_id_dirs if os.path.isdir(os.path.join(self.config["src_dir"],x))]
+        all_id_dirs = [x for x in all_id_dirs if inventory.isdir(os.path.join(self.config["src_dir"],x))]
         for each_id_dir in all_id_dirs :
-            all_videos = os.listdir(os.path.join(self.config["src_dir"], each_id_dir))
+            all_videos = inventory.listdir(os.path.join(self.config["src_dir"], each_id_dir))
             for each_video in all_videos :
                 video_full_path = os.path.join(self.config["src_dir"],each_id_dir,each_video)
                 activity = self.LABEL_MATCHER.get(each_video.split("_")[-2])
@@ -53,9 +59,10 @@ class MCADDatasetProcessor() :
                         "file_name" : video_full_path
                     }
                 ]
+        inventory.save()
         return all_activites
 
-    def get_train_test_split(self, dataset_dir) :
+    def get_train_test_split(self, dataset_dir, db_path=None) :
         """
         MCAD doesn't have train and validation test.
         So we take the all the generated tubelets and split them into 75% (train) to 25% (test)
@@ -64,7 +71,7 @@ class MCADDatasetProcessor() :
         dataset_dir -> root dataset with mcad tubeletes
         """
         # get all the tubelets
-        all_tubelets = [ x for x in os.listdir(dataset_dir) if os.path.isdir(os.path.join(dataset_dir,x))]
+        all_tubelets = utils.list_tubelets(dataset_dir, db_path)
 
         # filter the jrdbact tubelets
         mcad_tubelets = [x for x in all_tubelets if x.split("-")[0]=="MCAD"]
@@ -4,6 +4,9 @@ from typing import Any
 
 from loguru import logger
 
+from lib.utils import utils
+from lib.utils.inventory import SourceInventory
+
 
 class MMActDatasetProcessor() :
     def __init__(self, config) :
@@ -16,15 +19,18 @@ class MMActDatasetProcessor() :
         
     def __call__(self):
         all_activities = {}
-        all_subject_dirs = os.listdir(self.config["src_dir"])
+        # src_dir -> subject -> cam -> scene -> session -> videos, scanned once and cached
+        inventory = SourceInventory(self.config["src_dir"], self.config.get("inventory_cache_dir", None))
+        inventory.scan(max_depth=4)
+        all_subject_dirs = inventory.listdir(self.config["src_dir"])
         for each_subject_dir in all_subject_dirs :
-            cam_dirs = os.listdir(os.path.join(self.config["src_dir"],each_subject_dir))
+            cam_dirs = inventory.listdir(os.path.join(self.config["src_dir"],each_subject_dir))
             for each_cam_dir in cam_dirs :
-                scene_dirs = os.listdir(os.path.join(self.config["src_dir"],each_subject_dir,each_cam_dir))
+                scene_dirs = inventory.listdir(os.path.join(self.config["src_dir"],each_subject_dir,each_cam_dir))
                 for each_scene_dir in scene_dirs :
-                    all_sessions = os.listdir(os.path.join(self.config["src_dir"],each_subject_dir, each_cam_dir, each_scene_dir))
+                    all_sessions = inventory.listdir(os.path.join(self.config["src_dir"],each_subject_dir, each_cam_dir, each_scene_dir))
                     for each_session in all_sessions :
-                        all_videos = os.listdir(os.path.join(self.config["src_dir"],each_subject_dir, each_cam_dir, each_scene_dir,each_session))
+                        all_videos = inventory.listdir(os.path.join(self.config["src_dir"],each_subject_dir, each_cam_dir, each_scene_dir,each_session))
                         for each_video in all_videos :
                             video_full_name = os.path.join(self.config["src_dir"],each_subject_dir, each_cam_dir, each_scene_dir,each_session, each_video)
                             video_subpath = os.path.join(each_subject_dir, each_cam_dir, each_scene_dir,each_session, each_video)
@@ -39,14 +45,15 @@ class MMActDatasetProcessor() :
                                     "file_name" : video_full_name
                                 }
                             ]
+        inventory.save()
         return all_activities
 
-    def get_train_test_split(self, dataset_dir) :
+    def get_train_test_split(self, dataset_dir, db_path=None) :
         """
         using cross subject evaluation split from mmact
         """
 
-        all_tubelets = [ x for x in os.listdir(dataset_dir) if os.path.isdir(os.path.join(dataset_dir,x))]
+        all_tubelets = utils.list_tubelets(dataset_dir, db_path)
         #filter the mmact tubelets
         ucfarg_tubelets = [x for x in all_tubelets if x.split("-")[0]=="MMACT"]
         training_subject_ids = list(range(1,17))
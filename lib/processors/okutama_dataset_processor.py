@@ -17,6 +17,12 @@ import os
 import json
 from loguru import logger
 import random
+from functools import partial
+import numpy as np
+
+from lib.utils import utils
+from lib.utils.inventory import SourceInventory
+from lib.utils.activity import Activity
 
 class OkutamaDatasetProcessor() :
     def __init__(self, config):
@@ -32,50 +38,74 @@ class OkutamaDatasetProcessor() :
     
     def process_okumata_annotations(self) :
         all_files = [ os.path.join(self.config['labels_dir'],x) for x in os.listdir(self.config['labels_dir'])]
-        all_activity_data = {}
 
-        for f_name in all_files :
-            logger.info(F"processing {os.path.basename(f_name)}")
-            with open(f_name) as fd :
-                data = fd.readlines()
-            
-            unique_ids = list(set([x.split(" ")[0] for x in data]))
-
-            for tid in unique_ids :
-                tid_annotations = [x for x in data if x.split(" ")[0] == tid]
-                unique_acts = list(set([x.split(" ")[-1] for x in tid_annotations]))
-                #process each activity for given tid
-                for act in unique_acts :
-                    tid_act_annotations = [x for x in tid_annotations if x.split(" ")[-1] == act]
-                    tid_act_frames = [int(x.split(" ")[5]) for x in tid_act_annotations]
-                    start_f_no = min(tid_act_frames)
-                    end_f_no = max(tid_act_frames)
-
-                    bbox_info = {}
-                    # get the data for single acitivty based on annotations
-                    for ann in tid_act_annotations :
-                        ann = ann.split(" ")
-                        bbox_info[F"img_{int(ann[5]):05d}"] = [int(x) for x in ann[1:5]]
-
-                    video_name = [ x for x in os.listdir(self.config["src_dir"]) if os.path.splitext(x)[0] == os.path.splitext(os.path.basename(f_name))[0]][0]
-                    activity = act.strip().replace('"','').replace("/","_").replace("\\","")
-                    if self.classes_to_include is not None and activity not in self.classes_to_include :
-                        continue # skip if activity is not in classes_to_include
-                    act_info = {
-                        "start_f_no" : start_f_no,
-                        "end_f_no" : end_f_no,
-                        "activity" : activity,
-                        "file_name" : video_name,
-                        "bbox_info" : bbox_info
-                    }
-
-                    if all_activity_data.get(video_name,None) != None :
-                        all_activity_data[video_name].append(act_info)
-                    else :
-                        all_activity_data[video_name] = [act_info]
+        # index of the videos (name without ext -> video name), instead of listing src_dir for each activity
+        inventory = SourceInventory(self.config["src_dir"], self.config.get("inventory_cache_dir", None))
+        video_index = {}
+        for x in inventory.listdir(self.config["src_dir"]) :
+            video_index.setdefault(os.path.splitext(x)[0], x)
+        inventory.save()
+
+        # label files are processed in parallel, results are merged in the same order as the files
+        all_results = utils.run_in_executor(partial(self.process_label_file, video_index=video_index), all_files,
+                                            num_workers=self.config.get('num_workers', None),
+                                            chunksize=self.config.get('chunksize', 1))
+        all_activity_data = {}
+        for file_activities in all_results :
+            for video_name, act_info in file_activities :
+                if all_activity_data.get(video_name,None) != None :
+                    all_activity_data[video_name].append(act_info)
+                else :
+                    all_activity_data[video_name] = [act_info]
         return all_activity_data
 
-    def get_train_test_split(self, dataset_dir) :
+    def process_label_file(self, f_name, video_index) :
+        """
+        parse a single label file in one pass
+        lines are grouped by (track_id, action) and the numeric columns are converted at once
+        returns list of (video_name, act_info)
+        """
+        logger.info(F"processing {os.path.basename(f_name)}")
+        video_name = video_index.get(os.path.splitext(os.path.basename(f_name))[0], None)
+        if video_name is None :
+            logger.warning(F"video for {os.path.basename(f_name)} not found in {self.config['src_dir']}, skipping")
+            return []
+
+        with open(f_name) as fd :
+            data = [x.split(" ") for x in fd.readlines()]
+        data = [x for x in data if len(x) > 5]
+        if len(data) == 0 :
+            return []
+
+        # xmin, ymin, xmax, ymax, frame for all the lines
+        values = np.array([x[1:6] for x in data]).astype(np.int64)
+
+        # group the lines by (track_id, action), action is the last column
+        groups = {}
+        for line_idx, x in enumerate(data) :
+            groups.setdefault((x[0], x[-1]), []).append(line_idx)
+
+        out = []
+        for (_, act), line_idxs in groups.items() :
+            activity = act.strip().replace('"','').replace("/","_").replace("\\","")
+            if self.classes_to_include is not None and activity not in self.classes_to_include :
+                continue # skip if activity is not in classes_to_include
+            act_values = values[line_idxs]
+            tid_act_frames = act_values[:, 4]
+
+            # get the data for single acitivty based on annotations
+            act_info = Activity(
+                activity,
+                int(tid_act_frames.min()),
+                int(tid_act_frames.max()),
+                frames=tid_act_frames,
+                boxes=act_values[:, :4],
+                file_name=video_name
+            )
+            out.append((video_name, act_info))
+        return out
+
+    def get_train_test_split(self, dataset_dir, db_path=None) :
         """
         Okutama doesn't have train and validation test.
         So we take the all the generated tubelets and split them into 75% (train) to 25% (test)
@@ -84,7 +114,7 @@ class OkutamaDatasetProcessor() :
         dataset_dir -> root dataset with okutama tubeletes
         """
         # get all the tubelets
-        all_tubelets = [ x for x in os.listdir(dataset_dir) if os.path.isdir(os.path.join(dataset_dir,x))]
+        all_tubelets = utils.list_tubelets(dataset_dir, db_path)
 
         # filter the jrdbact tubelets
         okutama_tubelets = [x for x in all_tubelets if x.split("-")[0]=="OKUTAMA"]
@@ -3,6 +3,9 @@ import json
 import random
 from loguru import logger
 
+from lib.utils import utils
+from lib.utils.inventory import SourceInventory
+
 
 class UCFARGDatasetProcessor() :
     def __init__(self, config):
@@ -14,19 +17,22 @@ class UCFARGDatasetProcessor() :
         self.classes_to_include = config.get('classes_to_include',None)
 
     def __call__(self) :
-        all_dirs = [os.path.join(self.config["src_dir"],x) for x in os.listdir(self.config["src_dir"])]
+        # src_dir -> subject dirs -> class dirs -> videos, scanned once and cached
+        inventory = SourceInventory(self.config["src_dir"], self.config.get("inventory_cache_dir", None))
+        inventory.scan(max_depth=2)
+        all_dirs = [os.path.join(self.config["src_dir"],x) for x in inventory.listdir(self.config["src_dir"])]
         # get only directories
-        all_dirs = [x for x in all_dirs if os.path.isdir(x)]
+        all_dirs = [x for x in all_dirs if inventory.isdir(x)]
 
         all_activity_data = {}
 
         for dir_name in all_dirs :
-            class_dirs = [os.path.join(dir_name,x) for x in os.listdir(dir_name)]
+            class_dirs = [os.path.join(dir_name,x) for x in inventory.listdir(dir_name)]
             # filter the dirs 
-            class_dirs = [x for x in class_dirs if os.path.isdir(x)]
+            class_dirs = [x for x in class_dirs if inventory.isdir(x)]
 
             for each_class_dir in class_dirs :
-                all_videos = os.listdir(each_class_dir)
+                all_videos = inventory.listdir(each_class_dir)
                 for each_video in all_videos :
                     each_video = os.path.join(each_class_dir,each_video)
                     activity = os.path.basename(each_class_dir)
@@ -37,9 +43,10 @@ class UCFARGDatasetProcessor() :
                         "src_path" : each_video,
                         "file_name" : each_video
                     }]
+        inventory.save()
         return all_activity_data
 
-    def get_train_test_split(self, dataset_dir) :
+    def get_train_test_split(self, dataset_dir, db_path=None) :
         """
         UCFARG doesn't have train and validation test.
         So we take the all the generated tubelets and split them into 75% (train) to 25% (test)
@@ -48,7 +55,7 @@ class UCFARGDatasetProcessor() :
         dataset_dir -> root dataset with okutama tubeletes        
         """
         # get all the tubelets
-        all_tubelets = [ x for x in os.listdir(dataset_dir) if os.path.isdir(os.path.join(dataset_dir,x))]
+        all_tubelets = utils.list_tubelets(dataset_dir, db_path)
 
         # filter the jrdbact tubelets
         ucfarg_tubelets = [x for x in all_tubelets if x.split("-")[0]=="UCFARG"]
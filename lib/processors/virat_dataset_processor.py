@@ -34,6 +34,13 @@ outfile will be in the following format
         }
     }
 }
+
+along with the json, a compact columnar cache (*.npz) is written for each video
+    track_id    -> (N,) int32, rows are sorted by track_id and frame
+    frame       -> (N,) int32
+    boxes       -> (N,4) int16 (int32 if the coordinates don't fit)
+    act_track_id, act_name, act_range -> activity table, (M,) int32, (M,) str, (M,2) int32
+    src_mtime   -> latest mtime of the source yml files, cache is rebuilt if the sources change
 """
 
 import re
@@ -48,12 +55,56 @@ import copy
 import yaml
 import multiprocessing
 from functools import partial
+import time
+import numpy as np
 
 from loguru import logger
 try :
     from lib.utils import utils
+    from lib.utils.activity import Activity
 except Exception as e :
     import utils
+    from activity import Activity
+
+# use the libyaml based loader if available, its an order of magnitude faster than the python loader
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# geom record in KPF format (one record per line)
+# - { geom: {id1: 0, id0: 1, ts0: 0, ts1: 0.00000, g0: 641 416 692 491, src: truth, occlusion: heavy } }
+GEOM_ID1_REGEX = re.compile(r'[{,\s]id1:\s*(-?\d+)\s*[,}]')
+GEOM_TS0_REGEX = re.compile(r'[{,\s]ts0:\s*(-?\d+)\s*[,}]')
+GEOM_G0_REGEX = re.compile(r'[{,\s]g0:\s*(-?\d+(?: +-?\d+)*)\s*[,}]')
+
+def parse_kpf_line(line) :
+    """ parse a single KPF record (line) with the yaml loader, returns None for non record lines """
+    line = line.strip()
+    if not line.startswith("-") :
+        return None
+    records = yaml.load(line, Loader=YAML_LOADER)
+    return records[0] if records else None
+
+def parse_geom_line(line) :
+    """ parse a geom record line without yaml, returns None if the line is not in the expected format """
+    id1 = GEOM_ID1_REGEX.search(line)
+    ts0 = GEOM_TS0_REGEX.search(line)
+    g0 = GEOM_G0_REGEX.search(line)
+    if id1 is None or ts0 is None or g0 is None :
+        return None
+    return {
+        'id1' : int(id1.group(1)),
+        'ts0' : int(ts0.group(1)),
+        'g0' : g0.group(1)
+    }
+
+def iter_kpf_records(fName, key) :
+    """ stream the records with the given key (types, act) from a KPF file, one line at a time """
+    with open(fName) as fd :
+        for line in fd :
+            if key not in line :
+                continue
+            d = parse_kpf_line(line)
+            if d is not None and key in d :
+                yield d
 
 class ViratDatasetProcessor() :
     def __init__(self,config):
@@ -76,19 +127,27 @@ class ViratDatasetProcessor() :
     def update_annotations(self, key, value) :
         self.annotation_data[key] = value
     
-    def process_virat_original_annotations_in_dir(self,dir_name):
-        all_files = os.listdir(dir_name)
-        files_without_ext = list(set([x.split(".")[0] for x in all_files ]))
-        # print(files_without_ext)
+    def run_in_executor(self, func, *iterables) :
+        """
+        map func over iterables on a process pool, results are in the same order as the inputs
+        config -> num_workers (default no of cpus, 1 runs in the current process) and chunksize (default 1)
+        """
+        return utils.run_in_executor(func, *iterables,
+                                     num_workers=self.config.get('num_workers', None),
+                                     chunksize=self.config.get('chunksize', 1))
+
+    def process_virat_original_annotations_in_dir(self,dir_names):
+        # yml files of all the dirs are processed in a single executor
+        all_tasks = []
+        for dir_name in dir_names :
+            all_files = os.listdir(dir_name)
+            files_without_ext = list(set([x.split(".")[0] for x in all_files ]))
+            all_tasks.extend([(dir_name, x) for x in files_without_ext])
 
         # for f_name in files_without_ext :
         #     self.get_actions_per_person(f_name)
 
-        func = partial(self.get_actions_per_person,dir_name)
-        pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-        pool.map(func, files_without_ext)
-        pool.close()
-        pool.join()
+        self.run_in_executor(self.get_actions_per_person, [x[0] for x in all_tasks], [x[1] for x in all_tasks])
         
 
     def process_virat_annotation_files(self, annotation_dir) :
@@ -98,19 +157,23 @@ class ViratDatasetProcessor() :
         assert(utils.check_if_dir_exists(valid_files_dir)), "VIRAT valid files dir {valid_files_dir} not found"
 
         # process both training and validation files and generate the json files
-        self.process_virat_original_annotations_in_dir(train_files_dir)
-        self.process_virat_original_annotations_in_dir(valid_files_dir)
+        self.process_virat_original_annotations_in_dir([train_files_dir, valid_files_dir])
 
         train_files = [ os.path.join(train_files_dir,x) for x in os.listdir(train_files_dir) if x.split(".")[-1] == "json"]
         valid_files = [ os.path.join(valid_files_dir,x) for x in os.listdir(valid_files_dir) if x.split(".")[-1] == "json"]
         
         all_files = train_files + valid_files # combine both train and validation files
 
-        for f_name in all_files :
-            self.process_each_file(f_name)
-        # multi-processing is not working - USING multi-threading instead
-        # with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        #     executor.map(self.process_each_file, all_files)
+        # process_each_file doesn't modify self.annotation_data (it used to, which is why multiprocessing
+        # was not working), the results are returned to the parent and merged here
+        t_start = time.perf_counter()
+        all_results = self.run_in_executor(self.process_each_file, all_files)
+        for f_name, activities_in_file in zip(all_files, all_results) :
+            if activities_in_file is None :
+                continue
+            self.update_annotations(os.path.basename(f_name).split(".")[0]+".mp4", activities_in_file)
+        parse_time = time.perf_counter() - t_start
+        logger.info(F"parsed {len(all_files)} VIRAT annotation files in {parse_time:.2f} sec ({parse_time / max(1, len(all_files)):.3f} sec per file)")
         return self.annotation_data
 
     def get_train_test_split(self) :
@@ -134,69 +197,169 @@ class ViratDatasetProcessor() :
         
         logger.info(F"processing {os.path.basename(file_path)} ..")
 
-        with open(file_path) as fd :
-            data = json.load(fd)
-        
+        file_name = os.path.basename(file_path).split(".")[0]
+        cache_file = os.path.join(os.path.dirname(file_path), F"{file_name}.npz")
+        src_mtime = self.get_source_mtime(os.path.dirname(file_path), file_name)
+
+        if self.is_annotation_cache_valid(cache_file, src_mtime) :
+            # only the activities of classes_to_include and their tracks are taken from the cache
+            activity_table, track_index = self.load_annotation_cache(cache_file)
+        else :
+            with open(file_path) as fd :
+                data = json.load(fd)
+            activity_table = [(track_id, each_act["activity"], each_act["tsr0"]) \
+                                for track_id, track_act_info in data['activity'].items() for each_act in track_act_info]
+            track_index = self.build_track_index(data["bbox"])
+
         # acitivites are sorted with track_id
         # each track_id my contains multiple activities
         activities_in_file = []
-        # print(data["bbox"].keys())
-        for track_id , track_act_info in data['activity'].items() :
-            for each_act in track_act_info :
-                frame_range = each_act["tsr0"]
-                activity = each_act["activity"]
-                # print(frame_range)
-                # print(len(data["bbox"][track_id]["ts0"]))
-                file_name = os.path.basename(file_path).split(".")[0]
-                bbox_info = {}
-                for frame_idx in range(min(frame_range), max(frame_range)) :
-                    try :
-                        bbox_idx = data["bbox"][F"{track_id}"]["ts0"].index(frame_idx) # get index from ts0
-                        bbox = data["bbox"][F"{track_id}"]["g0"][bbox_idx]
-                        bbox_info[F"img_{frame_idx:05d}"] = [int(x) for x in bbox.split(" ")]
-                    except Exception as e:
-                        logger.info(F"Unable to get bbox_info  tracker id {track_id} for {frame_idx} of {activity} in {file_name} failed with {e}")
-                        # raise
-                if self.classes_to_include is not None and activity not in self.classes_to_include :
-                    continue # skip if activity is not in classes_to_include
-                activities_in_file.append({
-                        "start_f_no": min(frame_range),
-                        "end_f_no": max(frame_range),
-                        "activity": activity,
-                        "file_name": file_name,
-                        "bbox_info": bbox_info
-                        })
-        self.update_annotations(os.path.basename(file_path).split(".")[0]+".mp4", activities_in_file)
+        empty_track = (np.empty(0, dtype=np.int64), np.empty((0, 4), dtype=np.int32))
+        for track_id, activity, frame_range in activity_table :
+            if self.classes_to_include is not None and activity not in self.classes_to_include :
+                continue # skip if activity is not in classes_to_include
+            track_frames, track_boxes = track_index.get(F"{track_id}", empty_track)
+
+            # look up all the frames of the activity at once in the sorted frames of the track
+            act_frames = np.arange(min(frame_range), max(frame_range))
+            rows = np.searchsorted(track_frames, act_frames)
+            found = rows < len(track_frames)
+            found[found] = track_frames[rows[found]] == act_frames[found]
+            if not found.all() :
+                logger.info(F"Unable to get bbox_info tracker id {track_id} for {int((~found).sum())} of {len(act_frames)} frames of {activity} in {file_name}")
+
+            activities_in_file.append(Activity(
+                    activity,
+                    min(frame_range),
+                    max(frame_range),
+                    frames=act_frames[found],
+                    boxes=track_boxes[rows[found]],
+                    file_name=file_name
+                    ))
         return activities_in_file
 
+    def build_track_index(self, bbox_data) :
+        """
+        build the index of each track once per file
+        returns {track_id : (frames, boxes)}, frames sorted (ts0) with boxes as int32 array (N x 4) in the same order
+        the g0 strings of a track are parsed in one go
+        """
+        track_index = {}
+        for track_id, track_bbox in bbox_data.items() :
+            frames = np.asarray(track_bbox["ts0"], dtype=np.int64)
+            boxes = np.array(" ".join(track_bbox["g0"]).split(), dtype=np.int32).reshape(-1, 4)
+            # stable sort, so for duplicate frames the first entry is used (same as list.index)
+            order = np.argsort(frames, kind="stable")
+            track_index[track_id] = (frames[order], boxes[order])
+        return track_index
+
+    def get_source_mtime(self, dir_name, filename_without_ext) :
+        """ latest mtime of the source yml files of a video, None if the sources are not available """
+        all_mtimes = [os.path.getmtime(os.path.join(dir_name, F"{filename_without_ext}.{x}.yml")) \
+                        for x in ["activities", "types", "geom"] \
+                        if utils.check_if_file_exists(os.path.join(dir_name, F"{filename_without_ext}.{x}.yml"))]
+        return max(all_mtimes) if len(all_mtimes) > 0 else None
+
+    def is_annotation_cache_valid(self, cache_file, src_mtime) :
+        if not utils.check_if_file_exists(cache_file) :
+            return False
+        if src_mtime is None : # no sources to compare with
+            return True
+        try :
+            with np.load(cache_file) as cache :
+                return float(cache["src_mtime"]) == src_mtime
+        except Exception as e :
+            logger.warning(F"unable to read cache {cache_file}, failed with {e}")
+            return False
+
+    def write_annotation_cache(self, cache_file, person_activities, person_bboxes, src_mtime) :
+        """ write the columnar cache of the parsed annotations (see module doc for the format) """
+        track_ids = [np.full(len(v["ts0"]), int(k), dtype=np.int32) for k, v in person_bboxes.items()]
+        frames = [np.asarray(v["ts0"], dtype=np.int32) for v in person_bboxes.values()]
+        boxes = [np.array(" ".join(v["g0"]).split(), dtype=np.int32).reshape(-1, 4) for v in person_bboxes.values()]
+        track_ids = np.concatenate(track_ids) if len(track_ids) > 0 else np.empty(0, dtype=np.int32)
+        frames = np.concatenate(frames) if len(frames) > 0 else np.empty(0, dtype=np.int32)
+        boxes = np.concatenate(boxes) if len(boxes) > 0 else np.empty((0, 4), dtype=np.int32)
+
+        # sort by track and frame, stable so the first entry of a duplicate frame stays first
+        order = np.lexsort((frames, track_ids))
+        if boxes.size == 0 or (boxes.min() >= np.iinfo(np.int16).min and boxes.max() <= np.iinfo(np.int16).max) :
+            boxes = boxes.astype(np.int16)
+
+        all_acts = [(int(k), act["activity"], act["tsr0"]) for k, v in person_activities.items() for act in v]
+        tmp_file = F"{cache_file}.tmp"
+        with open(tmp_file, "wb") as fw :
+            np.savez(fw,
+                     track_id=track_ids[order],
+                     frame=frames[order],
+                     boxes=boxes[order],
+                     act_track_id=np.array([x[0] for x in all_acts], dtype=np.int32),
+                     act_name=np.array([x[1] for x in all_acts], dtype=str),
+                     act_range=np.array([x[2] for x in all_acts], dtype=np.int32).reshape(-1, 2),
+                     src_mtime=np.float64(src_mtime if src_mtime is not None else -1))
+        os.replace(tmp_file, cache_file)
+
+    def load_annotation_cache(self, cache_file) :
+        """
+        load the activities of classes_to_include and only the tracks used by them from the cache
+        returns activity table [(track_id, activity, [start, end])] and track index (same as build_track_index)
+        """
+        with np.load(cache_file) as cache :
+            act_track_id = cache["act_track_id"]
+            act_name = cache["act_name"]
+            act_range = cache["act_range"]
+            selected = np.isin(act_name, self.classes_to_include) if self.classes_to_include is not None \
+                            else np.ones(len(act_name), dtype=bool)
+            activity_table = [(int(t), str(a), r) for t, a, r in \
+                                zip(act_track_id[selected], act_name[selected], act_range[selected].tolist())]
+
+            track_index = {}
+            needed_tracks = np.unique(act_track_id[selected])
+            if len(needed_tracks) > 0 :
+                track_id = cache["track_id"]
+                frame = cache["frame"]
+                boxes = cache["boxes"]
+                starts = np.searchsorted(track_id, needed_tracks, side="left")
+                ends = np.searchsorted(track_id, needed_tracks, side="right")
+                for t, start, end in zip(needed_tracks.tolist(), starts, ends) :
+                    track_index[F"{t}"] = (frame[start:end], boxes[start:end])
+        return activity_table, track_index
+
     def get_persons_from_types_file(self, fName) :
-        with open(fName) as fd :
-            data = yaml.safe_load(fd)
-        
         person_track_ids = []
-        for d in data :
-            if 'types' in d :
-                # if Person is in cset3
-                if 'Person' in d['types']['cset3'] :
-                    person_track_ids.append(d['types']['id1'])
+        for d in iter_kpf_records(fName, 'types') :
+            # if Person is in cset3
+            if 'Person' in d['types']['cset3'] :
+                person_track_ids.append(d['types']['id1'])
         
         return person_track_ids
 
     def get_bboxes_for_persons(self, geom_file, person_track_ids) :
+        """
+        geom files are huge (100s of MB), so instead of loading the whole file
+        each line (record) is parsed while reading and only the person tracks are kept
+        """
+        person_track_ids = set(person_track_ids)
         person_bboxs = {}
         with open(geom_file) as fd :
-            data = yaml.safe_load(fd)
-            for d in data :
-                if 'geom' in d :
-                    if d['geom']['id1'] in person_track_ids :
-                        if person_bboxs.get(d['geom']['id1'],None) == None :
-                            person_bboxs[d['geom']['id1']] = {
-                                'ts0' : [d['geom']['ts0']],
-                                'g0' : [d['geom']['g0']]
-                            }
-                        else :
-                            person_bboxs[d['geom']['id1']]['ts0'].append(d['geom']['ts0'])
-                            person_bboxs[d['geom']['id1']]['g0'].append(d['geom']['g0'])                 
+            for line in fd :
+                if 'geom' not in line :
+                    continue
+                d = parse_geom_line(line)
+                if d is None : # unexpected format, use the yaml loader for this line
+                    d = parse_kpf_line(line)
+                    if d is None or 'geom' not in d :
+                        continue
+                    d = d['geom']
+                if d['id1'] in person_track_ids :
+                    if person_bboxs.get(d['id1'],None) == None :
+                        person_bboxs[d['id1']] = {
+                            'ts0' : [d['ts0']],
+                            'g0' : [d['g0']]
+                        }
+                    else :
+                        person_bboxs[d['id1']]['ts0'].append(d['ts0'])
+                        person_bboxs[d['id1']]['g0'].append(d['g0'])                 
         return person_bboxs
 
     def get_actions_per_person(self,dir_name,filename_without_ext) :
@@ -206,16 +369,26 @@ class ViratDatasetProcessor() :
         types_file = os.path.join(dir_name,F"{filename_without_ext}.types.yml")
         geom_file = os.path.join(dir_name, F"{filename_without_ext}.geom.yml")
         out_file_name = os.path.join(dir_name, F"{filename_without_ext}.json")
+        cache_file = os.path.join(dir_name, F"{filename_without_ext}.npz")
+        src_mtime = self.get_source_mtime(dir_name, filename_without_ext)
 
         if utils.check_if_file_exists(out_file_name) :
-            # file exists skipping
-            return
+            if self.is_annotation_cache_valid(cache_file, src_mtime) :
+                # file exists skipping
+                return
+            if src_mtime is None or os.path.getmtime(out_file_name) >= src_mtime :
+                # json is up to date, only the cache is missing or stale
+                with open(out_file_name) as fd :
+                    data = json.load(fd)
+                self.write_annotation_cache(cache_file, data["activity"], data["bbox"], src_mtime)
+                return
+            # sources are modified after the json is generated, parse them again
 
         persons_track_ids = self.get_persons_from_types_file(types_file)
         person_bboxes = self.get_bboxes_for_persons(geom_file,persons_track_ids)
+        persons_track_ids = set(persons_track_ids)
         
-        with open(activities_file) as fd :
-            data = yaml.safe_load(fd)
+        data = iter_kpf_records(activities_file, 'act')
         
         person_activities = {}
         for d in data :
@@ -245,6 +418,7 @@ class ViratDatasetProcessor() :
         
         with open(out_file_name,'w') as fw :
             json.dump(out_data, fw)    
+        self.write_annotation_cache(cache_file, person_activities, person_bboxes, src_mtime)
 
 
 
@@ -0,0 +1,231 @@
+"""
+Compact activity record
+
+The processors used to keep the boxes of each activity as {"img_00042" : [x0,y0,x1,y1], ...}
+i.e a string key and a list of python ints per frame, for VIRAT and OKUTAMA this takes several GB.
+Activity keeps the frames as int32 offsets from the first frame and the boxes as an int32 (N x 4) array.
+
+Activity behaves like the legacy activity dict (activity_info['activity'], activity_info.get('src_dir'), ...)
+activity_info['bbox_info'] returns a lazy read only view with the legacy {"img_XXXXX" : [x0,y0,x1,y1]} interface,
+to_dict() converts it to the legacy dict (for json), to_bytes() / from_bytes() is the compact binary form.
+
+usage
+act = Activity("walking", start_f_no, end_f_no, frames=frames, boxes=boxes, file_name=file_name)
+act.get_bbox(42) or act['bbox_info'].get("img_00042")
+
+python -m lib.utils.activity -> compares the peak memory of the legacy dicts and Activity records
+"""
+
+import json
+import struct
+import tracemalloc
+from collections.abc import Mapping, MutableMapping
+import numpy as np
+
+HEADER_SIZE = struct.Struct("<I")
+
+
+def frame_from_key(img_key) :
+    """ img_00042 -> 42 """
+    return int(img_key.split("_")[-1])
+
+
+class BboxInfo(Mapping) :
+    """ lazy read only view of the boxes with the legacy bbox_info interface """
+    __slots__ = ("base", "offsets", "boxes")
+
+    def __init__(self, base, offsets, boxes) :
+        self.base = base
+        self.offsets = offsets
+        self.boxes = boxes
+
+    def find(self, frame_idx) :
+        offset = frame_idx - self.base
+        idx = int(np.searchsorted(self.offsets, offset))
+        if idx < len(self.offsets) and self.offsets[idx] == offset :
+            return idx
+        return None
+
+    def __getitem__(self, img_key) :
+        try :
+            idx = self.find(frame_from_key(img_key))
+        except (ValueError, AttributeError) :
+            idx = None
+        if idx is None :
+            raise KeyError(img_key)
+        return self.boxes[idx].tolist()
+
+    def __iter__(self) :
+        return (F"img_{self.base + x:05d}" for x in self.offsets.tolist())
+
+    def __len__(self) :
+        return len(self.offsets)
+
+    def to_dict(self) :
+        return {F"img_{self.base + x:05d}" : b for x, b in zip(self.offsets.tolist(), self.boxes.tolist())}
+
+
+class Activity(MutableMapping) :
+    __slots__ = ("activity", "start_f_no", "end_f_no", "base", "offsets", "boxes", "extra")
+    FIELDS = ("activity", "start_f_no", "end_f_no")
+
+    def __init__(self, activity, start_f_no=None, end_f_no=None, frames=None, boxes=None, **extra) :
+        """
+        frames -> frame numbers of the boxes, boxes -> (N x 4) [x0,y0,x1,y1]
+        frames need not be sorted, for duplicate frames the last box is kept (same as the legacy dict)
+        any other key of the legacy activity dict (file_name, src_dir, ...) is passed as extra
+        """
+        self.activity = activity
+        self.start_f_no = start_f_no
+        self.end_f_no = end_f_no
+        self.extra = extra
+        self.set_boxes(frames, boxes)
+
+    def set_boxes(self, frames, boxes) :
+        frames = np.asarray(frames if frames is not None else [], dtype=np.int64).reshape(-1)
+        boxes = np.asarray(boxes if boxes is not None else [], dtype=np.int64).reshape(-1, 4)
+        assert len(frames) == len(boxes), F"{len(frames)} frames for {len(boxes)} boxes"
+        order = np.argsort(frames, kind="stable")
+        frames, boxes = frames[order], boxes[order]
+        keep = np.ones(len(frames), dtype=bool)
+        keep[:-1] = frames[1:] != frames[:-1]
+        frames, boxes = frames[keep], boxes[keep]
+        self.base = int(frames[0]) if len(frames) > 0 else 0
+        self.offsets = (frames - self.base).astype(np.int32)
+        self.boxes = boxes.astype(np.int32)
+
+    def set_bbox_info(self, bbox_info) :
+        """ from the legacy {"img_XXXXX" : [x0,y0,x1,y1]} dict, frames without a box (None) are dropped """
+        items = [(frame_from_key(k), v) for k, v in bbox_info.items() if v is not None]
+        self.set_boxes([k for k, _ in items], [v for _, v in items])
+
+    @classmethod
+    def from_dict(cls, activity_info) :
+        """ from the legacy activity dict """
+        activity_info = dict(activity_info)
+        bbox_info = activity_info.pop("bbox_info", None)
+        act = cls(**activity_info)
+        if bbox_info is not None :
+            act.set_bbox_info(bbox_info)
+        return act
+
+    def get_bbox(self, frame_idx) :
+        """ [x0,y0,x1,y1] of the frame or None """
+        idx = self.bbox_info.find(frame_idx)
+        return self.boxes[idx].tolist() if idx is not None else None
+
+    @property
+    def bbox_info(self) :
+        return BboxInfo(self.base, self.offsets, self.boxes)
+
+    # mapping interface, same keys as the legacy activity dict
+    def __getitem__(self, key) :
+        if key in self.FIELDS :
+            return getattr(self, key)
+        if key == "bbox_info" :
+            return self.bbox_info
+        return self.extra[key]
+
+    def __setitem__(self, key, value) :
+        if key in self.FIELDS :
+            setattr(self, key, value)
+        elif key == "bbox_info" :
+            self.set_bbox_info(value)
+        else :
+            self.extra[key] = value
+
+    def __delitem__(self, key) :
+        if key in self.FIELDS or key == "bbox_info" :
+            raise KeyError(F"{key} can't be removed from the activity")
+        del self.extra[key]
+
+    def __iter__(self) :
+        yield from self.FIELDS
+        yield "bbox_info"
+        yield from self.extra
+
+    def __len__(self) :
+        return len(self.FIELDS) + 1 + len(self.extra)
+
+    def __repr__(self) :
+        return F"Activity({self.activity}, {self.start_f_no}-{self.end_f_no}, {len(self.offsets)} boxes)"
+
+    def to_dict(self) :
+        """ legacy activity dict """
+        out = {k : getattr(self, k) for k in self.FIELDS}
+        out.update(self.extra)
+        out["bbox_info"] = self.bbox_info.to_dict()
+        return out
+
+    def to_bytes(self) :
+        """ header length (uint32) + json header + int32 offsets + int32 (N x 4) boxes """
+        header = json.dumps({
+            "activity" : self.activity,
+            "start_f_no" : self.start_f_no,
+            "end_f_no" : self.end_f_no,
+            "base" : self.base,
+            "n" : len(self.offsets),
+            "extra" : self.extra
+        }).encode()
+        return HEADER_SIZE.pack(len(header)) + header + self.offsets.astype("<i4").tobytes() + self.boxes.astype("<i4").tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, offset=0) :
+        """ returns (activity, offset of the next record) """
+        (header_len,) = HEADER_SIZE.unpack_from(data, offset)
+        offset += HEADER_SIZE.size
+        header = json.loads(bytes(data[offset:offset + header_len]))
+        offset += header_len
+        n = header["n"]
+        act = cls(header["activity"], header["start_f_no"], header["end_f_no"], **header["extra"])
+        act.base = header["base"]
+        act.offsets = np.frombuffer(data, dtype="<i4", count=n, offset=offset).astype(np.int32)
+        offset += 4 * n
+        act.boxes = np.frombuffer(data, dtype="<i4", count=4 * n, offset=offset).astype(np.int32).reshape(-1, 4)
+        offset += 16 * n
+        return act, offset
+
+
+def to_json(obj) :
+    """ default for json.dump, Activity is written as the legacy dict """
+    if isinstance(obj, Activity) :
+        return obj.to_dict()
+    if isinstance(obj, np.integer) :
+        return int(obj)
+    raise TypeError(F"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def measure_peak_memory(func, *args) :
+    """ returns (result of func, peak memory allocated by func in bytes) """
+    tracemalloc.start()
+    try :
+        result = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally :
+        tracemalloc.stop()
+    return result, peak
+
+
+if __name__ == "__main__" :
+    # VIRAT like data, 2000 activities of 1000 frames each
+    rng = np.random.default_rng(0)
+    all_frames = [np.arange(s, s + 1000) for s in rng.integers(0, 20000, 2000)]
+    all_boxes = [rng.integers(0, 1920, (1000, 4)) for _ in all_frames]
+
+    def build_legacy() :
+        return [{"activity" : "activity_walking", "start_f_no" : int(f[0]), "end_f_no" : int(f[-1]), "file_name" : "xyz",
+                 "bbox_info" : {F"img_{x:05d}" : b for x, b in zip(f.tolist(), bb.tolist())}}
+                for f, bb in zip(all_frames, all_boxes)]
+
+    def build_compact() :
+        return [Activity("activity_walking", int(f[0]), int(f[-1]), frames=f, boxes=bb, file_name="xyz")
+                for f, bb in zip(all_frames, all_boxes)]
+
+    legacy, legacy_peak = measure_peak_memory(build_legacy)
+    compact, compact_peak = measure_peak_memory(build_compact)
+    assert all(a.to_dict() == b for a, b in zip(compact, legacy))
+    assert all(Activity.from_bytes(a.to_bytes())[0].to_dict() == b for a, b in zip(compact[:50], legacy))
+    print(F"peak memory legacy dicts {legacy_peak / 2**20:.1f} MB, Activity {compact_peak / 2**20:.1f} MB "
+          F"({legacy_peak / compact_peak:.1f}x)")
+    print(F"binary size {sum(len(a.to_bytes()) for a in compact) / 2**20:.1f} MB, "
+          F"json size {sum(len(json.dumps(b)) for b in legacy) / 2**20:.1f} MB")
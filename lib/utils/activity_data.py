@@ -0,0 +1,168 @@
+"""
+Streaming writer / lazy reader for the processed activity data ({DATASET}_data.jsonl)
+
+Instead of dumping the whole {video : [activity_info, ...]} dict as a single json, each video is
+written as one json line {"video" : video, "activities" : [activity_info, ...]} (orjson if available).
+An index sidecar ({DATASET}_data.jsonl.idx) keeps the offset and length of the latest line of each video, so
+- checkpoints only append the lines of the videos that changed
+- a single video can be read without loading the file
+- the file is compacted when more than half of it is stale lines
+
+usage
+writer = ActivityDataWriter("out/KTH_data.jsonl")
+writer.write(current_data) # all the videos
+writer.checkpoint(current_data, changed_videos) # only the changed videos
+for video, activities in iter_activity_data("out/KTH_data.jsonl") : ...
+"""
+
+import os
+import json
+from loguru import logger
+
+from .activity import Activity, to_json
+
+try :
+    import orjson
+    def dumps(obj) :
+        return orjson.dumps(obj, default=to_json, option=orjson.OPT_SERIALIZE_NUMPY)
+    loads = orjson.loads
+except ImportError :
+    def dumps(obj) :
+        return json.dumps(obj, default=to_json).encode()
+    loads = json.loads
+
+
+def get_index_file(path) :
+    return F"{path}.idx"
+
+
+def load_index(path) :
+    """
+    {video : [offset, length]} in the order the videos were first written
+    the index is rebuilt from the file if the sidecar is missing or unreadable (ex. a copy without the sidecar)
+    """
+    index_file = get_index_file(path)
+    if not os.path.isfile(path) :
+        return {}
+    if os.path.isfile(index_file) :
+        try :
+            with open(index_file, "rb") as fd :
+                return loads(fd.read())
+        except Exception as e :
+            logger.warning(F"unable to load {index_file}, failed with {e}")
+    logger.warning(F"rebuilding the index of {path} with a scan of the file")
+    return rebuild_index(path)
+
+
+def rebuild_index(path) :
+    """ index of the latest line of each video with a linear scan of the file, saved as the sidecar """
+    index = {}
+    offset = 0
+    with open(path, "rb") as fd :
+        for line in fd :
+            if line.strip() :
+                try :
+                    index[loads(line)["video"]] = [offset, len(line)]
+                except Exception as e : # line cut by an interrupted write
+                    logger.warning(F"skipping the line at {offset} of {path}, failed with {e}")
+            offset += len(line)
+    try :
+        tmp_file = F"{get_index_file(path)}.tmp"
+        with open(tmp_file, "wb") as fw :
+            fw.write(dumps(index))
+        os.replace(tmp_file, get_index_file(path))
+    except OSError as e :
+        logger.warning(F"unable to save the index of {path}, failed with {e}")
+    return index
+
+
+class ActivityDataWriter() :
+    def __init__(self, path) :
+        self.path = path
+        self.index = load_index(path)
+
+    def save_index(self) :
+        tmp_file = F"{get_index_file(self.path)}.tmp"
+        with open(tmp_file, "wb") as fw :
+            fw.write(dumps(self.index))
+        os.replace(tmp_file, get_index_file(self.path))
+
+    def write_records(self, fw, all_activity_data, videos) :
+        offset = fw.tell()
+        for video in videos :
+            line = dumps({"video" : video, "activities" : all_activity_data[video]}) + b"\n"
+            fw.write(line)
+            self.index[video] = [offset, len(line)]
+            offset += len(line)
+
+    def write(self, all_activity_data) :
+        """ write all the videos to a new file """
+        self.index = {}
+        tmp_file = F"{self.path}.tmp"
+        with open(tmp_file, "wb") as fw :
+            self.write_records(fw, all_activity_data, list(all_activity_data.keys()))
+        os.replace(tmp_file, self.path)
+        self.save_index()
+        logger.info(F"saved {len(self.index)} videos to {self.path}")
+
+    def checkpoint(self, all_activity_data, changed_videos=None) :
+        """
+        append the changed videos (None -> all the videos) to the file,
+        the videos which are no longer in all_activity_data are dropped from the index
+        """
+        if len(self.index) == 0 :
+            return self.write(all_activity_data)
+        for video in [x for x in self.index if x not in all_activity_data] :
+            del self.index[video]
+        changed_videos = list(all_activity_data.keys()) if changed_videos is None else \
+                            [x for x in changed_videos if x in all_activity_data]
+        changed_videos.extend([x for x in all_activity_data if x not in self.index and x not in changed_videos])
+
+        with open(self.path, "ab") as fw :
+            self.write_records(fw, all_activity_data, changed_videos)
+
+        live_bytes = sum(length for _, length in self.index.values())
+        if os.path.getsize(self.path) > 2 * live_bytes :
+            self.compact()
+        else :
+            self.save_index()
+        logger.info(F"checkpointed {len(changed_videos)} of {len(all_activity_data)} videos to {self.path}")
+
+    def compact(self) :
+        """ rewrite the file with only the latest line of each video """
+        tmp_file = F"{self.path}.tmp"
+        new_index = {}
+        with open(self.path, "rb") as fd, open(tmp_file, "wb") as fw :
+            for video, (offset, length) in self.index.items() :
+                fd.seek(offset)
+                new_index[video] = [fw.tell(), length]
+                fw.write(fd.read(length))
+        os.replace(tmp_file, self.path)
+        self.index = new_index
+        self.save_index()
+
+
+def iter_activity_data(path, as_records=False) :
+    """
+    lazily yield (video, activities) for each video, one line is read at a time
+    as_records -> activities as Activity records instead of the legacy dicts
+    """
+    index = load_index(path)
+    with open(path, "rb") as fd :
+        # lines are read in file order, the stale lines (not in the index) are skipped
+        for _, (offset, length) in sorted(index.items(), key=lambda x : x[1][0]) :
+            fd.seek(offset)
+            record = loads(fd.read(length))
+            activities = record["activities"]
+            if as_records :
+                activities = [Activity.from_dict(x) for x in activities]
+            yield record["video"], activities
+
+
+def load_video_activities(path, video, as_records=False) :
+    """ activities of a single video, only its line is read """
+    offset, length = load_index(path)[video]
+    with open(path, "rb") as fd :
+        fd.seek(offset)
+        activities = loads(fd.read(length))["activities"]
+    return [Activity.from_dict(x) for x in activities] if as_records else activities
@@ -0,0 +1,282 @@
+"""
+SQLite store for the tubelet annotations
+
+Instead of parsing the tubelet dir names (DATASET-VIDEO-CLASS-idSTART_END-pPART) and the
+train / test / class_list text files again and again, the generator writes everything to a
+single indexed sqlite db (global_settings -> annotation_store, default <output_dir>/annotations.db)
+
+tables
+    source_videos   -> one row per source video (or frames dir) of each dataset
+    activities      -> activities of each source video (class, start and end frame)
+    tubelets        -> one row per cropped part of an activity with its frame count and split
+                       (parts stored as index ranges into an activity frame store have frames_dir and frame_offset)
+    tubelet_integrity -> frames of each tubelet cropped from their own frame and the repaired frames (json lists of frame nos)
+    store_info      -> key / value (ex. synced -> the tubelets in the output dir are in the store, no dir scans are needed)
+    label_matcher   -> dataset class -> harmonized tubelet label
+
+The text files (train.txt, test.txt, class_list.txt, parts_manifest.txt, tubelet_*.txt) are exported from the store.
+"""
+
+import os
+import json
+import sqlite3
+from loguru import logger
+
+from . import utils
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS source_videos (
+    id INTEGER PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    video TEXT NOT NULL,
+    src_path TEXT,
+    UNIQUE (dataset, video)
+);
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    video_id INTEGER NOT NULL REFERENCES source_videos(id) ON DELETE CASCADE,
+    class TEXT NOT NULL,
+    start_f_no INTEGER,
+    end_f_no INTEGER
+);
+CREATE TABLE IF NOT EXISTS tubelets (
+    name TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    class TEXT NOT NULL,
+    activity_id INTEGER REFERENCES activities(id) ON DELETE SET NULL,
+    part_idx INTEGER,
+    start_f_no INTEGER,
+    end_f_no INTEGER,
+    no_of_frames INTEGER,
+    split TEXT,
+    frames_dir TEXT,
+    frame_offset INTEGER
+);
+CREATE TABLE IF NOT EXISTS tubelet_integrity (
+    name TEXT PRIMARY KEY REFERENCES tubelets(name) ON DELETE CASCADE,
+    expected_frames INTEGER,
+    written_frames INTEGER,
+    interpolated TEXT,
+    duplicated TEXT,
+    missing TEXT
+);
+CREATE TABLE IF NOT EXISTS store_info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS label_matcher (
+    class TEXT PRIMARY KEY,
+    label TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_source_videos_dataset ON source_videos(dataset);
+CREATE INDEX IF NOT EXISTS idx_activities_class ON activities(class);
+CREATE INDEX IF NOT EXISTS idx_tubelets_dataset ON tubelets(dataset);
+CREATE INDEX IF NOT EXISTS idx_tubelets_class ON tubelets(class);
+CREATE INDEX IF NOT EXISTS idx_tubelets_split ON tubelets(split);
+"""
+
+
+def parse_tubelet_name(name) :
+    """ DATASET-VIDEO-CLASS-idSTART_END-pPART -> (dataset, class, part_idx) """
+    parts = name.split("-")
+    part_idx = int(parts[-1][1:]) if parts[-1].startswith("p") and parts[-1][1:].isdigit() else None
+    return parts[0], parts[-3], part_idx
+
+
+class AnnotationStore() :
+    def __init__(self, db_path) :
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir != "" :
+            os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(SCHEMA)
+        self.migrate()
+        self.conn.commit()
+
+    def migrate(self) :
+        """ add the columns missing in the dbs created by the older versions """
+        tubelet_columns = [x[1] for x in self.conn.execute("PRAGMA table_info(tubelets)")]
+        for column, column_type in [("frames_dir", "TEXT"), ("frame_offset", "INTEGER")] :
+            if column not in tubelet_columns :
+                self.conn.execute(F"ALTER TABLE tubelets ADD COLUMN {column} {column_type}")
+
+    def close(self) :
+        self.conn.close()
+
+    def add_source_data(self, dataset, all_activity_data, src_dir=None) :
+        """
+        replace the source videos and activities of the dataset with the processor output
+        ({video : [activity_info, ...]}), the row id of each activity is added to its activity_info as 'activity_id'
+        """
+        with self.conn :
+            if self.conn.execute("DELETE FROM tubelets WHERE dataset = ?", (dataset,)).rowcount > 0 :
+                # the tubelet dirs are still on disk, the next sync scans the dataset dir again
+                self.conn.execute("DELETE FROM store_info WHERE key = 'synced'")
+            self.conn.execute("DELETE FROM source_videos WHERE dataset = ?", (dataset,))
+            for video, activities in all_activity_data.items() :
+                src_path = os.path.join(src_dir, video) if src_dir is not None else None
+                video_id = self.conn.execute("INSERT INTO source_videos (dataset, video, src_path) VALUES (?, ?, ?)",
+                                             (dataset, video, src_path)).lastrowid
+                for act in activities :
+                    start_f_no, end_f_no = act.get("start_f_no", None), act.get("end_f_no", None)
+                    act["activity_id"] = self.conn.execute(
+                        "INSERT INTO activities (video_id, class, start_f_no, end_f_no) VALUES (?, ?, ?, ?)",
+                        (video_id, act["activity"],
+                         int(start_f_no) if start_f_no is not None else None,
+                         int(end_f_no) if end_f_no is not None else None)).lastrowid
+        logger.info(F"added {len(all_activity_data)} {dataset} videos to {self.db_path}")
+
+    def update_activity_range(self, activity_id, start_f_no, end_f_no) :
+        with self.conn :
+            self.conn.execute("UPDATE activities SET start_f_no = ?, end_f_no = ? WHERE id = ?",
+                              (int(start_f_no), int(end_f_no), activity_id))
+
+    def add_tubelet(self, name, activity_id=None, start_f_no=None, end_f_no=None, no_of_frames=None,
+                    frames_dir=None, frame_offset=None, integrity=None) :
+        """
+        frames_dir (relative to the output dir) and frame_offset only for the parts stored in an activity frame store
+        integrity -> {"expected_frames", "written_frames", "interpolated", "duplicated", "missing"} from the crop stage
+        """
+        dataset, cls, part_idx = parse_tubelet_name(name)
+        with self.conn :
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tubelets (name, dataset, class, activity_id, part_idx, start_f_no, end_f_no, no_of_frames, "
+                "frames_dir, frame_offset) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, dataset, cls, activity_id, part_idx, start_f_no, end_f_no, no_of_frames, frames_dir, frame_offset))
+            if integrity is not None :
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO tubelet_integrity (name, expected_frames, written_frames, interpolated, duplicated, missing) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (name, integrity["expected_frames"], integrity["written_frames"], json.dumps(integrity["interpolated"]),
+                     json.dumps(integrity["duplicated"]), json.dumps(integrity["missing"])))
+
+    def get_integrity(self, name) :
+        """ integrity record of the tubelet (None if it was cropped before the records existed) """
+        row = self.conn.execute("SELECT expected_frames, written_frames, interpolated, duplicated, missing "
+                                "FROM tubelet_integrity WHERE name = ?", (name,)).fetchone()
+        if row is None :
+            return None
+        return {
+            "expected_frames" : row[0],
+            "written_frames" : row[1],
+            "interpolated" : json.loads(row[2]),
+            "duplicated" : json.loads(row[3]),
+            "missing" : json.loads(row[4])
+        }
+
+    def get_integrity_stats(self) :
+        """ no of tubelets and frames repaired / missing over all the integrity records """
+        row = self.conn.execute(
+            "SELECT COUNT(*), SUM(expected_frames), SUM(written_frames), SUM(json_array_length(interpolated)), "
+            "SUM(json_array_length(duplicated)), SUM(json_array_length(missing)), "
+            "SUM(interpolated != '[]' OR duplicated != '[]'), SUM(missing != '[]') FROM tubelet_integrity").fetchone()
+        keys = ["tubelets", "expected_frames", "written_frames", "interpolated_frames", "duplicated_frames", "missing_frames",
+                "repaired_tubelets", "incomplete_tubelets"]
+        return {k : v if v is not None else 0 for k, v in zip(keys, row)}
+
+    def is_synced(self) :
+        return self.conn.execute("SELECT value FROM store_info WHERE key = 'synced'").fetchone() is not None
+
+    def sync_tubelets(self, dataset_dir, get_tubelet_length, rescan=False) :
+        """
+        add the tubelets found in the dataset dir which are not in the store (cropped before the store existed)
+        and fill the missing frame counts
+        the dir is scanned only once, after that the crop stage keeps the store up to date (rescan -> scan again,
+        also done when add_source_data dropped the tubelets of a dataset)
+        """
+        if self.is_synced() and not rescan :
+            return
+        known = {name : n for name, n in self.conn.execute("SELECT name, no_of_frames FROM tubelets")}
+        rows = []
+        for name in utils.scan_tubelets(dataset_dir, self.db_path) :
+            if known.get(name, None) is None :
+                dataset, cls, part_idx = parse_tubelet_name(name)
+                rows.append((name, dataset, cls, part_idx, get_tubelet_length(dataset_dir, name)))
+        with self.conn :
+            self.conn.executemany(
+                "INSERT INTO tubelets (name, dataset, class, part_idx, no_of_frames) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET no_of_frames = excluded.no_of_frames", rows)
+            self.conn.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES ('synced', ?)", (dataset_dir,))
+        if len(rows) > 0 :
+            logger.info(F"synced {len(rows)} tubelets from {dataset_dir}")
+
+    def get_tubelets(self, datasets=None) :
+        """ list of (name, dataset, class, no_of_frames) """
+        query = "SELECT name, dataset, class, no_of_frames FROM tubelets"
+        params = []
+        if datasets is not None :
+            query += F" WHERE dataset IN ({','.join('?' * len(datasets))})"
+            params = list(datasets)
+        return self.conn.execute(query + " ORDER BY name", params).fetchall()
+
+    def set_splits(self, name_to_split) :
+        """ name_to_split -> {tubelet_name : "train" / "test" / None} """
+        with self.conn :
+            self.conn.executemany("UPDATE tubelets SET split = ? WHERE name = ?",
+                                  [(split, name) for name, split in name_to_split.items()])
+
+    def get_class_list(self) :
+        return [x for x, in self.conn.execute("SELECT DISTINCT class FROM tubelets ORDER BY class")]
+
+    def export_split_files(self, out_dir) :
+        """
+        write train.txt, test.txt (tubelet_name no_of_frames class_idx) and class_list.txt
+        and parts_manifest.txt (tubelet_name frames_dir frame_offset no_of_frames) for the parts in activity frame stores
+        """
+        classes_list = self.get_class_list()
+        class_idx = {x : idx for idx, x in enumerate(classes_list)}
+        for split in ["train", "test"] :
+            rows = self.conn.execute("SELECT name, no_of_frames, class FROM tubelets WHERE split = ? ORDER BY name", (split,))
+            with open(os.path.join(out_dir, F"{split}.txt"), "w") as fw :
+                fw.writelines([F"{name} {n} {class_idx[cls]}\n" for name, n, cls in rows])
+        with open(os.path.join(out_dir, "class_list.txt"), "w") as fw :
+            fw.writelines([F"{x}\n" for x in classes_list])
+        rows = self.conn.execute("SELECT name, frames_dir, frame_offset, no_of_frames FROM tubelets "
+                                 "WHERE frames_dir IS NOT NULL AND split IS NOT NULL ORDER BY name")
+        with open(os.path.join(out_dir, "parts_manifest.txt"), "w") as fw :
+            fw.writelines([F"{name} {frames_dir} {offset} {n}\n" for name, frames_dir, offset, n in rows])
+        return classes_list
+
+    def set_label_matcher(self, label_matcher) :
+        with self.conn :
+            self.conn.execute("DELETE FROM label_matcher")
+            self.conn.executemany("INSERT INTO label_matcher (class, label) VALUES (?, ?)", list(label_matcher.items()))
+
+    def export_harmonized_split_files(self, out_dir, tubelet_labels) :
+        """
+        write tubelet_train.txt, tubelet_test.txt and tubelet_class_list.txt with the dataset classes
+        mapped to the tubelet labels through the label_matcher table
+        """
+        unmatched = [x for x, in self.conn.execute(
+            "SELECT DISTINCT t.class FROM tubelets t LEFT JOIN label_matcher l ON t.class = l.class "
+            "WHERE t.split IS NOT NULL AND l.label IS NULL")]
+        if len(unmatched) > 0 :
+            logger.warning(F"no tubelet label for the classes {unmatched}, skipping their tubelets")
+        label_idx = {x : idx for idx, x in enumerate(tubelet_labels)}
+        for split in ["train", "test"] :
+            rows = self.conn.execute(
+                "SELECT t.name, t.no_of_frames, l.label FROM tubelets t JOIN label_matcher l ON t.class = l.class "
+                "WHERE t.split = ? ORDER BY t.name", (split,))
+            with open(os.path.join(out_dir, F"tubelet_{split}.txt"), "w") as fw :
+                fw.writelines([F"{name} {n} {label_idx[label]}\n" for name, n, label in rows if label in label_idx])
+        with open(os.path.join(out_dir, "tubelet_class_list.txt"), "w") as fw :
+            fw.writelines([F"{x}\n" for x in tubelet_labels])
+
+    def get_stats(self, datasets=None) :
+        """
+        no of tubelets and frames for each dataset, class and split
+        {dataset : {class : {split : {"tubelets" : n, "frames" : n}}}}
+        """
+        query = "SELECT dataset, class, COALESCE(split, 'none'), COUNT(*), COALESCE(SUM(no_of_frames), 0) FROM tubelets"
+        params = []
+        if datasets is not None :
+            query += F" WHERE dataset IN ({','.join('?' * len(datasets))})"
+            params = list(datasets)
+        query += " GROUP BY dataset, class, split"
+        stats = {}
+        for dataset, cls, split, n_tubelets, n_frames in self.conn.execute(query, params) :
+            stats.setdefault(dataset, {}).setdefault(cls, {})[split] = {"tubelets" : n_tubelets, "frames" : n_frames}
+        return stats
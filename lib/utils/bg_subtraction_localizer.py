@@ -0,0 +1,122 @@
+# bg_subtraction_localizer
+"""
+Cheap person localizer for static camera datasets (KTH, MCAD, parts of UCFARG)
+
+These clips are recorded with a fixed camera and have a single actor, so instead of
+running the deep detector we
+1. learn the background with MOG2 background subtraction (primed with the median of frames sampled over the clip)
+2. clean the foreground mask with morphology (open + close)
+3. take the largest connected blob as the person
+
+All the processing is done on downscaled grayscale frames, boxes are scaled back to the source image.
+Output format is same as person_detector i.e {"img_XXXXX" : [x0,y0,x1,y1]}
+"""
+
+import os
+import cv2
+import imagesize
+import numpy as np
+from loguru import logger
+
+# shortest side of the frame used for background subtraction
+WORK_SIZE = 160
+# no of frames sampled over the clip to prime the background model
+NO_OF_PRIMING_FRAMES = 30
+NO_OF_PRIMING_ROUNDS = 10
+# blobs smaller than this fraction of the frame are considered as noise
+MIN_BLOB_AREA_RATIO = 0.002
+
+KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+
+def to_work_frame(frame, work_size=WORK_SIZE) :
+    """ convert BGR frame to downscaled grayscale frame, returns (gray_frame, (scale_x, scale_y)) """
+    height, width = frame.shape[:2]
+    if min(height, width) > work_size :
+        resize_factor = work_size / min(height, width)
+        frame = cv2.resize(frame, (round(width * resize_factor), round(height * resize_factor)),
+                           interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    return gray, (width / gray.shape[1], height / gray.shape[0])
+
+
+REDUCED_READ_FLAGS = {
+    8 : cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    4 : cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    2 : cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    1 : cv2.IMREAD_GRAYSCALE
+}
+
+def read_work_frame(img_path, work_size=WORK_SIZE) :
+    """ read the jpeg at reduced scale (DCT scaling) and convert it to the work frame """
+    width, height = imagesize.get(img_path)
+    reduction = [r for r in sorted(REDUCED_READ_FLAGS.keys(), reverse=True) if min(width, height) // r >= work_size]
+    img = cv2.imread(img_path, REDUCED_READ_FLAGS[reduction[0] if len(reduction) > 0 else 1])
+    gray, (sx, sy) = to_work_frame(img, work_size)
+    return gray, (width / gray.shape[1], height / gray.shape[0])
+
+
+def get_largest_blob(mask, min_area) :
+    n_labels, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if n_labels <= 1 : # only background
+        return None
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    blob_idx = int(np.argmax(areas))
+    if areas[blob_idx] < min_area :
+        return None
+    x, y, w, h = stats[blob_idx + 1, :4]
+    return x, y, x + w, y + h
+
+
+"""
+localize the person in each frame
+work_frames -> list of (image_name, (gray_frame, (scale_x, scale_y)))
+"""
+def localize(work_frames) :
+    if len(work_frames) == 0 :
+        return {}
+
+    subtractor = cv2.createBackgroundSubtractorMOG2(history=max(len(work_frames), 50), detectShadows=True)
+    # prime the background model with the median of frames sampled over the clip,
+    # the actor is moving so the median doesn't contain the actor
+    stride = max(1, len(work_frames) // NO_OF_PRIMING_FRAMES)
+    background = np.median(np.stack([gray for _, (gray, _) in work_frames[::stride]]), axis=0).astype(np.uint8)
+    for _ in range(NO_OF_PRIMING_ROUNDS) :
+        subtractor.apply(background)
+
+    out = {}
+    for image_name, (gray, (sx, sy)) in work_frames :
+        # background is frozen after priming, the actor standing still is not absorbed into it
+        mask = subtractor.apply(gray, learningRate=0)
+        # shadows are marked as 127 by MOG2, keep only the foreground
+        _, mask = cv2.threshold(mask, 200, 255, cv2.THRESH_BINARY)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, KERNEL)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, KERNEL, iterations=3)
+
+        blob = get_largest_blob(mask, MIN_BLOB_AREA_RATIO * mask.shape[0] * mask.shape[1])
+        if blob is None :
+            continue
+        x0, y0, x1, y1 = blob
+        out[image_name] = [int(x0 * sx), int(y0 * sy), int(x1 * sx), int(y1 * sy)]
+    return out
+
+
+# same signature as person_detector.get_person_bboxes_from_dir
+def get_person_bboxes_from_dir(dir_path, input_size=None) :
+    work_size = input_size if input_size is not None else WORK_SIZE
+    all_files = sorted(os.listdir(dir_path))
+    work_frames = []
+    for f in all_files :
+        try :
+            work_frames.append((f.split(".")[0], read_work_frame(os.path.join(dir_path, f), work_size)))
+        except Exception as e :
+            logger.error(F"unable to read {f} from {dir_path}, failed with {e}")
+    return localize(work_frames)
+
+
+# same signature as person_detector.get_person_bboxes_from_frames
+# only the downscaled grayscale frames are kept in memory
+def get_person_bboxes_from_frames(frames, input_size=None) :
+    work_size = input_size if input_size is not None else WORK_SIZE
+    work_frames = [(image_name, to_work_frame(frame, work_size)) for image_name, frame in frames]
+    return localize(work_frames)
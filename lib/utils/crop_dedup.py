@@ -0,0 +1,125 @@
+"""
+Content addressed dedup of the cropped frames
+
+JRDBACT (multi label boxes) and VIRAT (activities sharing a track and span) produce several activities
+with the same frames and boxes. Each crop is identified by (source frame, crop rect, output settings),
+the first crop is encoded as usual and published to the crop store (a hardlink of the output),
+the other copies are hardlinked from the store instead of reading, cropping and encoding the frame again.
+
+store layout (global_settings -> crop_store_dir, default <output_dir>/.crop_store)
+    <key[:2]>/<key>.jpg     -> single frame (cv2 crop backend)
+    <key[:2]>/<key>.mp4     -> tubelet part (ffmpeg crop backend, mp4 output)
+    <key[:2]>/<key>/        -> frames of a tubelet part (ffmpeg crop backend, jpg output), complete once .done exists
+
+The store has to be on the same file system as the output dir (hardlinks), otherwise dedup is disabled.
+"""
+
+import os
+import hashlib
+from loguru import logger
+
+DONE_MARKER = ".done"
+
+
+def new_stats() :
+    return {"hits" : 0, "misses" : 0, "saved_bytes" : 0, "encode_time" : 0.0}
+
+
+def merge_stats(all_stats) :
+    out = new_stats()
+    for stats in all_stats :
+        for k in out.keys() :
+            out[k] += stats[k]
+    return out
+
+
+def log_stats(stats) :
+    """ saved encode time is estimated with the mean encode time of the crops which were encoded """
+    if stats["hits"] + stats["misses"] == 0 :
+        return
+    mean_encode_time = stats["encode_time"] / stats["misses"] if stats["misses"] > 0 else 0.0
+    logger.info(F"crop dedup : {stats['hits']} of {stats['hits'] + stats['misses']} crops linked from the store, "
+                F"saved ~{stats['hits'] * mean_encode_time:.1f} sec of encoding and {stats['saved_bytes'] / 2**20:.1f} MB of disk")
+
+
+def remove_if_exists(path) :
+    """ outputs may be hardlinks to the store, they are removed before writing instead of writing through the link """
+    try :
+        os.remove(path)
+    except FileNotFoundError :
+        pass
+
+
+class CropDedup() :
+    def __init__(self, store_dir, enabled=True) :
+        self.store_dir = store_dir
+        self.enabled = enabled
+
+    def get_key(self, *parts) :
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def get_store_path(self, key, ext="") :
+        return os.path.join(self.store_dir, key[:2], F"{key}{ext}")
+
+    def link(self, src, dst) :
+        remove_if_exists(dst)
+        os.link(src, dst)
+
+    def link_from_store(self, key, out_path, stats, ext=".jpg") :
+        """ link the crop from the store to out_path, returns False if it is not in the store """
+        if not self.enabled :
+            return False
+        try :
+            self.link(self.get_store_path(key, ext), out_path)
+        except FileNotFoundError :
+            return False
+        stats["hits"] += 1
+        stats["saved_bytes"] += os.path.getsize(out_path)
+        return True
+
+    def publish(self, key, out_path, stats, encode_time, ext=".jpg") :
+        """ add the encoded crop to the store """
+        stats["misses"] += 1
+        stats["encode_time"] += encode_time
+        if not self.enabled :
+            return
+        store_path = self.get_store_path(key, ext)
+        try :
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            os.link(out_path, store_path)
+        except FileExistsError :
+            pass # same crop published by another worker
+        except OSError as e :
+            logger.warning(F"disabling crop dedup, unable to link {out_path} to {store_path}, failed with {e}")
+            self.enabled = False
+
+    def link_dir_from_store(self, key, out_dir, stats) :
+        """ link the frames of a tubelet part from the store, returns the no of frames (0 if not in the store) """
+        store_path = self.get_store_path(key)
+        if not self.enabled or not os.path.isfile(os.path.join(store_path, DONE_MARKER)) :
+            return 0
+        os.makedirs(out_dir, exist_ok=True)
+        all_files = [x for x in sorted(os.listdir(store_path)) if x != DONE_MARKER]
+        for x in all_files :
+            self.link(os.path.join(store_path, x), os.path.join(out_dir, x))
+            stats["saved_bytes"] += os.path.getsize(os.path.join(out_dir, x))
+        stats["hits"] += 1
+        return len(all_files)
+
+    def publish_dir(self, key, out_dir, stats, encode_time) :
+        stats["misses"] += 1
+        stats["encode_time"] += encode_time
+        if not self.enabled :
+            return
+        store_path = self.get_store_path(key)
+        try :
+            os.makedirs(store_path, exist_ok=True)
+            for x in os.listdir(out_dir) :
+                try :
+                    os.link(os.path.join(out_dir, x), os.path.join(store_path, x))
+                except FileExistsError :
+                    pass
+            open(os.path.join(store_path, DONE_MARKER), "w").close()
+        except OSError as e :
+            logger.warning(F"disabling crop dedup, unable to link {out_dir} to {store_path}, failed with {e}")
+            self.enabled = False
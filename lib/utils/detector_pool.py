@@ -0,0 +1,119 @@
+"""
+Pool of CPU person detector processes
+
+Running a single torch process with the default intra-op threads doesn't scale
+beyond ~8 cores. Instead we start N worker processes, each pinned to a small
+number of torch threads, load the model once per worker and let the workers pull
+one video (frames dir) at a time from the shared task queue of the pool.
+
+Results are returned in the same order the videos were submitted.
+
+config (global_settings -> detector)
+{
+    "num_workers" : 4,            -> no of detector processes, 1 runs in the current process
+    "threads_per_worker" : 2,     -> torch.set_num_threads for each worker
+    "input_size" : 320,           -> decode the frames at reduced scale for the detector, null -> full size
+    "bg_subtraction_size" : 160,  -> work size of the background subtraction localizer, null -> its default WORK_SIZE
+    "detect_on_decode" : false    -> for video datasets, detect on the decoded frames while extracting them
+}
+
+The localizer is selected for each dataset (each_dataset_config -> localizer)
+    "detector"          -> torchvision person detector (default)
+    "bg_subtraction"    -> background subtraction localizer for static camera datasets
+"""
+
+import multiprocessing
+import os
+from functools import partial
+from loguru import logger
+
+from . import person_detector
+from . import bg_subtraction_localizer
+from . import utils
+
+LOCALIZERS = {
+    "detector" : person_detector,
+    "bg_subtraction" : bg_subtraction_localizer
+}
+
+
+def _init_worker(num_threads, localizer="detector") :
+    # load the model once for each worker, it is reused for all the videos of that worker
+    if localizer == "detector" :
+        person_detector.load_model(num_threads)
+
+
+def _detect_dir(frames_dir, input_size=None, localizer="detector") :
+    try :
+        return LOCALIZERS[localizer].get_person_bboxes_from_dir(frames_dir, input_size)
+    except Exception as e :
+        logger.error(F"unable to get person detections from {frames_dir}, failed with {e}")
+        return {}
+
+
+def _detect_video(task, input_size=None, localizer="detector") :
+    # single decode pass, frames are written to frames_dir (for cropping) and detected in memory
+    video_path, frames_dir, frame_step = task
+    try :
+        frames = utils.iter_video_frames(video_path, frames_dir, frame_step)
+        return LOCALIZERS[localizer].get_person_bboxes_from_frames(frames, input_size)
+    except Exception as e :
+        logger.error(F"unable to get person detections from {video_path}, failed with {e}")
+        return {}
+
+
+class DetectorPool() :
+    def __init__(self, num_workers=1, threads_per_worker=None, input_size=None, detect_on_decode=False, localizer="detector",
+                 bg_subtraction_size=None) :
+        assert localizer in LOCALIZERS, F"unknown localizer {localizer}, supported {list(LOCALIZERS.keys())}"
+        self.localizer = localizer
+        self.num_workers = max(1, int(num_workers))
+        # input_size is only for the detector, the background subtraction localizer has its own work size
+        self.input_size = input_size if localizer == "detector" else bg_subtraction_size
+        self.detect_on_decode = detect_on_decode
+        if threads_per_worker is None :
+            threads_per_worker = max(1, multiprocessing.cpu_count() // self.num_workers)
+        self.threads_per_worker = int(threads_per_worker)
+
+        if self.num_workers > 1 and localizer == "detector" and person_detector.device != 'cpu' :
+            logger.warning(F"detector pool with {self.num_workers} workers is only supported on cpu, using single worker on {person_detector.device}")
+            self.num_workers = 1
+        logger.info(F"initialized {localizer} pool with {self.num_workers} workers, {self.threads_per_worker} threads per worker")
+
+    def __call__(self, frames_dirs) :
+        """
+        get the person detections for each frames dir
+        returns a list of detections ({"img_XXXXX" : [x0,y0,x1,y1]}) in the same order as frames_dirs
+        """
+        frames_dirs = list(frames_dirs)
+        return self.run(_detect_dir, frames_dirs, frames_dirs)
+
+    def detect_videos(self, video_paths, frames_dirs, frame_step=1) :
+        """
+        decode each video once, store its frames in the respective frames dir and get the person detections
+        frame_step -> fps / target_fps, only the frames of the target fps are stored and detected
+        returns a list of detections in the same order as video_paths
+        """
+        video_paths = list(video_paths)
+        return self.run(_detect_video, [(v, d, frame_step) for v, d in zip(video_paths, frames_dirs)], video_paths)
+
+    def run(self, detect_fn, tasks, names) :
+        if len(tasks) == 0 :
+            return []
+
+        func = partial(detect_fn, input_size=self.input_size, localizer=self.localizer)
+        if self.num_workers == 1 :
+            _init_worker(self.threads_per_worker, self.localizer)
+            return [func(t) for t in tasks]
+
+        # spawn instead of fork, forking a process after torch initialized its thread pools can deadlock
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(processes=self.num_workers, initializer=_init_worker,
+                      initargs=(self.threads_per_worker, self.localizer)) as pool :
+            # chunksize=1 -> each worker takes the next video from the queue when its done
+            # imap keeps the submission order
+            all_detections = []
+            for name, detections in zip(names, pool.imap(func, tasks, chunksize=1)) :
+                logger.info(F"Got {len(detections)} person detections from {os.path.basename(name)}")
+                all_detections.append(detections)
+        return all_detections
@@ -0,0 +1,153 @@
+"""
+Cached inventory of the source dataset trees
+
+The datasets are on NFS, walking them with os.listdir on every run is slow.
+SourceInventory keeps the listing of each dir (with size and mtime of each entry)
+and persists it as a json file. A cached dir listing is reused as long as the mtime of
+the dir is unchanged (adding / removing / renaming entries updates the dir mtime).
+
+cache format
+{
+    "dir_path" : {
+        "mtime" : dir mtime,
+        "entries" : {
+            "name" : [is_dir, size, mtime]
+        }
+    }
+}
+
+usage
+inventory = SourceInventory(src_dir)
+inventory.scan(max_depth=2) # optional, scan the tree in parallel across the top level dirs
+inventory.listdir(os.path.join(src_dir, "xyz"))
+inventory.save()
+"""
+
+import os
+import json
+import hashlib
+import threading
+import concurrent.futures
+from loguru import logger
+
+INVENTORY_CACHE_DIR = ".inventory"
+
+
+class SourceInventory() :
+    def __init__(self, root, cache_dir=None, validate=True) :
+        """
+        root -> root dir of the source tree (used for the parallel scan and the cache file name)
+        cache_dir -> dir to store the cache (default .inventory)
+        validate -> check the dir mtime before using a cached listing, False trusts the cache blindly
+        """
+        self.root = os.path.abspath(root)
+        self.validate = validate
+        cache_dir = cache_dir if cache_dir is not None else INVENTORY_CACHE_DIR
+        self.cache_file = os.path.join(cache_dir, F"{hashlib.md5(self.root.encode()).hexdigest()}.json")
+        self.dirs = self.load()
+        self.lock = threading.Lock()
+        self.modified = False
+
+    def __getstate__(self) :
+        # the lock is not sent to the worker processes
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state) :
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def load(self) :
+        if not os.path.isfile(self.cache_file) :
+            return {}
+        try :
+            with open(self.cache_file) as fd :
+                return json.load(fd)
+        except Exception as e :
+            logger.warning(F"unable to load inventory {self.cache_file}, failed with {e}")
+            return {}
+
+    def save(self) :
+        if not self.modified :
+            return
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_file = F"{self.cache_file}.tmp"
+        with open(tmp_file, "w") as fw :
+            json.dump(self.dirs, fw)
+        os.replace(tmp_file, self.cache_file)
+        self.modified = False
+        logger.info(F"saved inventory of {self.root} ({len(self.dirs)} dirs) to {self.cache_file}")
+
+    def scan_dir(self, dir_path) :
+        """ listing of a single dir, from the cache if the dir is unchanged """
+        dir_path = os.path.abspath(dir_path)
+        cached = self.dirs.get(dir_path, None)
+        if cached is not None and not self.validate :
+            return cached["entries"]
+
+        dir_mtime = os.stat(dir_path).st_mtime
+        if cached is not None and cached["mtime"] == dir_mtime :
+            return cached["entries"]
+
+        entries = {}
+        with os.scandir(dir_path) as it :
+            for entry in it :
+                st = entry.stat()
+                entries[entry.name] = [entry.is_dir(), st.st_size, st.st_mtime]
+        with self.lock :
+            self.dirs[dir_path] = {"mtime" : dir_mtime, "entries" : entries}
+            self.modified = True
+        return entries
+
+    def scan(self, max_depth=None, num_workers=16) :
+        """
+        scan the tree under root, each top level dir is walked in a separate thread
+        max_depth -> no of levels below root to scan (None -> whole tree)
+        """
+        def walk(dir_path, depth) :
+            entries = self.scan_dir(dir_path)
+            if max_depth is not None and depth >= max_depth :
+                return
+            for name, (is_dir, _, _) in entries.items() :
+                if is_dir :
+                    walk(os.path.join(dir_path, name), depth + 1)
+
+        top_level = self.scan_dir(self.root)
+        top_level_dirs = [os.path.join(self.root, name) for name, (is_dir, _, _) in top_level.items() if is_dir]
+        if max_depth is None or max_depth > 0 :
+            with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor :
+                list(executor.map(walk, top_level_dirs, [1] * len(top_level_dirs)))
+        logger.info(F"scanned {self.root}, {len(self.dirs)} dirs in inventory")
+
+    def scan_dirs(self, dir_paths, num_workers=16) :
+        """
+        scan the given dirs in parallel (missing dirs are skipped), ex. before sending the inventory to
+        worker processes, whose copies of the cache are never saved
+        """
+        def scan(dir_path) :
+            try :
+                self.scan_dir(dir_path)
+            except FileNotFoundError :
+                pass
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor :
+            list(executor.map(scan, list(dict.fromkeys(dir_paths))))
+
+    def listdir(self, dir_path) :
+        """ same as os.listdir """
+        return list(self.scan_dir(dir_path).keys())
+
+    def isdir(self, path) :
+        """ same as os.path.isdir, based on the listing of the parent dir """
+        path = os.path.abspath(path)
+        parent, name = os.path.split(path)
+        try :
+            entry = self.scan_dir(parent).get(name, None)
+        except FileNotFoundError :
+            return False
+        return entry is not None and entry[0]
+
+    def getsize(self, path) :
+        """ same as os.path.getsize, based on the listing of the parent dir """
+        parent, name = os.path.split(os.path.abspath(path))
+        return self.scan_dir(parent)[name][1]
@@ -9,22 +9,33 @@ import torchvision.transforms as transforms
 
 import torch
 import cv2
+import imagesize
+from loguru import logger
 
 import os
+import time
 import numpy as np
 import json
 
 device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
 
+# model is loaded once per process and reused for all the videos processed by that process
+_model = None
+_preprocess = None
+
 
 """
 pred_out -> predictions (list of detection out consist of gpu/cpu tensors)
          -> keys are boxes, labels, scores
 """
-def process_predictions(image_names, pred_out, label_to_filter=1):
+def process_predictions(image_names, pred_out, label_to_filter=1, scales=None):
     out = []
     for idx, pred in enumerate(pred_out) :
         bbox = pred['boxes'].detach().cpu().numpy()
+        if scales is not None :
+            # boxes are predicted on the reduced image, scale them back to the source image coordinates
+            sx, sy = scales[idx]
+            bbox = bbox * np.array([sx, sy, sx, sy], dtype=bbox.dtype)
         labels = pred['labels'].detach().cpu().numpy()
         scores = pred['scores'].detach().cpu().numpy()
         # get all the person detections
@@ -41,28 +52,123 @@ def process_predictions(image_names, pred_out, label_to_filter=1):
 
 
 
+"""
+load the pre-trained model, only once per process
+num_threads -> torch intra-op threads for this process (None -> torch default)
+"""
+def load_model(num_threads=None) :
+    global _model, _preprocess
+    if num_threads is not None :
+        torch.set_num_threads(num_threads)
+    if _model is None :
+        # weights = FasterRCNN_ResNet50_FPN_V2_Weights.DEFAULT
+        weights = FasterRCNN_MobileNet_V3_Large_320_FPN_Weights.DEFAULT
+        _preprocess = weights.transforms()
+        # model = fasterrcnn_resnet50_fpn_v2(weights=weights, box_score_thresh=0.75)
+        _model = fasterrcnn_mobilenet_v3_large_320_fpn(weights=weights, box_score_thresh=0.50)
+        _model.to(device)
+        _model.eval()
+    return _model, _preprocess
+
+
+"""
+decode the image for the detector
+the 320 FPN model resizes its input to 320 anyway, so when input_size is given the jpeg
+is decoded at a reduced scale (DCT scaling 1/2, 1/4 or 1/8) keeping the shortest side >= input_size
+returns (uint8 RGB tensor CHW, (scale_x, scale_y)) -> scale to map boxes back to the source image
+"""
+REDUCED_READ_FLAGS = {
+    8 : cv2.IMREAD_REDUCED_COLOR_8,
+    4 : cv2.IMREAD_REDUCED_COLOR_4,
+    2 : cv2.IMREAD_REDUCED_COLOR_2
+}
+
+def read_image_for_detection(img_path, input_size=None) :
+    if input_size is None :
+        return read_image(img_path), (1.0, 1.0)
+
+    width, height = imagesize.get(img_path)
+    reduction = 1
+    for r in sorted(REDUCED_READ_FLAGS.keys(), reverse=True) :
+        if min(width, height) // r >= input_size :
+            reduction = r
+            break
+    if reduction == 1 :
+        return read_image(img_path), (1.0, 1.0)
+
+    img = cv2.imread(img_path, REDUCED_READ_FLAGS[reduction])
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return torch.from_numpy(img).permute(2, 0, 1), (width / img.shape[1], height / img.shape[0])
+
+
 """
 run inference on images using pre-trained models
 batches -> list of list of images [[im1,im2],[im3,im4],[im5,im6]]
+input_size -> decode the images at reduced scale (see read_image_for_detection), None -> full size
 """
-def run_inference(batches) :
+def run_inference(batches, input_size=None) :
     torch.cuda.empty_cache()
-    # weights = FasterRCNN_ResNet50_FPN_V2_Weights.DEFAULT
-    weights = FasterRCNN_MobileNet_V3_Large_320_FPN_Weights.DEFAULT
-    preprocess = weights.transforms()
-    # model = fasterrcnn_resnet50_fpn_v2(weights=weights, box_score_thresh=0.75)
-    model = fasterrcnn_mobilenet_v3_large_320_fpn(weights=weights, box_score_thresh=0.50)
-    model.to(device)
-    model.eval()
+    model, preprocess = load_model()
     out_data = []
-    for batch in batches :
-        c_batch = [preprocess(read_image(x)).to(device) for x in batch]
-        predictions = model(c_batch) # we are assuming only 
-        bbox_info = process_predictions(batch,predictions)
-        out_data.extend(bbox_info)
-    
-    with open("bbox_predictions.json","w") as fw :
-        json.dump(out_data,fw)
+    decode_time = 0
+    no_of_frames = 0
+    with torch.no_grad() :
+        for batch in batches :
+            t_start = time.perf_counter()
+            decoded = [read_image_for_detection(x, input_size) for x in batch]
+            decode_time = decode_time + time.perf_counter() - t_start
+            no_of_frames = no_of_frames + len(batch)
+
+            c_batch = [preprocess(img).to(device) for img, _ in decoded]
+            predictions = model(c_batch) # we are assuming only 
+            bbox_info = process_predictions(batch,predictions, scales=[scale for _, scale in decoded])
+            out_data.extend(bbox_info)
+    if no_of_frames > 0 :
+        logger.info(F"decoded {no_of_frames} frames for detection, {1000 * decode_time / no_of_frames:.2f} ms per frame (input_size {input_size})")
+    # not dumping the predictions to bbox_predictions.json anymore,
+    # multiple detector processes would overwrite each others file
+    return out_data
+
+"""
+convert an in-memory frame (BGR numpy array as returned by cv2) for the detector
+with input_size the frame is resized so that the shortest side is input_size
+returns (uint8 RGB tensor CHW, (scale_x, scale_y)) similar to read_image_for_detection
+"""
+def prepare_frame_for_detection(frame, input_size=None) :
+    height, width = frame.shape[:2]
+    if input_size is not None and min(height, width) > input_size :
+        resize_factor = input_size / min(height, width)
+        frame = cv2.resize(frame, (round(width * resize_factor), round(height * resize_factor)),
+                           interpolation=cv2.INTER_AREA)
+    img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return torch.from_numpy(img).permute(2, 0, 1), (width / img.shape[1], height / img.shape[0])
+
+
+"""
+run inference on in-memory frames
+frames -> iterator of (image_name, frame), frames are consumed lazily in batches of batch_size
+          so a video decode stream can be passed directly without storing all the frames
+"""
+def run_inference_on_frames(frames, input_size=None, batch_size=10) :
+    torch.cuda.empty_cache()
+    model, preprocess = load_model()
+    out_data = []
+
+    def infer(names, batch) :
+        c_batch = [preprocess(img).to(device) for img, _ in batch]
+        predictions = model(c_batch)
+        return process_predictions(names, predictions, scales=[scale for _, scale in batch])
+
+    with torch.no_grad() :
+        names, batch = [], []
+        for image_name, frame in frames :
+            names.append(image_name)
+            batch.append(prepare_frame_for_detection(frame, input_size))
+            if len(batch) == batch_size :
+                out_data.extend(infer(names, batch))
+                names, batch = [], []
+        if len(batch) > 0 :
+            out_data.extend(infer(names, batch))
     return out_data
 
 # split the images into batches
@@ -75,9 +181,9 @@ def generate_batches(dir_name,batch_size=10):
     return all_batches
 
 # main function binding other fcn's
-def get_person_bboxes_from_dir(dir_path):
+def get_person_bboxes_from_dir(dir_path, input_size=None):
     batches = generate_batches(dir_path)
-    bbox_detections = run_inference(batches)
+    bbox_detections = run_inference(batches, input_size)
     
     out = {}
     for each_bbox in bbox_detections :
@@ -85,8 +191,32 @@ def get_person_bboxes_from_dir(dir_path):
 
     return out
 
+# same as get_person_bboxes_from_dir but for an iterator of (image_name, frame)
+# i.e frames decoded from a video stream, skipping the jpeg round trip
+def get_person_bboxes_from_frames(frames, input_size=None):
+    bbox_detections = run_inference_on_frames(frames, input_size)
+
+    out = {}
+    for each_bbox in bbox_detections :
+        out[each_bbox["image_name"]] = each_bbox["bbox"]
+
+    return out
+
+# compare the per frame decode time of full size and reduced scale decoding
+def benchmark_decode(dir_path, input_size=320, max_frames=200):
+    all_files = [os.path.join(dir_path, f) for f in sorted(os.listdir(dir_path))][:max_frames]
+    timings = {}
+    for name, size in [("full", None), (F"reduced_{input_size}", input_size)] :
+        t_start = time.perf_counter()
+        for f in all_files :
+            read_image_for_detection(f, size)
+        timings[name] = 1000 * (time.perf_counter() - t_start) / max(1, len(all_files))
+        logger.info(F"{name} decode : {timings[name]:.2f} ms per frame over {len(all_files)} frames")
+    return timings
+
 
 if __name__ == "__main__" :
     # src_dir = "ex_jrdb-act_data/images/image_0/tressider-2019-04-26_2"
     src_dir = "/home/akunchala/Documents/PhDStuff/action_tracklet_parser/kth_frames/handclapping/person01_handclapping_d2_uncomp_1/"
+    benchmark_decode(src_dir)
     bboxes = get_person_bboxes_from_dir(src_dir)
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+Temporal resampling of the source frames to the target fps of each dataset
+(each_dataset_config -> target_fps, default global_settings -> target_fps, null -> native fps of the dataset)
+
+The frames are dropped at decode time (ffmpeg select filter for the frame extraction / crop,
+frame skipping in the opencv streaming decoder), all of them use the same mapping with step = fps / target_fps
+    source frame n is kept    <=> ceil(n / step) < ceil((n + 1) / step)
+    target frame of n (kept)  =  ceil(n / step)
+    source frame of target j  =  floor(j * step)
+i.e 30 -> 10 fps keeps the source frames 0, 3, 6, ... and 25 -> 10 fps keeps 0, 2, 5, 7, 10, ...
+
+The frame numbers of the activities (start_f_no, end_f_no, bbox_info) are remapped to the target frames
+right after parsing, so the later stages only see target frame numbers.
+
+python -m lib.utils.resampling -> checks the mapping and the streaming decoder on a synthetic video
+"""
+
+import math
+import numpy as np
+
+from .activity import Activity, frame_from_key
+
+
+def is_target_frame(n, step) :
+    return math.ceil(n / step) < math.ceil((n + 1) / step)
+
+
+def to_target_frame(n, step) :
+    """ target frame of the source frame n (the next kept frame if n is dropped) """
+    return math.ceil(n / step)
+
+
+def to_source_frame(j, step) :
+    """ source frame of the target frame j """
+    n = math.floor(j * step)
+    # same rounding as is_target_frame, in case j * step and n / step round differently
+    while n > 0 and math.ceil(n / step) > j :
+        n -= 1
+    while math.ceil((n + 1) / step) <= j :
+        n += 1
+    return n
+
+
+def get_target_frame_count(no_of_frames, step) :
+    """ no of target frames in a source of no_of_frames frames """
+    return math.ceil(no_of_frames / step)
+
+
+def get_select_expr(step, offset=0) :
+    """ ffmpeg select filter keeping the target frames, offset -> source frame no of the first decoded frame (after a seek) """
+    n = F"(n+{offset})" if offset != 0 else "n"
+    return F"lt(ceil({n}/{step!r}),ceil(({n}+1)/{step!r}))"
+
+
+def resample_activity(act, step, first_frame=0) :
+    """
+    remap the frame numbers of the activity to the target frames, boxes of the dropped frames are removed
+    first_frame -> frame no of the first source frame (1 for the frames extracted from a video, img_00001 is frame 0)
+    """
+    to_target = lambda n : to_target_frame(n - first_frame, step) + first_frame
+    if act.get("start_f_no", None) is not None :
+        act["start_f_no"] = to_target(int(act["start_f_no"]))
+    if act.get("end_f_no", None) is not None :
+        # last kept frame at or before end_f_no
+        act["end_f_no"] = get_target_frame_count(int(act["end_f_no"]) - first_frame + 1, step) - 1 + first_frame
+    if isinstance(act, Activity) :
+        frames = act.base + act.offsets.astype(np.int64) - first_frame
+        keep = np.ceil(frames / step) < np.ceil((frames + 1) / step)
+        act.set_boxes(np.ceil(frames[keep] / step).astype(np.int64) + first_frame, act.boxes[keep])
+    elif act.get("bbox_info", None) is not None :
+        act["bbox_info"] = {F"img_{to_target(frame_from_key(k)):05d}" : v
+                            for k, v in act["bbox_info"].items() if is_target_frame(frame_from_key(k) - first_frame, step)}
+    return act
+
+
+if __name__ == "__main__" :
+    import os
+    import tempfile
+    import cv2
+    from . import utils
+
+    for fps, target_fps in [(30, 10), (25, 10), (30, 15), (29.97, 10), (30, 30)] :
+        step = fps / target_fps
+        kept = [n for n in range(3000) if is_target_frame(n, step)]
+        assert kept == [to_source_frame(j, step) for j in range(len(kept))], (fps, target_fps)
+        assert all(to_target_frame(n, step) == j for j, n in enumerate(kept))
+        assert len(kept) == get_target_frame_count(3000, step)
+        print(F"{fps} -> {target_fps} fps : {kept[:8]} ... {len(kept)} of 3000 frames")
+
+    act = Activity("walking", 3, 29, frames=list(range(3, 30)), boxes=[[n, 0, n + 10, 10] for n in range(3, 30)])
+    legacy = act.to_dict()
+    resample_activity(act, 2.5)
+    resample_activity(legacy, 2.5)
+    assert act.to_dict() == legacy and act.start_f_no == 2 and act.end_f_no == 11
+    assert all(act.get_bbox(j)[0] == to_source_frame(j, 2.5) for j in range(act.start_f_no, act.end_f_no + 1))
+    act = resample_activity(Activity("walking", 1, 10, frames=list(range(1, 11)), boxes=[[n, 0, n + 10, 10] for n in range(1, 11)]), 2.5, 1)
+    assert (act.start_f_no, act.end_f_no) == (1, 4) and [act.get_bbox(j)[0] for j in range(1, 5)] == [1, 3, 6, 8]
+
+    with tempfile.TemporaryDirectory() as tmp_dir :
+        video_path = os.path.join(tmp_dir, "video.avi")
+        writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (64, 48))
+        for n in range(100) :
+            writer.write(np.full((48, 64, 3), n * 2, dtype=np.uint8))
+        writer.release()
+        frames = list(utils.iter_video_frames(video_path, os.path.join(tmp_dir, "frames"), frame_step=2.5))
+        # img_{j + 1} is target frame j
+        assert [x for x, _ in frames] == [F"img_{j + 1:05d}" for j in range(get_target_frame_count(100, 2.5))]
+        assert all(abs(int(frame.mean()) - 2 * to_source_frame(j, 2.5)) <= 2 for j, (_, frame) in enumerate(frames))
+        print(F"streaming decoder kept {len(frames)} of 100 frames at 25 -> 10 fps")
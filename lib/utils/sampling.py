@@ -0,0 +1,67 @@
+"""
+Stratified quick sample of the processed activities (global_settings / each_dataset_config -> sampling)
+
+"sampling" : {
+    "per_class" : 50,       -> tubelets per class (None -> no limit)
+    "per_dataset" : 400,    -> tubelets per dataset (None -> no limit)
+    "seed" : 0
+}
+
+The quotas are applied on the output of the dataset processor i.e before any decoding / detection,
+the no of tubelets of each activity is estimated from its frame range (parts of the activity).
+Activities are taken round robin over the classes (shuffled with the seed), so the per dataset quota
+is shared evenly by the classes. Videos without any selected activity are dropped, so they are never
+decoded or passed to the detector.
+"""
+
+import random
+from loguru import logger
+
+
+def stratified_sample(data, per_class=None, per_dataset=None, seed=0, estimate_tubelets=None) :
+    """
+    data -> {video : [activity_info, ...]} from the dataset processor
+    estimate_tubelets -> estimate_tubelets(activity_info), no of tubelets of the activity (default 1)
+    returns {video : [selected activity_info, ...]} with the same order of videos and activities
+    """
+    if per_class is None and per_dataset is None :
+        return data
+    estimate_tubelets = estimate_tubelets if estimate_tubelets is not None else (lambda act : 1)
+
+    # candidates of each class in a fixed order, shuffled with the seed
+    rng = random.Random(seed)
+    candidates = {}
+    for video in sorted(data.keys()) :
+        for idx, act in enumerate(data[video]) :
+            candidates.setdefault(act['activity'], []).append((video, idx))
+    all_classes = sorted(candidates.keys())
+    for cls in all_classes :
+        rng.shuffle(candidates[cls])
+
+    selected = set()
+    class_counts = {cls : 0 for cls in all_classes}
+    total = 0
+    next_candidate = {cls : 0 for cls in all_classes}
+    active_classes = list(all_classes)
+    while len(active_classes) > 0 and (per_dataset is None or total < per_dataset) :
+        for cls in list(active_classes) :
+            if next_candidate[cls] >= len(candidates[cls]) or (per_class is not None and class_counts[cls] >= per_class) :
+                active_classes.remove(cls)
+                continue
+            video, idx = candidates[cls][next_candidate[cls]]
+            next_candidate[cls] += 1
+            n = estimate_tubelets(data[video][idx])
+            selected.add((video, idx))
+            class_counts[cls] += n
+            total += n
+            if per_dataset is not None and total >= per_dataset :
+                break
+
+    out = {}
+    for video, acts in data.items() :
+        video_acts = [act for idx, act in enumerate(acts) if (video, idx) in selected]
+        if len(video_acts) > 0 :
+            out[video] = video_acts
+    logger.info(F"sampled {len(selected)} of {sum(len(x) for x in data.values())} activities from {len(out)} of {len(data)} videos, "
+                F"~tubelets per class {class_counts}")
+    return out
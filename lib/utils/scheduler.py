@@ -0,0 +1,177 @@
+"""
+Execution scheduler for the generator stages (global_settings -> processing)
+
+modes
+    sequential  -> everything runs in the current process, one task at a time
+    threads     -> thread pool for each stage (ffmpeg / opencv release the GIL)
+    processes   -> process pool for each stage ("parllel" and "parallel" are accepted as aliases)
+
+no of workers for each stage (global_settings -> workers, default no of cpus)
+{
+    "extract" : 4,  -> video to frames extraction
+    "detect" : 4,   -> person detector workers (overrides detector -> num_workers)
+    "crop" : 8,     -> cropping the tubelets of each activity
+    "write" : 2     -> threads writing the cropped frames in each crop worker
+}
+
+The tasks are submitted largest first (based on the given cost) to a shared queue, each worker
+takes the next task when it is done. So a long VIRAT video doesn't end up at the end of a worker
+which already got many short KTH clips. Results are returned in the same order as the tasks, so
+the output is the same for all the modes. on_result is called in the calling process as each result
+arrives, so the results of a long stage can be saved while it is still running.
+
+python -m lib.utils.scheduler -> checks that all the modes give the same results
+python -m lib.analysis.crop_stage_modes -> same check for the crop stage (crop_tubelets on a small frames dataset)
+"""
+
+import os
+import multiprocessing
+import concurrent.futures
+from loguru import logger
+
+MODES = ["sequential", "threads", "processes"]
+MODE_ALIASES = {
+    "parllel" : "processes",
+    "parallel" : "processes"
+}
+STAGES = ["extract", "detect", "crop", "write"]
+
+# context of the tasks in each worker process, sent once when the worker starts instead of with each task
+_worker_context = None
+
+
+def _init_worker(context) :
+    global _worker_context
+    _worker_context = context
+
+
+def _run_with_worker_context(func, task) :
+    return func(_worker_context, task)
+
+
+class Scheduler() :
+    def __init__(self, mode="sequential", workers=None) :
+        mode = MODE_ALIASES.get(mode, mode)
+        assert mode in MODES, F"unknown processing mode {mode}, supported {MODES + list(MODE_ALIASES.keys())}"
+        self.mode = mode
+        workers = workers if workers is not None else {}
+        for stage in workers.keys() :
+            assert stage in STAGES, F"unknown stage {stage} in workers, supported {STAGES}"
+        self.workers = {stage : max(1, int(n)) for stage, n in workers.items()}
+        self.write_pool = self.create_write_pool()
+        logger.info(F"initialized {self.mode} scheduler with workers {self.workers}")
+
+    def get_workers(self, stage, default=None) :
+        """ no of workers of the stage, if not configured default (None -> no of cpus) """
+        if self.mode == "sequential" :
+            return 1
+        return self.workers.get(stage, default if default is not None else multiprocessing.cpu_count())
+
+    def get_task_order(self, stage, tasks, cost=None) :
+        """ indices of the tasks in the order map starts them (ex. to stage the sources in the same order) """
+        tasks = list(tasks)
+        order = list(range(len(tasks)))
+        if cost is not None and min(self.get_workers(stage), len(tasks)) > 1 :
+            order = sorted(order, key=lambda i : cost(tasks[i]), reverse=True)
+        return order
+
+    def map(self, stage, func, tasks, cost=None, context=None, on_result=None) :
+        """
+        run func over the tasks with the workers of the stage, results are in the same order as the tasks
+        cost -> cost(task), the tasks with higher cost are started first
+        context -> if given func(context, task) is called, the context is sent once to each worker process
+                    (ex. the generator as context with an unbound method as func)
+        on_result -> on_result(result), called in the calling process as each result arrives (completion order)
+        """
+        tasks = list(tasks)
+        if context is not None :
+            call = lambda task : func(context, task)
+        else :
+            call = func
+        num_workers = min(self.get_workers(stage), len(tasks))
+        on_result = on_result if on_result is not None else (lambda result : None)
+        if num_workers <= 1 :
+            results = []
+            for t in tasks :
+                results.append(call(t))
+                on_result(results[-1])
+            return results
+
+        order = self.get_task_order(stage, tasks, cost)
+
+        if self.mode == "threads" :
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+            submit = lambda task : executor.submit(call, task)
+        else :
+            # spawn instead of fork, the parent may have initialized torch thread pools
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers,
+                                                               mp_context=multiprocessing.get_context("spawn"),
+                                                               initializer=_init_worker, initargs=(context,))
+            if context is not None :
+                submit = lambda task : executor.submit(_run_with_worker_context, func, task)
+            else :
+                submit = lambda task : executor.submit(func, task)
+
+        results = [None] * len(tasks)
+        with executor :
+            futures = {submit(tasks[i]) : i for i in order}
+            for future in concurrent.futures.as_completed(futures) :
+                results[futures[future]] = future.result()
+                on_result(results[futures[future]])
+        return results
+
+    def create_write_pool(self) :
+        if self.get_workers("write") <= 1 :
+            return None
+        return concurrent.futures.ThreadPoolExecutor(max_workers=self.get_workers("write"))
+
+    def get_write_pool(self) :
+        """ thread pool to write the frames in the current process (None -> write in the calling thread) """
+        return self.write_pool
+
+    def __getstate__(self) :
+        # thread pools are not sent to the worker processes, each process creates its own
+        state = self.__dict__.copy()
+        state["write_pool"] = None
+        return state
+
+    def __setstate__(self, state) :
+        self.__dict__.update(state)
+        self.write_pool = self.create_write_pool()
+
+
+def _self_check_task(context, task) :
+    """ uneven work, crops a synthetic frame and writes the crops, returns the hash of the outputs """
+    import hashlib
+    import numpy as np
+    import cv2
+    out_dir, name, n_frames = task
+    rng = np.random.default_rng(n_frames)
+    frame = rng.integers(0, 255, (context["size"], context["size"], 3), dtype=np.uint8)
+    digest = hashlib.md5()
+    for idx in range(n_frames) :
+        crop = frame[idx % 50 : idx % 50 + 100, idx % 30 : idx % 30 + 80]
+        ok, buf = cv2.imencode(".jpg", crop)
+        digest.update(buf.tobytes())
+    with open(os.path.join(out_dir, F"{name}.md5"), "w") as fw :
+        fw.write(digest.hexdigest())
+    return name, n_frames, digest.hexdigest()
+
+
+if __name__ == "__main__" :
+    import tempfile
+    # long VIRAT like tasks next to many short KTH like tasks
+    lengths = [2000, 1500] + [40] * 60 + [300] * 10
+    all_results = {}
+    for mode in MODES :
+        with tempfile.TemporaryDirectory() as out_dir :
+            scheduler = Scheduler(mode, {"crop" : 4})
+            tasks = [(out_dir, F"task{idx:03d}", n) for idx, n in enumerate(lengths)]
+            arrived = []
+            results = scheduler.map("crop", _self_check_task, tasks, cost=lambda t : t[2], context={"size" : 256},
+                                    on_result=arrived.append)
+            assert sorted(arrived) == sorted(results), F"on_result missed results in {mode} mode"
+            written = {x : open(os.path.join(out_dir, x)).read() for x in sorted(os.listdir(out_dir))}
+            all_results[mode] = (results, written)
+    assert all(all_results[mode] == all_results["sequential"] for mode in MODES), "results differ between the modes"
+    print(F"same results for {MODES} over {len(lengths)} tasks")
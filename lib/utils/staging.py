@@ -0,0 +1,248 @@
+"""
+Read ahead staging of the source videos / image dirs from network storage to local scratch
+(global_settings -> staging)
+
+"staging" : {
+    "scratch_dir" : "/tmp/act_tubelet_scratch",   -> local disk
+    "budget_gb" : 50,                              -> max size of the staged sources
+    "num_workers" : 4                              -> parallel copies
+}
+
+Before the extract and crop stages the generator passes the sources in the order the scheduler will
+process them, they are copied in bulk (one sequential copy per video / dir instead of small synchronous
+reads) in the background while the stage is running. Readers call resolve(path), which returns the
+local copy if it is staged, otherwise the original path (so a source which is not staged yet or was
+evicted is read from the network as before).
+
+The copies only run ahead of the readers as far as the budget allows: a staged source which is not read
+yet is never evicted, and the next copy waits until the staged but unread sources leave room for it
+(a source counts as read once its entry mtime is touched by resolve).
+
+scratch layout
+    <scratch_dir>/<md5(src path)[:16]>/<basename>   -> staged video or image dir
+the mtime of <scratch_dir>/<md5(src path)[:16]> is the last use (touched by resolve in any worker process),
+the least recently used sources are evicted when the budget is exceeded. Staged sources are kept across runs.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import threading
+import concurrent.futures
+from loguru import logger
+
+TOUCH_INTERVAL = 30 # sec
+WAIT_INTERVAL = 0.5 # sec, copies waiting for the readers to catch up
+
+
+def new_stats() :
+    return {"local_reads" : 0, "remote_reads" : 0, "staged" : 0, "staged_bytes" : 0, "copy_time" : 0.0}
+
+
+def merge_stats(all_stats) :
+    out = new_stats()
+    for stats in all_stats :
+        for k in out.keys() :
+            out[k] += stats[k]
+    return out
+
+
+def log_stats(stats) :
+    reads = stats["local_reads"] + stats["remote_reads"]
+    if reads == 0 and stats["staged"] == 0 :
+        return
+    copy_rate = stats["staged_bytes"] / 2**20 / stats["copy_time"] if stats["copy_time"] > 0 else 0.0
+    logger.info(F"staging : {stats['local_reads']} of {reads} source reads from local scratch, "
+                F"staged {stats['staged']} sources ({stats['staged_bytes'] / 2**30:.2f} GB at {copy_rate:.1f} MB/s)")
+
+
+def get_size(path) :
+    if os.path.isfile(path) :
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path) :
+        total += sum(os.path.getsize(os.path.join(root, x)) for x in files)
+    return total
+
+
+class SourceStager() :
+    def __init__(self, scratch_dir=None, budget_gb=50, num_workers=4) :
+        """ scratch_dir None -> staging is disabled, resolve returns the original paths """
+        self.scratch_dir = scratch_dir
+        self.enabled = scratch_dir is not None
+        self.budget = int(budget_gb * 2**30)
+        self.num_workers = num_workers
+        self.remote_roots = []
+        self.stats = new_stats()
+        self.last_touch = {}
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pending = []
+        # {entry dir : size} of the staged sources, only used by the main process
+        self.entries = {}
+        # {entry dir : mtime when staged} of the sources which are not read yet
+        self.unread = {}
+        self.stopping = False
+        if self.enabled :
+            os.makedirs(self.scratch_dir, exist_ok=True)
+            for x in os.scandir(self.scratch_dir) :
+                if x.is_dir() and not x.name.endswith(".tmp") :
+                    self.entries[x.path] = get_size(x.path)
+                elif x.name.endswith(".tmp") : # interrupted copy
+                    shutil.rmtree(x.path, ignore_errors=True)
+            logger.info(F"initialized staging in {self.scratch_dir} with {len(self.entries)} staged sources "
+                        F"({sum(self.entries.values()) / 2**30:.2f} of {budget_gb} GB)")
+
+    def set_remote_roots(self, remote_roots) :
+        """ only the reads under these dirs are counted as remote reads (tmp frames etc. are already local) """
+        self.remote_roots = [os.path.join(os.path.abspath(x), "") for x in remote_roots if x is not None]
+
+    def is_remote(self, path) :
+        path = os.path.abspath(path)
+        return any(path.startswith(x) for x in self.remote_roots)
+
+    def get_entry(self, src_path) :
+        key = hashlib.md5(os.path.abspath(src_path).encode()).hexdigest()[:16]
+        return os.path.join(self.scratch_dir, key)
+
+    def get_local_path(self, src_path) :
+        return os.path.join(self.get_entry(src_path), os.path.basename(os.path.normpath(src_path)))
+
+    def touch(self, entry) :
+        now = time.time()
+        if now - self.last_touch.get(entry, 0) > TOUCH_INTERVAL :
+            self.last_touch[entry] = now
+            try :
+                os.utime(entry)
+            except FileNotFoundError :
+                pass
+
+    def resolve(self, path) :
+        """ local copy of the video (or of the image in a staged image dir) if staged, else path """
+        if not self.enabled or not self.is_remote(path) :
+            return path
+        # staged video / image dir or an image of a staged dir
+        for src_path, rel_path in [(path, ""), (os.path.dirname(path), os.path.basename(path))] :
+            local_path = os.path.join(self.get_local_path(src_path), rel_path) if rel_path else self.get_local_path(src_path)
+            if os.path.exists(local_path) :
+                self.touch(self.get_entry(src_path))
+                with self.lock :
+                    self.stats["local_reads"] += 1
+                return local_path
+        with self.lock :
+            self.stats["remote_reads"] += 1
+        return path
+
+    def take_stats(self) :
+        """ stats since the last call (so the stats of the tasks in worker processes can be summed up) """
+        with self.lock :
+            stats, self.stats = self.stats, new_stats()
+        return stats
+
+    def update_unread(self) :
+        """ drop the sources which were read since they were staged (resolve touched the entry) """
+        for entry, staged_mtime in list(self.unread.items()) :
+            if staged_mtime is None : # copy in progress
+                continue
+            try :
+                if os.path.getmtime(entry) > staged_mtime :
+                    del self.unread[entry]
+            except FileNotFoundError :
+                pass
+
+    def get_unread_size(self) :
+        return sum(self.entries.get(x, 0) for x in self.unread.keys())
+
+    def evict(self, size) :
+        """ remove the least recently used sources until size fits in the budget, the unread sources are kept """
+        while sum(self.entries.values()) + size > self.budget :
+            # copies in progress (no entry dir yet) and sources which are not read yet are not evicted
+            staged = [x for x in self.entries.keys() if os.path.exists(x) and x not in self.unread]
+            if len(staged) == 0 :
+                break
+            entry = min(staged, key=os.path.getmtime)
+            del self.entries[entry]
+            # open files (ex. ffmpeg reading a staged video) are still readable after the removal,
+            # images of an evicted dir are read from the network
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def stage(self, src_path) :
+        entry = self.get_entry(src_path)
+        if entry in self.entries or not os.path.exists(src_path) :
+            return
+        size = get_size(src_path)
+        if size > self.budget :
+            return
+        # wait until the staged but unread sources leave room for this one (the readers are behind)
+        while True :
+            with self.lock :
+                if self.stopping :
+                    return
+                self.update_unread()
+                if self.get_unread_size() + size <= self.budget :
+                    self.evict(size)
+                    self.entries[entry] = size
+                    self.unread[entry] = None
+                    break
+            time.sleep(WAIT_INTERVAL)
+        t_start = time.perf_counter()
+        tmp_entry = F"{entry}.tmp"
+        local_path = os.path.join(tmp_entry, os.path.basename(os.path.normpath(src_path)))
+        try :
+            os.makedirs(tmp_entry, exist_ok=True)
+            if os.path.isdir(src_path) :
+                shutil.copytree(src_path, local_path)
+            else :
+                shutil.copyfile(src_path, local_path)
+            # mtime before the rename, a read after the rename touches the entry with a later mtime
+            staged_mtime = time.time() - 1
+            os.utime(tmp_entry, (staged_mtime, staged_mtime))
+            os.rename(tmp_entry, entry) # visible to the readers only once complete
+        except OSError as e :
+            logger.warning(F"unable to stage {src_path}, failed with {e}")
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            with self.lock :
+                self.entries.pop(entry, None)
+                self.unread.pop(entry, None)
+            return
+        with self.lock :
+            self.unread[entry] = staged_mtime
+            self.stats["staged"] += 1
+            self.stats["staged_bytes"] += size
+            self.stats["copy_time"] += time.perf_counter() - t_start
+
+    def prefetch(self, src_paths) :
+        """ copy the sources in the background, in the given order (the order they will be read) """
+        if not self.enabled :
+            return
+        if self.executor is None :
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers)
+        src_paths = list(dict.fromkeys(src_paths))
+        logger.info(F"staging {len(src_paths)} sources to {self.scratch_dir}")
+        self.pending.extend([self.executor.submit(self.stage, x) for x in src_paths])
+
+    def finish(self) :
+        """ cancel the copies which are not started yet (end of the stage) """
+        self.stopping = True
+        for future in self.pending :
+            future.cancel()
+        concurrent.futures.wait(self.pending)
+        self.pending = []
+        self.stopping = False
+        # sources of the stage which were never read can be evicted by the next stage
+        self.unread = {}
+
+    def __getstate__(self) :
+        # worker processes only resolve the paths, the copies are done by the main process
+        state = self.__dict__.copy()
+        state["lock"] = None
+        state["executor"] = None
+        state["pending"] = []
+        state["stats"] = new_stats()
+        state["unread"] = {}
+        return state
+
+    def __setstate__(self, state) :
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
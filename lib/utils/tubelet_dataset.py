@@ -0,0 +1,400 @@
+"""
+Random access reader and clip loader for the generated tubelet dataset
+
+layouts (resolved for each tubelet in this order)
+    packed      -> <packed_dir>/packed_frames.u8 (memmap, N x H x W x 3 uint8) + packed_index.json, see TubeletDataset.pack
+    manifest    -> parts_manifest.txt (name frames_dir frame_offset no_of_frames), the part is a range of the activity frame store
+    jpg dir     -> <dataset_dir>/<name>/img_XXXXX.jpg
+    mp4         -> <dataset_dir>/<name>.mp4
+
+clip sampling (clip_len frames, frame_stride between the frames of a clip)
+    uniform -> one clip per tubelet, clip_len frames evenly spread over the tubelet
+    random  -> one clip per tubelet, random window (changes with set_epoch, same for the same seed and epoch)
+    dense   -> all the windows of the tubelet, clip_stride frames apart (each window is an item)
+short tubelets are padded with the last frame
+
+usage
+dataset = TubeletDataset(dataset_dir, "train", clip_len=16, sampling="uniform", size=(112, 112))
+clip, label = dataset[0] # clip -> (clip_len x H x W x 3) uint8 RGB
+for clips, labels in ClipLoader(dataset, batch_size=8, num_workers=8) : ...
+
+dataset works as a map style dataset for torch DataLoader as well (__len__ / __getitem__)
+
+python -m lib.utils.tubelet_dataset [dataset_dir] -> clips/sec for different no of workers (synthetic dataset if no dir)
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+import cv2
+from loguru import logger
+
+SAMPLING = ["uniform", "random", "dense"]
+PACKED_FRAMES_FILE = "packed_frames.u8"
+PACKED_INDEX_FILE = "packed_index.json"
+
+
+def read_split_file(split_file) :
+    """ [(tubelet_name, no_of_frames, class_idx)] """
+    out = []
+    with open(split_file) as fd :
+        for line in fd :
+            parts = line.split()
+            if len(parts) == 3 :
+                out.append((parts[0], int(parts[1]), int(parts[2])))
+    return out
+
+
+def read_parts_manifest(dataset_dir) :
+    """ {tubelet_name : (frames_dir, frame_offset, no_of_frames)} """
+    manifest_file = os.path.join(dataset_dir, "parts_manifest.txt")
+    if not os.path.isfile(manifest_file) :
+        return {}
+    out = {}
+    with open(manifest_file) as fd :
+        for line in fd :
+            parts = line.split()
+            if len(parts) == 4 :
+                out[parts[0]] = (parts[1], int(parts[2]), int(parts[3]))
+    return out
+
+
+def frame_no(f_name) :
+    """ img_00042.jpg -> 42 """
+    return int(os.path.splitext(f_name)[0].split("_")[-1])
+
+
+def read_video_frames(video_path, frame_indices) :
+    """ decode the given frames of the video, the video is read sequentially from the first to the last index """
+    cap = cv2.VideoCapture(video_path)
+    first, last = min(frame_indices), max(frame_indices)
+    if first > 0 :
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    wanted = set(frame_indices)
+    frames = {}
+    last_frame = None
+    for idx in range(first, last + 1) :
+        ok, frame = cap.read()
+        if not ok :
+            break
+        last_frame = frame
+        if idx in wanted :
+            frames[idx] = frame
+    cap.release()
+    if last_frame is None :
+        raise IOError(F"unable to decode {video_path} frames {first}-{last}")
+    # frames after the end of the video (frame count of the container can be off by a few frames)
+    return [frames.get(idx, last_frame) for idx in frame_indices]
+
+
+class TubeletDataset() :
+    def __init__(self, dataset_dir, split="train", clip_len=16, sampling="uniform", frame_stride=1, clip_stride=None,
+                 size=None, rgb=True, cache_bytes=0, packed_dir=None, seed=0) :
+        """
+        dataset_dir -> output dir of the generator (train.txt, test.txt, class_list.txt, parts_manifest.txt)
+        split -> train / test or the path of a split file (ex. tubelet_train.txt)
+        size -> (height, width) to resize the frames, needed to batch the clips
+        cache_bytes -> byte budget of the in memory LRU cache of decoded clips (0 -> no cache)
+        packed_dir -> dir of the packed frames (default dataset_dir if it has packed_index.json)
+        """
+        assert sampling in SAMPLING, F"unknown sampling {sampling}, supported {SAMPLING}"
+        self.dataset_dir = dataset_dir
+        split_file = split if os.path.isfile(split) else os.path.join(dataset_dir, F"{split}.txt")
+        self.tubelets = read_split_file(split_file)
+        class_list_file = os.path.join(os.path.dirname(split_file), "class_list.txt")
+        self.classes = [x.strip() for x in open(class_list_file)] if os.path.isfile(class_list_file) else None
+        self.clip_len = clip_len
+        self.sampling = sampling
+        self.frame_stride = frame_stride
+        self.clip_stride = clip_stride if clip_stride is not None else clip_len * frame_stride
+        self.size = size
+        self.rgb = rgb
+        self.seed = seed
+        self.epoch = 0
+        self.manifest = read_parts_manifest(dataset_dir)
+
+        packed_dir = packed_dir if packed_dir is not None else dataset_dir
+        self.packed_index = None
+        if os.path.isfile(os.path.join(packed_dir, PACKED_INDEX_FILE)) :
+            with open(os.path.join(packed_dir, PACKED_INDEX_FILE)) as fd :
+                packed_info = json.load(fd)
+            self.packed_index = packed_info["tubelets"]
+            h, w = packed_info["size"]
+            self.packed_frames = np.memmap(os.path.join(packed_dir, PACKED_FRAMES_FILE), dtype=np.uint8, mode="r",
+                                           shape=(packed_info["no_of_frames"], h, w, 3))
+            logger.info(F"using packed frames {packed_dir} ({len(self.packed_index)} tubelets)")
+
+        # dense sampling -> (tubelet_idx, window start) for each window
+        if sampling == "dense" :
+            span = (clip_len - 1) * frame_stride + 1
+            self.items = [(t_idx, start) for t_idx, (_, n, _) in enumerate(self.tubelets)
+                          for start in range(0, max(n - span, 0) + 1, self.clip_stride)]
+        else :
+            self.items = [(t_idx, None) for t_idx in range(len(self.tubelets))]
+
+        # frame listing of the jpg dirs, shared by the parts of an activity frame store
+        self.dir_listing = {}
+        self.cache_bytes = cache_bytes
+        self.cache = collections.OrderedDict()
+        self.cached_bytes = 0
+        self.cache_hits = 0
+        self.cache_lock = threading.Lock()
+        logger.info(F"initialized {len(self.tubelets)} tubelets from {split_file} ({len(self.items)} clips, {sampling} sampling)")
+
+    def __len__(self) :
+        return len(self.items)
+
+    def set_epoch(self, epoch) :
+        """ random sampling picks different windows in each epoch """
+        self.epoch = epoch
+
+    def get_clip_indices(self, item_idx) :
+        """ frame indices (within the tubelet) of the clip """
+        t_idx, start = self.items[item_idx]
+        n = self.tubelets[t_idx][1]
+        span = (self.clip_len - 1) * self.frame_stride + 1
+        if self.sampling == "uniform" :
+            indices = np.linspace(0, max(n - 1, 0), self.clip_len).round().astype(int)
+        else :
+            if self.sampling == "random" :
+                # seeded with the item, so the workers don't share a random generator
+                rng = np.random.default_rng((self.seed, self.epoch, item_idx))
+                start = int(rng.integers(0, max(n - span, 0) + 1))
+            indices = start + np.arange(self.clip_len) * self.frame_stride
+        return np.minimum(indices, max(n - 1, 0)).tolist()
+
+    def list_frames(self, frames_dir) :
+        if frames_dir not in self.dir_listing :
+            self.dir_listing[frames_dir] = sorted(x for x in os.listdir(frames_dir) if x.endswith(".jpg"))
+        return self.dir_listing[frames_dir]
+
+    def read_frames(self, name, indices) :
+        """ decoded (BGR) frames of the tubelet """
+        if self.packed_index is not None and name in self.packed_index :
+            start, _ = self.packed_index[name]
+            return [self.packed_frames[start + idx] for idx in indices]
+
+        frame_offset = 0
+        path = os.path.join(self.dataset_dir, name)
+        if name in self.manifest :
+            frames_dir, frame_offset, _ = self.manifest[name]
+            path = os.path.join(self.dataset_dir, frames_dir)
+        elif not os.path.isdir(path) :
+            path = F"{path}.mp4"
+
+        if path.endswith(".mp4") :
+            return read_video_frames(path, [frame_offset + idx for idx in indices])
+
+        all_frames = self.list_frames(path)
+        if frame_offset > 0 :
+            # frames of the part in the activity frame store (may have gaps with org bbox variation)
+            first = np.searchsorted([frame_no(x) for x in all_frames], frame_offset)
+            all_frames = all_frames[first:]
+        frames = []
+        for idx in indices :
+            img = cv2.imread(os.path.join(path, all_frames[min(idx, len(all_frames) - 1)]))
+            if img is None :
+                raise IOError(F"unable to read frame {idx} of {name}")
+            frames.append(img)
+        return frames
+
+    def get_clip(self, item_idx) :
+        """ (clip_len x H x W x 3) uint8 """
+        name = self.tubelets[self.items[item_idx][0]][0]
+        indices = self.get_clip_indices(item_idx)
+        cache_key = (name, tuple(indices))
+        if self.cache_bytes > 0 :
+            with self.cache_lock :
+                if cache_key in self.cache :
+                    self.cache.move_to_end(cache_key)
+                    self.cache_hits += 1
+                    return self.cache[cache_key]
+
+        frames = self.read_frames(name, indices)
+        if self.size is not None :
+            frames = [x if x.shape[:2] == tuple(self.size) else cv2.resize(x, (self.size[1], self.size[0])) for x in frames]
+        if self.rgb :
+            frames = [cv2.cvtColor(np.ascontiguousarray(x), cv2.COLOR_BGR2RGB) for x in frames]
+        clip = np.stack(frames)
+
+        if self.cache_bytes > 0 and clip.nbytes <= self.cache_bytes :
+            with self.cache_lock :
+                if cache_key not in self.cache :
+                    self.cache[cache_key] = clip
+                    self.cached_bytes += clip.nbytes
+                while self.cached_bytes > self.cache_bytes :
+                    _, old_clip = self.cache.popitem(last=False)
+                    self.cached_bytes -= old_clip.nbytes
+        return clip
+
+    def __getitem__(self, item_idx) :
+        """ (clip, class_idx) """
+        return self.get_clip(item_idx), self.tubelets[self.items[item_idx][0]][2]
+
+    def pack(self, out_dir, size=(112, 112), num_workers=8) :
+        """
+        write all the frames of the tubelets resized to size into a single memmap (packed layout),
+        reading a clip from it is a slice of the memmap without any decoding
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        h, w = size
+        index = {}
+        no_of_frames = 0
+        for name, n, _ in self.tubelets :
+            index[name] = [no_of_frames, n]
+            no_of_frames += n
+        packed_frames = np.memmap(os.path.join(out_dir, PACKED_FRAMES_FILE), dtype=np.uint8, mode="w+",
+                                  shape=(max(no_of_frames, 1), h, w, 3))
+
+        def pack_tubelet(tubelet) :
+            name, n, _ = tubelet
+            if n == 0 :
+                return
+            start, _ = index[name]
+            for idx, frame in enumerate(self.read_frames(name, list(range(n)))) :
+                packed_frames[start + idx] = frame if frame.shape[:2] == (h, w) else cv2.resize(frame, (w, h))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor :
+            list(executor.map(pack_tubelet, self.tubelets))
+        packed_frames.flush()
+        with open(os.path.join(out_dir, PACKED_INDEX_FILE), "w") as fw :
+            json.dump({"size" : [h, w], "no_of_frames" : max(no_of_frames, 1), "tubelets" : index}, fw)
+        logger.info(F"packed {len(index)} tubelets ({no_of_frames} frames) to {out_dir}")
+
+
+def collate(samples) :
+    """ stack the clips (if they have the same shape) and the labels """
+    clips = [x for x, _ in samples]
+    labels = np.array([y for _, y in samples])
+    if all(x.shape == clips[0].shape for x in clips) :
+        return np.stack(clips), labels
+    return clips, labels
+
+
+class ClipLoader() :
+    def __init__(self, dataset, batch_size=1, num_workers=4, prefetch=2, shuffle=False, seed=0, drop_last=False) :
+        """
+        clips are decoded by num_workers threads (cv2 decoding releases the GIL),
+        prefetch -> no of batches decoded ahead of the consumer
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.num_workers = max(1, num_workers)
+        self.prefetch = max(1, prefetch)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+    def __len__(self) :
+        if self.drop_last :
+            return len(self.dataset) // self.batch_size
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def get_batches(self) :
+        order = np.arange(len(self.dataset))
+        if self.shuffle :
+            order = np.random.default_rng((self.seed, self.epoch)).permutation(order)
+        batches = [order[i : i + self.batch_size].tolist() for i in range(0, len(order), self.batch_size)]
+        if self.drop_last and len(batches) > 0 and len(batches[-1]) < self.batch_size :
+            batches = batches[:-1]
+        return batches
+
+    def __iter__(self) :
+        if hasattr(self.dataset, "set_epoch") :
+            self.dataset.set_epoch(self.epoch)
+        batches = self.get_batches()
+        self.epoch += 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers) as executor :
+            pending = collections.deque()
+            next_batch = 0
+            while next_batch < len(batches) or len(pending) > 0 :
+                # keep the workers busy with the items of the next prefetch batches
+                while next_batch < len(batches) and len(pending) < self.prefetch :
+                    pending.append([executor.submit(self.dataset.__getitem__, i) for i in batches[next_batch]])
+                    next_batch += 1
+                yield collate([x.result() for x in pending.popleft()])
+
+
+def benchmark(dataset, all_num_workers=(1, 2, 4, 8), batch_size=8, max_clips=None) :
+    """ {num_workers : clips/sec} over one pass (or max_clips) of the dataset """
+    out = {}
+    for num_workers in all_num_workers :
+        loader = ClipLoader(dataset, batch_size=batch_size, num_workers=num_workers, shuffle=True)
+        no_of_clips = 0
+        t_start = time.perf_counter()
+        for clips, _ in loader :
+            no_of_clips += len(clips)
+            if max_clips is not None and no_of_clips >= max_clips :
+                break
+        out[num_workers] = no_of_clips / (time.perf_counter() - t_start)
+        logger.info(F"{num_workers} workers -> {out[num_workers]:.1f} clips/sec")
+    return out
+
+
+def create_synthetic_dataset(dataset_dir, no_of_activities=12, activity_len=96, part_len=48, part_stride=24) :
+    """ jpg dir tubelets and the same frames as manifest parts of activity frame stores """
+    rng = np.random.default_rng(0)
+    copy_lines, manifest_parts = [], []
+    for act_idx in range(no_of_activities) :
+        store = os.path.join(".frames", F"SYN-video{act_idx}-walking-id0_{activity_len}")
+        os.makedirs(os.path.join(dataset_dir, store))
+        base = rng.integers(0, 255, (240, 180, 3), dtype=np.uint8)
+        for f_idx in range(activity_len) :
+            frame = np.roll(base, f_idx * 2, axis=1)
+            cv2.imwrite(os.path.join(dataset_dir, store, F"img_{f_idx:05d}.jpg"), frame)
+        for p_idx, start in enumerate(range(0, activity_len - part_len + 1, part_stride)) :
+            name = F"SYN-video{act_idx}-walking-id0_{activity_len}-p{p_idx}"
+            manifest_parts.append((name, store, start))
+            copy_name = F"{name}_copy"
+            os.makedirs(os.path.join(dataset_dir, copy_name))
+            for f_idx in range(part_len) :
+                os.link(os.path.join(dataset_dir, store, F"img_{start + f_idx:05d}.jpg"),
+                        os.path.join(dataset_dir, copy_name, F"img_{f_idx:05d}.jpg"))
+            copy_lines.append(F"{copy_name} {part_len} {act_idx % 3}\n")
+    with open(os.path.join(dataset_dir, "copy.txt"), "w") as fw :
+        fw.writelines(copy_lines)
+    with open(os.path.join(dataset_dir, "train.txt"), "w") as fw :
+        fw.writelines([F"{name} {part_len} {idx % 3}\n" for idx, (name, _, _) in enumerate(manifest_parts)])
+    with open(os.path.join(dataset_dir, "parts_manifest.txt"), "w") as fw :
+        fw.writelines([F"{name} {store} {start} {part_len}\n" for name, store, start in manifest_parts])
+
+
+if __name__ == "__main__" :
+    import tempfile
+    if len(sys.argv) > 1 :
+        dataset = TubeletDataset(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "train", size=(112, 112))
+        benchmark(dataset, max_clips=2000)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as dataset_dir :
+        create_synthetic_dataset(dataset_dir)
+        # manifest parts and their jpg dir copies give the same clips
+        manifest_dataset = TubeletDataset(dataset_dir, "train", sampling="dense", clip_stride=8, size=(112, 112))
+        copy_dataset = TubeletDataset(dataset_dir, os.path.join(dataset_dir, "copy.txt"), sampling="dense", clip_stride=8,
+                                      size=(112, 112))
+        assert len(manifest_dataset) == len(copy_dataset)
+        assert all(np.array_equal(manifest_dataset[i][0], copy_dataset[i][0]) for i in range(0, len(copy_dataset), 7))
+
+        results = {}
+        for name, dataset in [("jpg dirs", copy_dataset), ("manifest", manifest_dataset)] :
+            results[name] = benchmark(dataset)
+
+        copy_dataset.pack(os.path.join(dataset_dir, "packed"), size=(112, 112))
+        packed_dataset = TubeletDataset(dataset_dir, os.path.join(dataset_dir, "copy.txt"), sampling="dense", clip_stride=8,
+                                        size=(112, 112), packed_dir=os.path.join(dataset_dir, "packed"))
+        results["packed"] = benchmark(packed_dataset)
+
+        cached_dataset = TubeletDataset(dataset_dir, os.path.join(dataset_dir, "copy.txt"), sampling="dense", clip_stride=8,
+                                        size=(112, 112), cache_bytes=2**30)
+        benchmark(cached_dataset, all_num_workers=(4,)) # first epoch fills the cache
+        results["cached"] = benchmark(cached_dataset)
+
+        print(F"clips/sec ({len(copy_dataset)} clips of {copy_dataset.clip_len} frames)")
+        for name, result in results.items() :
+            print(F"{name:10s} " + ", ".join(F"{k} workers {v:.0f}" for k, v in result.items()))
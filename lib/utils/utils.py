@@ -1,7 +1,14 @@
 import os
 import shutil
+import time
+import sqlite3
+import cv2
+import multiprocessing
+import concurrent.futures
 from loguru import logger
 
+from . import resampling
+
 def create_dir_if_not_exists(dir_to_check) :
     # logger.info(F"creating dir(s) {dir_to_check}")
     if type(dir_to_check) == list :
@@ -14,4 +21,132 @@ def check_if_file_exists(file_to_check) :
     return os.path.isfile(file_to_check)
 
 def check_if_dir_exists(dir_to_check) :
-    return os.path.isdir(dir_to_check)
\ No newline at end of file
+    return os.path.isdir(dir_to_check)
+
+def timed(func, *args) :
+    """ returns (func(*args), time taken in sec) """
+    t_start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t_start
+
+def get_file_size(file_path) :
+    """ size of the file in bytes, 0 if the file is not found """
+    try :
+        return os.path.getsize(file_path)
+    except OSError :
+        return 0
+
+def iter_video_frames(video_path, out_dir=None, frame_step=1) :
+    """
+    decode the video with opencv and yield (image_name, frame) for each frame
+    image names follow the ffmpeg frame extraction i.e img_00001 is the first frame
+    if out_dir is given, each frame is also written to out_dir as jpg, so the same
+    decode pass can be used for both detection and cropping
+    frame_step -> fps / target_fps, the dropped frames are only grabbed (not converted, written or yielded)
+                  and the kept frames are numbered continuously (see resampling)
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened() :
+        raise IOError(F"unable to open video {video_path}")
+    if out_dir is not None :
+        create_dir_if_not_exists(out_dir)
+    f_idx = 1
+    src_idx = 0
+    try :
+        while True :
+            if frame_step != 1 and not resampling.is_target_frame(src_idx, frame_step) :
+                src_idx = src_idx + 1
+                if not cap.grab() :
+                    break
+                continue
+            ok, frame = cap.read()
+            src_idx = src_idx + 1
+            if not ok :
+                break
+            img_name = F"img_{f_idx:05d}"
+            if out_dir is not None :
+                cv2.imwrite(os.path.join(out_dir, F"{img_name}.jpg"), frame)
+            yield img_name, frame
+            f_idx = f_idx + 1
+    finally :
+        cap.release()
+
+def run_in_executor(func, *iterables, num_workers=None, chunksize=1) :
+    """
+    same as map(func, *iterables) but on a process pool, results are in the same order as the inputs
+    num_workers -> no of processes (None -> no of cpus, 1 runs in the current process)
+    func has to be side effect free (results are returned to the parent), since it runs in a different process
+    """
+    num_workers = multiprocessing.cpu_count() if num_workers is None else num_workers
+    if num_workers <= 1 :
+        return list(map(func, *iterables))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor :
+        return list(executor.map(func, *iterables, chunksize=chunksize))
+
+def get_video_info(video_path) :
+    """ frame count, fps and frame size of the video from its header """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened() :
+        raise IOError(F"unable to open video {video_path}")
+    try :
+        return {
+            "frame_count" : int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            "fps" : cap.get(cv2.CAP_PROP_FPS),
+            "width" : int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height" : int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        }
+    finally :
+        cap.release()
+
+def get_annotation_store_path(dataset_dir, db_path=None) :
+    """ db_path (global_settings -> annotation_store) if given, else the default annotations.db of the dataset dir """
+    return db_path if db_path is not None else os.path.join(dataset_dir, "annotations.db")
+
+def query_annotation_store(dataset_dir, query, db_path=None) :
+    """ rows of a read only query on the annotation store of the dataset dir (None if there is no store or the query fails) """
+    db_path = get_annotation_store_path(dataset_dir, db_path)
+    if not os.path.isfile(db_path) :
+        return None
+    conn = sqlite3.connect(F"file:{db_path}?mode=ro", uri=True)
+    try :
+        return conn.execute(query).fetchall()
+    except sqlite3.OperationalError : # db created by an older version
+        return None
+    finally :
+        conn.close()
+
+def list_manifest_parts(dataset_dir, db_path=None) :
+    """ names of the tubelet parts stored as index ranges into activity frame stores (annotation store of the dataset dir) """
+    rows = query_annotation_store(dataset_dir, "SELECT name FROM tubelets WHERE frames_dir IS NOT NULL", db_path)
+    return [x for x, in rows] if rows is not None else []
+
+def scan_tubelets(dataset_dir, db_path=None) :
+    """
+    names of all the tubelets in the dataset dir, i.e jpg dirs and mp4 files (without ext)
+    and the parts in the activity frame stores (part_storage -> manifest)
+    """
+    all_tubelets = list_manifest_parts(dataset_dir, db_path)
+    for x in os.listdir(dataset_dir) :
+        if x.startswith(".") : # crop store etc.
+            continue
+        if os.path.isdir(os.path.join(dataset_dir,x)) :
+            all_tubelets.append(x)
+        elif x.endswith(".mp4") :
+            all_tubelets.append(os.path.splitext(x)[0])
+    return all_tubelets
+
+def list_tubelets(dataset_dir, db_path=None) :
+    """
+    names of all the tubelets in the dataset dir, from the annotation store once it is synced with the dir
+    (the crop stage adds each tubelet with its integrity record), else by scanning the dir
+    """
+    if query_annotation_store(dataset_dir, "SELECT value FROM store_info WHERE key = 'synced'", db_path) :
+        return [x for x, in query_annotation_store(dataset_dir, "SELECT name FROM tubelets", db_path)]
+    return scan_tubelets(dataset_dir, db_path)
+
+def get_tubelet_length(dataset_dir, tubelet_name) :
+    """ no of frames in a tubelet (jpg dir or mp4) """
+    tubelet_dir = os.path.join(dataset_dir, tubelet_name)
+    if os.path.isdir(tubelet_dir) :
+        return len(os.listdir(tubelet_dir))
+    return get_video_info(F"{tubelet_dir}.mp4")["frame_count"]
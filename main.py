@@ -1,4 +1,5 @@
-from lib.act_tubelet_generator import ActTubeletGenerator
+import argparse
+from lib.act_tubelet_generator import ActTubeletGenerator, STAGES
 
 
 ATOMIC_ACTION_CLASSES = [
@@ -31,14 +32,31 @@ CONCURRENT_ACTION_CLASSES = [
     "Opening"
 ]
 
-def main(config_file) :
+def main(config_file, stage="all", datasets=None, videos=None, classes=None) :
     generator = ActTubeletGenerator(config_file)
-    generator.generate_dataset()
-    generator.get_train_test_split()
-    # generator.get_dataset_stats(CONCURRENT_ACTION_CLASSES,"concurrent_action")
+    if stage == "all" and (datasets is not None or videos is not None or classes is not None) :
+        # filtered run, the stages are run one by one with the filters (same stages as the full run)
+        for each_stage in [x for x in STAGES if x != "stats"] :
+            generator.run_stage(each_stage, datasets=datasets, videos=videos, classes=classes)
+    elif stage == "all" :
+        generator.generate_dataset()
+        generator.get_train_test_split()
+        # generator.get_dataset_stats(CONCURRENT_ACTION_CLASSES,"concurrent_action")
+    else :
+        generator.run_stage(stage, datasets=datasets, videos=videos, classes=classes)
 
 
+def parse_args() :
+    parser = argparse.ArgumentParser(description="generate the action centric tubelet dataset")
+    parser.add_argument("stage", nargs="?", default="all", choices=["all"] + STAGES,
+                        help="stage to run on the saved outputs of the earlier stages (default all the stages)")
+    parser.add_argument("--config", default="generator_config.json", help="generator config")
+    parser.add_argument("--datasets", nargs="+", default=None, help="datasets to process, or to compute the stats over (default datasets_to_consider)")
+    parser.add_argument("--videos", nargs="+", default=None, help="video names or glob patterns (extract, detect, crop)")
+    parser.add_argument("--classes", nargs="+", default=None, help="activity classes (extract, detect, crop, stats)")
+    return parser.parse_args()
+
 
 if __name__ == "__main__" :
-    config_file = "generator_config.json"
-    main(config_file)
\ No newline at end of file
+    args = parse_args()
+    main(args.config, args.stage, args.datasets, args.videos, args.classes)